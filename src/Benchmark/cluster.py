@@ -0,0 +1,149 @@
+import argparse
+import json
+import os
+import shlex
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Client.client import Client
+from Benchmark.serverModeBenchmark import startServer
+
+#无界面的本地集群：在localhost上以系统分配的端口启动路径服务器、锁服务器和N个文件服务器，供压测和回归测试使用
+#-- 每个文件服务器使用工作目录下独立的存储目录，集群停止时工作目录随之删除（keep=True时保留）
+#-- 路径服务器可以启动为多个分片（directories > 1），各分片的端口需要事先写入分区表，因此预先向系统申请空闲端口
+#-- 单独运行时启动集群并输出各服务器的端口，按Ctrl-C停止: python Benchmark/cluster.py --file-servers 3
+
+
+def freePorts(count):
+    '''
+    : 向系统申请若干个当前空闲的端口
+    '''
+    sockets = [socket.socket() for i in range(count)]
+    try:
+        for sock in sockets:
+            sock.bind(("127.0.0.1", 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+class LocalCluster():
+    '''
+    : 本地集群：路径服务器（一个或多个分片） + 锁服务器 + N个文件服务器
+    '''
+    def __init__(self, fileServers=3, directoryArgs=None, lockArgs=None, fileServerArgs=None, workdir=None, keep=False, directories=1):
+        '''
+        : fileServers: int,文件服务器数
+        : directoryArgs: list,路径服务器的额外命令行参数
+        : lockArgs: list,锁服务器的额外命令行参数
+        : fileServerArgs: list,文件服务器的额外命令行参数
+        : workdir: str,工作目录，为None时创建临时目录
+        : keep: bool,停止集群时是否保留工作目录
+        : directories: int,路径服务器分片数
+        '''
+        self.fileServerCount = fileServers
+        self.directoryCount = directories
+        self.directoryArgs = directoryArgs or []
+        self.lockArgs = lockArgs or []
+        self.fileServerArgs = fileServerArgs or []
+        self.workdir = workdir or tempfile.mkdtemp(prefix="mydfs-cluster-")
+        self.keep = keep
+        self.processes = []
+        self.directoryPort = None       #第一个路径服务器分片的端口，客户端和文件服务器从这里获得分区表
+        self.directoryPorts = []
+        self.lockPort = None
+        self.fileServerPorts = []
+        self.clients = []
+
+    def start(self):
+        '''
+        : 依次启动路径服务器、锁服务器和文件服务器；文件服务器在加入路径服务器之后才输出监听端口，因此返回时集群已经可用
+        : return -> LocalCluster
+        '''
+        try:
+            if self.directoryCount > 1:
+                shards = ",".join("127.0.0.1:%d" % port for port in freePorts(self.directoryCount))
+                shardArgs = [["--shards", shards, "--shard-index", str(i)] for i in range(self.directoryCount)]
+            else:
+                shardArgs = [["--port", "0"]]
+            for i, extra in enumerate(shardArgs):
+                directory, port = startServer("directoryServer.py", extra + ["--metadata-dir", os.path.join(self.workdir, "DirectoryMetadata%d" % i)]
+                                              + self.directoryArgs, self.workdir)
+                self.processes.append(directory)
+                self.directoryPorts.append(port)
+            self.directoryPort = self.directoryPorts[0]
+            lock, self.lockPort = startServer("lockingServer.py", ["--port", "0"] + self.lockArgs, self.workdir)
+            self.processes.append(lock)
+            for i in range(self.fileServerCount):
+                fileServer, port = startServer("fileServer.py", ["--port", "0", "--master-port", str(self.directoryPort), "--lock-port", str(self.lockPort),
+                                                                 "--bucket", os.path.join(self.workdir, "bucket%d" % i)] + self.fileServerArgs, self.workdir)
+                self.processes.append(fileServer)
+                self.fileServerPorts.append(port)
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def client(self, **kwargs):
+        '''
+        : 创建连接到本集群的客户端，集群停止时自动关闭
+        : kwargs: 传给Client的其他参数（例如cacheBytes）
+        : return -> Client
+        '''
+        client = Client("127.0.0.1", self.directoryPort, "127.0.0.1", self.lockPort, **kwargs)
+        self.clients.append(client)
+        return client
+
+    def ports(self):
+        return {"directory": self.directoryPort, "directories": list(self.directoryPorts), "lock": self.lockPort, "fileServers": list(self.fileServerPorts)}
+
+    def stop(self):
+        '''
+        : 关闭全部客户端并停止全部服务器
+        '''
+        for client in self.clients:
+            client.shutdown()
+        self.clients = []
+        for process in self.processes:
+            process.kill()
+        for process in self.processes:
+            process.wait()
+        self.processes = []
+        if not self.keep:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="start a headless local myDFS cluster")
+    parser.add_argument("--file-servers", type=int, default=3, help="文件服务器数")
+    parser.add_argument("--directories", type=int, default=1, help="路径服务器分片数")
+    parser.add_argument("--directory-args", default="", help="路径服务器的额外命令行参数")
+    parser.add_argument("--lock-args", default="", help="锁服务器的额外命令行参数")
+    parser.add_argument("--file-server-args", default="", help="文件服务器的额外命令行参数")
+    parser.add_argument("--workdir", default=None, help="工作目录，默认为新建的临时目录，停止时保留")
+    args = parser.parse_args()
+
+    cluster = LocalCluster(args.file_servers, shlex.split(args.directory_args), shlex.split(args.lock_args),
+                           shlex.split(args.file_server_args), args.workdir, keep=True, directories=args.directories)
+    with cluster:
+        print(json.dumps(dict(cluster.ports(), workdir=cluster.workdir)), flush=True)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
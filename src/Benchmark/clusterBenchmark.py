@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import random
+import shlex
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Benchmark.cluster import LocalCluster
+
+#通过Client对本地集群运行典型负载，输出每种操作的吞吐量和延迟分位数（JSON），用于发现性能回退
+#-- 每个负载由--clients个线程同时运行，每个线程使用独立的Client，持续--duration秒
+#-- read-heavy / write-heavy: 在一组预先写入的文件上按9:1 / 1:9的比例随机读写
+#-- small-files: 不断写入新的小文件，每写满一批用readMany批量读回
+#-- big-files: 反复写入并读回大文件（超过路径服务器的条带阈值时切分为条带）
+#-- lock-contention: 所有线程在少数几个文件上阻塞等待排他锁并立即释放
+#-- 用法: python Benchmark/clusterBenchmark.py --file-servers 3 --clients 4 --duration 5
+
+WORKLOADS = ("read-heavy", "write-heavy", "small-files", "big-files", "lock-contention")
+SMALL_BATCH = 32       #small-files负载中每批写入后用readMany读回的文件数
+
+
+class Recorder():
+    '''
+    : 线程安全的操作延迟记录器
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.bytes = {}
+
+    def record(self, op, elapsed, ok, size=0):
+        with self.lock:
+            if ok:
+                self.latencies.setdefault(op, []).append(elapsed)
+                self.bytes[op] = self.bytes.get(op, 0) + size
+            else:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def timed(self, op, func, *args, size=0, **kwargs):
+        '''
+        : 调用func并记录其延迟；返回值不是响应报文（例如文件被锁定时write返回的提示字符串）或抛出异常时记为失败
+        : return -> func的返回值，失败时为None
+        '''
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            result = None
+        elapsed = time.perf_counter() - start
+        self.record(op, elapsed, isinstance(result, dict), size)
+        return result
+
+    def summary(self, elapsed):
+        '''
+        : return -> dict,操作 -> 次数、失败次数、每秒操作数、p50/p99/p999延迟（毫秒），有数据传输的操作另有MB/s
+        '''
+        def percentile(values, q):
+            return round(values[min(int(len(values) * q), len(values) - 1)] * 1000, 3) if values else None
+
+        ops = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(op, []))
+            ops[op] = {
+                "count": len(values),
+                "errors": self.errors.get(op, 0),
+                "opsPerSec": round(len(values) / elapsed, 1),
+                "p50ms": percentile(values, 0.5),
+                "p99ms": percentile(values, 0.99),
+                "p999ms": percentile(values, 0.999),
+            }
+            if self.bytes.get(op):
+                ops[op]['MBps'] = round(self.bytes[op] / elapsed / 1e6, 1)
+        return ops
+
+
+def mixedWorker(client, index, args, recorder, deadline, prefix, readRatio, payload):
+    rng = random.Random(args.seed + index)
+    while time.perf_counter() < deadline:
+        docname = "%s-%d" % (prefix, rng.randrange(args.files))
+        if rng.random() < readRatio:
+            recorder.timed("read", client.read, docname, size=len(payload))
+        else:
+            recorder.timed("write", client.write, docname, payload, size=len(payload))
+
+
+def smallFilesWorker(client, index, args, recorder, deadline, payload):
+    count = 0
+    while time.perf_counter() < deadline:
+        batch = []
+        for i in range(SMALL_BATCH):
+            docname = "small-%d-%d" % (index, count)
+            count += 1
+            recorder.timed("write", client.write, docname, payload, size=len(payload))
+            batch.append(docname)
+        recorder.timed("readmany", client.readMany, batch, size=len(payload) * len(batch))
+
+
+def bigFilesWorker(client, index, args, recorder, deadline, payload):
+    docname = "big-%d" % index
+    while time.perf_counter() < deadline:
+        recorder.timed("write", client.write, docname, payload, size=len(payload))
+        recorder.timed("read", client.read, docname, size=len(payload))
+
+
+def lockWorker(client, index, args, recorder, deadline):
+    rng = random.Random(args.seed + index)
+    while time.perf_counter() < deadline:
+        docname = "hot-%d" % rng.randrange(args.hot_locks)
+        response = recorder.timed("obtainlock", client.obtainLock, docname, wait=args.lock_wait)
+        if response is not None and response.get('lockid') is not None:
+            recorder.timed("releaselock", client.releaseLock, docname, response['lockid'])
+
+
+def runWorkload(cluster, name, args):
+    '''
+    : 运行一个负载
+    : return -> dict,负载的参数和各操作的统计结果
+    '''
+    clients = [cluster.client(cacheBytes=args.client_cache) for i in range(args.clients)]
+    recorder = Recorder()
+
+    #1. 准备数据：读写负载需要预先写入的文件
+    if name in ("read-heavy", "write-heavy"):
+        payload = os.urandom(args.file_size)
+        prefix = name
+        for i in range(args.files):
+            clients[0].write("%s-%d" % (prefix, i), payload)
+        readRatio = 0.9 if name == "read-heavy" else 0.1
+        target, extra = mixedWorker, (prefix, readRatio, payload)
+    elif name == "small-files":
+        target, extra = smallFilesWorker, (os.urandom(args.small_size),)
+    elif name == "big-files":
+        target, extra = bigFilesWorker, (os.urandom(args.big_size),)
+    else:
+        target, extra = lockWorker, ()
+
+    #2. 各线程同时运行到截止时间
+    start = time.perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=target, args=(client, index, args, recorder, deadline) + extra) for index, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for client in clients:
+        client.shutdown()
+        cluster.clients.remove(client)
+    return {"clients": args.clients, "elapsed": round(elapsed, 3), "ops": recorder.summary(elapsed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="myDFS local cluster workload benchmark")
+    parser.add_argument("--file-servers", type=int, default=3, help="文件服务器数")
+    parser.add_argument("--directories", type=int, default=1, help="路径服务器分片数")
+    parser.add_argument("--clients", type=int, default=4, help="每个负载的并发客户端（线程）数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每个负载的持续时间（秒）")
+    parser.add_argument("--workloads", nargs="+", choices=WORKLOADS, default=list(WORKLOADS), help="要运行的负载")
+    parser.add_argument("--files", type=int, default=64, help="read-heavy/write-heavy负载的文件数")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="read-heavy/write-heavy负载的文件大小（字节）")
+    parser.add_argument("--small-size", type=int, default=1024, help="small-files负载的文件大小（字节）")
+    parser.add_argument("--big-size", type=int, default=64 * 1024 * 1024, help="big-files负载的文件大小（字节）")
+    parser.add_argument("--hot-locks", type=int, default=4, help="lock-contention负载中被争用的文件数")
+    parser.add_argument("--lock-wait", type=float, default=10.0, help="lock-contention负载中等待锁的时限（秒）")
+    parser.add_argument("--client-cache", type=int, default=0, help="客户端文件缓存的容量（字节），默认不缓存，使读请求都到达文件服务器")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--directory-args", default="", help="路径服务器的额外命令行参数，例如\"--replicas 2\"")
+    parser.add_argument("--lock-args", default="", help="锁服务器的额外命令行参数")
+    parser.add_argument("--file-server-args", default="", help="文件服务器的额外命令行参数，例如\"--mode asyncio\"")
+    args = parser.parse_args()
+
+    results = {}
+    with LocalCluster(args.file_servers, shlex.split(args.directory_args), shlex.split(args.lock_args), shlex.split(args.file_server_args),
+                      directories=args.directories) as cluster:
+        for name in args.workloads:
+            results[name] = runWorkload(cluster, name, args)
+
+    config = {key: value for key, value in vars(args).items() if key != "workloads"}
+    print(json.dumps({"config": config, "workloads": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Common import protocol
+from Benchmark.serverModeBenchmark import startServer
+
+#数据块压缩的吞吐量和压缩率
+#-- 第一部分在进程内测试各压缩算法和级别：按CHUNK_SIZE分块压缩、解压样本数据，得到压缩/解压速度和压缩率
+#-- 第二部分通过真实的文件服务器读取样本文件，比较不压缩、实时压缩和发送压缩副本（--compressed-copies）三种情况下的读取速度和实际传输的字节数
+#-- 样本数据: text（日志文本）、json（JSON记录）、source（本仓库的Python源代码）、random（随机数据，不可压缩）
+#-- 用法: python Benchmark/compressionBenchmark.py --size 8388608 --reads 5
+
+CODEC_LEVELS = [("zlib", 1), ("zlib", 6), ("zlib", 9), ("lzma", 0), ("lzma", 1), ("lzma", 6)]
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def sampleCorpora(size):
+    '''
+    : 生成样本数据，每种样本的长度为size字节
+    : return -> dict,样本名 -> bytes
+    '''
+    def repeat(data):
+        return (data * (size // max(len(data), 1) + 1))[:size]
+
+    text = b"".join(b"2024-01-01 12:%02d:%02d INFO request %d served in %d ms from node-%d\n" % (i // 60 % 60, i % 60, i, i * 7 % 300, i % 5)
+                    for i in range(size // 50 + 1))
+    records = b"".join(json.dumps({"id": i, "name": "file-%d" % i, "size": i * 4096 % 1000003, "replicas": [i % 3, (i + 1) % 3]}).encode("utf-8") + b"\n"
+                       for i in range(size // 70 + 1))
+    sources = []
+    for root, dirs, files in os.walk(SOURCE_DIRECTORY):
+        for name in sorted(files):
+            if name.endswith(".py"):
+                with open(os.path.join(root, name), "rb") as sourceFile:
+                    sources.append(sourceFile.read())
+    return {"text": text[:size], "json": records[:size], "source": repeat(b"".join(sources)), "random": os.urandom(size)}
+
+
+def codecThroughput(data, codec, level):
+    '''
+    : 进程内按CHUNK_SIZE分块压缩、解压样本数据
+    : return -> dict,压缩/解压速度（MB/s）和压缩率（压缩后长度/原始长度）
+    '''
+    compressor = protocol.Compressor(codec, level)
+    view = memoryview(data)
+    start = time.perf_counter()
+    frames = [compressor.frame(view[pos:pos+protocol.CHUNK_SIZE]) for pos in range(0, len(data), protocol.CHUNK_SIZE)]
+    compressTime = time.perf_counter() - start
+    start = time.perf_counter()
+    for flags, chunk in frames:
+        protocol.decompressChunk(flags, chunk)
+    decompressTime = time.perf_counter() - start
+    return {
+        "compressMBps": round(len(data) / compressTime / 1e6, 1),
+        "decompressMBps": round(len(data) / decompressTime / 1e6, 1),
+        "ratio": round(compressor.wireBytes / len(data), 4),
+    }
+
+
+def readOnce(conn, docname, codec):
+    '''
+    : 通过文件服务器完整读取一个文件
+    : return -> (文件长度, 实际传输的数据块字节数)
+    '''
+    conn.send({"request": "read", "docname": docname, "offset": 0, "length": -1, "compression": [codec] if codec else None})
+    response = conn.recv()
+    remaining = response['length']
+    wire = 0
+    while remaining > 0:
+        codec, flags, body = protocol.readFrame(conn.rfile)
+        wire += len(body)
+        remaining -= len(protocol.decompressChunk(flags, body))
+    return response['length'], wire
+
+
+def readThroughput(port, docname, codec, reads):
+    '''
+    : 反复读取同一个文件，第一次读取（可能需要生成压缩副本）单独计时
+    : return -> dict
+    '''
+    conn = protocol.connect("127.0.0.1", port)
+    try:
+        start = time.perf_counter()
+        size, wire = readOnce(conn, docname, codec)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(reads):
+            readOnce(conn, docname, codec)
+        elapsed = time.perf_counter() - start
+    finally:
+        conn.close()
+    return {
+        "firstReadMs": round(first * 1000, 2),
+        "readMBps": round(size * reads / elapsed / 1e6, 1),
+        "wireRatio": round(wire / size, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chunk compression throughput and ratio")
+    parser.add_argument("--size", type=int, default=8 * 1024 * 1024, help="每种样本数据的长度（字节）")
+    parser.add_argument("--reads", type=int, default=5, help="第二部分中每种情况重复读取的次数")
+    args = parser.parse_args()
+
+    corpora = sampleCorpora(args.size)
+
+    #1. 进程内的压缩/解压速度和压缩率
+    codecs = {}
+    for name, data in corpora.items():
+        codecs[name] = {"%s-%d" % (codec, level): codecThroughput(data, codec, level) for codec, level in CODEC_LEVELS}
+
+    #2. 通过文件服务器读取
+    workdir = tempfile.mkdtemp(prefix="mydfs-compressbench-")
+    bucket = os.path.join(workdir, "FileServerBucket")
+    os.makedirs(bucket)
+    for name, data in corpora.items():
+        with open(os.path.join(bucket, name), "wb") as sampleFile:
+            sampleFile.write(data)
+
+    directory, directoryPort = startServer("directoryServer.py", ["--port", "0", "--metadata-dir", ""], workdir)
+    reads = {}
+    try:
+        for copies in (False, True):
+            fileServer, filePort = startServer("fileServer.py", ["--port", "0", "--master-port", str(directoryPort), "--bucket", bucket]
+                                               + (["--compressed-copies"] if copies else []), workdir)
+            try:
+                for codec in (["zlib", "lzma"] if copies else [None, "zlib", "lzma"]):
+                    label = (codec or "none") + ("-copies" if copies else "")
+                    reads[label] = {name: readThroughput(filePort, name, codec, args.reads) for name in corpora}
+            finally:
+                fileServer.kill()
+    finally:
+        directory.kill()
+
+    print(json.dumps({"size": args.size, "chunkSize": protocol.CHUNK_SIZE, "codecs": codecs, "reads": reads}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import shlex
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Benchmark.cluster import LocalCluster
+from Server.durability import MODES, GROUP_WINDOW
+
+#测量文件服务器在各种持久化方式（--durability none/fsync/group）下的小文件写入吞吐量和延迟
+#-- 对每种方式分别启动只有一个文件服务器的本地集群，由--clients个线程（各自使用独立的Client）持续--duration秒覆盖写入小文件，
+#-- 输出每秒写入数、延迟分位数，以及文件服务器的刷盘请求数和刷盘轮数（组提交时同一组的写入由组长一并刷盘）
+#-- 用法: python Benchmark/durabilityBenchmark.py --modes none fsync group --clients 16 --duration 5
+
+
+def measure(mode, args):
+    '''
+    : 在--durability mode的文件服务器上运行一次写入负载
+    : return -> dict
+    '''
+    fileServerArgs = ["--durability", mode, "--group-commit-window", str(args.window)] + shlex.split(args.file_server_args)
+    with LocalCluster(1, directoryArgs=["--metadata-dir", ""], fileServerArgs=fileServerArgs) as cluster:
+        clients = [cluster.client(cacheBytes=0) for i in range(args.clients)]
+        payload = os.urandom(args.size)
+        latencies = [[] for client in clients]
+        errors = [0]
+        start = time.perf_counter()
+        deadline = start + args.duration
+
+        def worker(index):
+            client = clients[index]
+            i = 0
+            while time.perf_counter() < deadline:
+                began = time.perf_counter()
+                response = client.write("durability-%d-%d" % (index, i % args.files), payload)
+                latencies[index].append(time.perf_counter() - began)
+                if not isinstance(response, dict) or response.get('response') != "write":
+                    errors[0] += 1
+                i += 1
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        gauges = clients[0].pool.call("127.0.0.1", cluster.fileServerPorts[0], {"request": "stats"})['metrics']['gauges']
+
+    values = sorted(latency for thread in latencies for latency in thread)
+    return {
+        "durability": mode,
+        "writes": len(values),
+        "errors": errors[0],
+        "writesPerSec": round(len(values) / elapsed, 1),
+        "p50ms": round(values[len(values) // 2] * 1000, 3) if values else None,
+        "p99ms": round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 3) if values else None,
+        "syncs": gauges.get('durability_syncs'),
+        "flushes": gauges.get('durability_flushes'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="myDFS write throughput under each durability mode")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES), help="依次测试的持久化方式")
+    parser.add_argument("--clients", type=int, default=16, help="并发写入的客户端（线程）数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每种方式的测试时间（秒）")
+    parser.add_argument("--files", type=int, default=16, help="每个客户端轮流覆盖写入的文件数")
+    parser.add_argument("--size", type=int, default=4096, help="每次写入的字节数")
+    parser.add_argument("--window", type=float, default=GROUP_WINDOW, help="组提交的时间窗口（秒）")
+    parser.add_argument("--file-server-args", default="", help="文件服务器的额外命令行参数，例如\"--mode asyncio\"")
+    args = parser.parse_args()
+
+    runs = [measure(mode, args) for mode in args.modes]
+    config = {key: value for key, value in vars(args).items() if key != "modes"}
+    print(json.dumps({"config": config, "runs": runs}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
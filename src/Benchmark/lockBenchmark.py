@@ -0,0 +1,107 @@
+import asyncio
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Common import protocol
+from Benchmark.serverModeBenchmark import startServer, readFrame
+
+#锁服务器吞吐量随处理线程数的变化
+#-- 锁服务器以多线程模式运行，每个连接由一个处理线程服务，因此并发连接数即为处理线程数
+#-- 每个连接反复发送obtainlock + releaselock：independent负载中每个连接锁定不同的文件，shared负载中所有连接对同一个文件加共享锁
+#-- 分别测试分片锁表（--lock-shards）与单个全局互斥锁（分片数为1）
+#-- 压测客户端分布在多个进程中，避免客户端本身成为瓶颈
+#-- 用法: python Benchmark/lockBenchmark.py --threads 1 2 4 8 16 32 --duration 3
+
+WORKLOADS = ("independent", "shared")
+
+
+async def lockWorker(port, workload, index, deadline, latencies):
+    '''
+    : 单个连接：在截止时间之前反复加锁、解锁
+    '''
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    if workload == "independent":
+        docname, mode = "bench-%d" % index, "exclusive"
+    else:
+        docname, mode = "bench-shared", "shared"
+    clientid = "bench-%d" % index
+    frames = [b"".join(bytes(part) for part in protocol.encodeFrame(message)) for message in (
+        {"request": "obtainlock", "docname": docname, "clientid": clientid, "mode": mode},
+        {"request": "releaselock", "docname": docname, "clientid": clientid},
+    )]
+    while time.perf_counter() < deadline:
+        for frame in frames:
+            start = time.perf_counter()
+            writer.write(frame)
+            await writer.drain()
+            await readFrame(reader)
+            latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+def clientProcess(port, workload, indexes, duration, results):
+    async def run():
+        latencies = []
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*[lockWorker(port, workload, index, deadline, latencies) for index in indexes])
+        return latencies
+    results.put(asyncio.run(run()))
+
+
+def runLoad(port, workload, threads, processes, duration):
+    '''
+    : 用threads个并发连接压测锁服务器
+    : return -> dict,吞吐量和延迟分位数
+    '''
+    processes = max(1, min(processes, threads))
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=clientProcess, args=(port, workload, range(i, threads, processes), duration, results))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    latencies = []
+    for worker in workers:
+        latencies.extend(results.get())
+    for worker in workers:
+        worker.join()
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "opsPerSec": round(len(latencies) / duration, 1),
+        "p50ms": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+        "p99ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="locking server throughput vs handler threads")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32], help="并发连接数（即处理线程数）")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 64], help="要比较的锁表分片数")
+    parser.add_argument("--duration", type=float, default=3.0, help="每项测试的持续时间（秒）")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="压测客户端的进程数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="mydfs-lockbench-")
+    results = {}
+    for shards in args.shards:
+        server, port = startServer("lockingServer.py", ["--port", "0", "--lock-shards", str(shards)], workdir)
+        try:
+            results[str(shards)] = {
+                workload: {str(threads): runLoad(port, workload, threads, args.processes, args.duration) for threads in args.threads}
+                for workload in WORKLOADS
+            }
+        finally:
+            server.kill()
+
+    print(json.dumps({"duration": args.duration, "cpus": os.cpu_count(), "clientProcesses": args.processes,
+                      "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
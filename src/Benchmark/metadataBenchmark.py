@@ -0,0 +1,105 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Benchmark.cluster import LocalCluster
+from Client.client import Client
+
+#测量元数据请求的吞吐量随路径服务器分片数的变化
+#-- 对每个分片数分别启动本地集群，预先写入--files个小文件，然后由--processes个客户端进程（每个进程--threads个线程）
+#-- 持续发送open（单个文件）和lookup（--batch个文件）请求，输出每秒完成的元数据请求数以及相对于第一个分片数的加速比
+#-- 客户端使用多个进程，避免客户端自身的GIL成为瓶颈；分片数较多时需要足够的CPU核心才能观察到吞吐量的增长
+#-- 用法: python Benchmark/metadataBenchmark.py --directories 1 2 4 --processes 4 --threads 4 --duration 5
+
+
+def clientProcess(directoryPort, lockPort, args, index, start, results):
+    '''
+    : 客户端进程：各线程使用独立的Client，在start时刻同时开始，持续args.duration秒
+    '''
+    counts = []
+
+    def worker(thread):
+        client = Client("127.0.0.1", directoryPort, "127.0.0.1", lockPort, cacheBytes=0)
+        client.partitions()
+        rng = random.Random(args.seed + index * 1000 + thread)
+        opens = lookups = errors = 0
+        time.sleep(max(start - time.time(), 0))
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            if rng.random() < args.lookup_ratio:
+                files = client.lookup(["meta-%d" % rng.randrange(args.files) for i in range(args.batch)])
+                lookups += 1
+                errors += sum(1 for fileinfo in files.values() if fileinfo is None)
+            else:
+                response = client.open("meta-%d" % rng.randrange(args.files))
+                opens += 1
+                errors += response['response'] != "open-exists"
+        client.shutdown()
+        counts.append((opens, lookups, errors))
+
+    threads = [threading.Thread(target=worker, args=(thread,)) for thread in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(tuple(sum(column) for column in zip(*counts)))
+
+
+def measure(directories, args):
+    '''
+    : 在有directories个路径服务器分片的本地集群上运行一次负载
+    : return -> dict
+    '''
+    with LocalCluster(1, directoryArgs=["--metadata-dir", ""], directories=directories) as cluster:
+        client = cluster.client()
+        for i in range(args.files):
+            client.write("meta-%d" % i, b"x")
+
+        results = multiprocessing.Queue()
+        start = time.time() + 1.0      #留出各进程建立连接的时间
+        processes = [multiprocessing.Process(target=clientProcess, args=(cluster.directoryPort, cluster.lockPort, args, index, start, results))
+                     for index in range(args.processes)]
+        for process in processes:
+            process.start()
+        totals = [results.get() for process in processes]
+        for process in processes:
+            process.join()
+
+    opens, lookups, errors = (sum(column) for column in zip(*totals))
+    return {
+        "directories": directories,
+        "opens": opens,
+        "lookups": lookups,
+        "errors": errors,
+        "opsPerSec": round((opens + lookups) / args.duration, 1),
+        "docnamesPerSec": round((opens + lookups * args.batch) / args.duration, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="myDFS metadata throughput vs. number of directory shards")
+    parser.add_argument("--directories", type=int, nargs="+", default=[1, 2, 4], help="依次测试的路径服务器分片数")
+    parser.add_argument("--processes", type=int, default=4, help="客户端进程数")
+    parser.add_argument("--threads", type=int, default=4, help="每个客户端进程的线程数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每次测试的持续时间（秒）")
+    parser.add_argument("--files", type=int, default=1000, help="预先写入的文件数")
+    parser.add_argument("--lookup-ratio", type=float, default=0.2, help="lookup请求占全部请求的比例，其余为open请求")
+    parser.add_argument("--batch", type=int, default=8, help="每个lookup请求包含的文件数")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    args = parser.parse_args()
+
+    runs = [measure(directories, args) for directories in args.directories]
+    for run in runs:
+        run['speedup'] = round(run['opsPerSec'] / runs[0]['opsPerSec'], 2) if runs[0]['opsPerSec'] else None
+    config = {key: value for key, value in vars(args).items() if key != "directories"}
+    print(json.dumps({"config": config, "runs": runs, "cpus": os.cpu_count()}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
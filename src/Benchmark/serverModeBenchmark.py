@@ -0,0 +1,138 @@
+import asyncio
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Common import protocol
+
+#比较多线程模式（socketserver.ThreadingMixIn）与asyncio事件循环模式的服务器吞吐量
+#-- 对锁服务器发送checklock请求（纯内存操作），对文件服务器发送read请求（磁盘I/O + sendfile）
+#-- 压测客户端本身使用asyncio实现，因此可以用少量线程模拟成千上万个并发连接
+#-- 用法: python Benchmark/serverModeBenchmark.py --connections 1000 --requests 20
+
+SERVER_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server")
+
+
+def startServer(script, args, cwd):
+    '''
+    : 以子进程方式启动服务器，并从其输出中解析实际监听的端口
+    : return -> (子进程, 端口)
+    '''
+    process = subprocess.Popen([sys.executable, "-u", os.path.join(SERVER_DIRECTORY, script)] + args,
+                               cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    while True:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError(script + " 启动失败")
+        match = re.search(r"is listening on [\d.]+:(\d+)", line)
+        if match:
+            #之后的输出不再读取，转发到/dev/null以免管道写满阻塞服务器
+            subprocess.Popen(["cat"], stdin=process.stdout, stdout=subprocess.DEVNULL)
+            return process, int(match.group(1))
+
+
+def threadCount(pid):
+    '''
+    : 读取进程当前的线程数
+    '''
+    with open("/proc/%d/status" % pid) as status:
+        return int(re.search(r"Threads:\s+(\d+)", status.read()).group(1))
+
+
+async def readFrame(reader):
+    header = await reader.readexactly(protocol.HEADER.size)
+    codec, flags, size = protocol.HEADER.unpack(header)
+    return codec, await reader.readexactly(size)
+
+
+async def worker(port, message, requests, latencies):
+    '''
+    : 单个并发连接：在同一连接上依次发送requests个请求
+    '''
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    frame = b"".join(bytes(part) for part in protocol.encodeFrame(message))
+    for i in range(requests):
+        start = time.perf_counter()
+        writer.write(frame)
+        await writer.drain()
+        codec, body = await readFrame(reader)
+        response = protocol.decodeBody(codec, body)
+        remaining = response.get('length', 0) if response['response'] == "read" else 0
+        while remaining > 0:
+            codec, chunk = await readFrame(reader)
+            remaining -= len(chunk)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def sampleThreads(pid, peak, done):
+    while not done.is_set():
+        peak[0] = max(peak[0], threadCount(pid))
+        await asyncio.sleep(0.01)
+
+
+async def runLoad(port, message, connections, requests, pid):
+    latencies = []
+    peak = [0]
+    done = asyncio.Event()
+    sampler = asyncio.ensure_future(sampleThreads(pid, peak, done))
+    start = time.perf_counter()
+    results = await asyncio.gather(*[worker(port, message, requests, latencies) for i in range(connections)], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await sampler
+    failed = sum(1 for result in results if isinstance(result, Exception))
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "failedConnections": failed,
+        "opsPerSec": round(len(latencies) / elapsed, 1),
+        "p50ms": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+        "p99ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3) if latencies else None,
+        "peakServerThreads": peak[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="threaded vs asyncio server benchmark")
+    parser.add_argument("--connections", type=int, default=500, help="并发连接数")
+    parser.add_argument("--requests", type=int, default=20, help="每个连接发送的请求数")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="read测试使用的文件大小")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="mydfs-bench-")
+    os.makedirs(os.path.join(workdir, "FileServerBucket"))
+    with open(os.path.join(workdir, "FileServerBucket", "bench.bin"), "wb") as f:
+        f.write(os.urandom(args.file_size))
+
+    directory, directoryPort = startServer("directoryServer.py", ["--port", "0"], workdir)
+    results = {}
+    try:
+        for mode in ("threaded", "asyncio"):
+            lock, lockPort = startServer("lockingServer.py", ["--port", "0", "--mode", mode], workdir)
+            fileServer, filePort = startServer("fileServer.py", ["--mode", mode, "--master-port", str(directoryPort)], workdir)
+            try:
+                results[mode] = {
+                    "checklock": asyncio.run(runLoad(lockPort, {"request": "checklock", "docname": "bench.bin", "clientid": "bench"},
+                                                     args.connections, args.requests, lock.pid)),
+                    "read": asyncio.run(runLoad(filePort, {"request": "read", "docname": "bench.bin"},
+                                                args.connections, args.requests, fileServer.pid)),
+                }
+            finally:
+                lock.kill()
+                fileServer.kill()
+    finally:
+        directory.kill()
+
+    print(json.dumps({"connections": args.connections, "requestsPerConnection": args.requests,
+                      "fileSize": args.file_size, "results": results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import shlex
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Benchmark.cluster import LocalCluster
+
+#比较普通写入（锁服务器checklock -> 路径服务器write -> 文件服务器write，三次串行的客户端往返）与融合写入（只向文件服务器发送一个fusedwrite请求）的小文件写入延迟
+#-- 本地集群中各进程之间的往返时间很短，融合写入节省的是客户端到集群的往返：--client-rtt指定模拟的客户端往返时间（毫秒），
+#-- 客户端每发出一个请求先等待这么长的时间，服务器之间的请求不受影响；同时输出每次写入客户端发出的请求数
+#-- 用法: python Benchmark/writePathBenchmark.py --file-servers 3 --client-rtt 0 1 5 --writes 500
+
+
+def delayRequests(client, rtt):
+    '''
+    : 使客户端的每个请求多花费rtt秒，模拟客户端与集群之间的网络往返；返回请求计数器
+    '''
+    counter = {"requests": 0}
+    submit = client.pool.submit
+
+    def delayedSubmit(*args, **kwargs):
+        counter['requests'] += 1
+        if rtt:
+            time.sleep(rtt)
+        return submit(*args, **kwargs)
+
+    client.pool.submit = delayedSubmit
+    return counter
+
+
+def measure(cluster, fused, rtt, args):
+    '''
+    : 由一个客户端依次写入args.writes次args.size字节的小文件（在args.files个文件上轮流覆盖）
+    : return -> dict
+    '''
+    client = cluster.client(cacheBytes=0, fusedWrites=fused)
+    payload = os.urandom(args.size)
+    for i in range(args.files):
+        client.write("write-path-%d" % i, payload)      #预热：建立连接并记住各文件的位置
+    counter = delayRequests(client, rtt / 1000)
+
+    latencies = []
+    errors = 0
+    for i in range(args.writes):
+        start = time.perf_counter()
+        response = client.write("write-path-%d" % (i % args.files), payload)
+        latencies.append(time.perf_counter() - start)
+        errors += not isinstance(response, dict) or response.get('response') != "write"
+    latencies.sort()
+    return {
+        "mode": "fused" if fused else "classic",
+        "clientRttMs": rtt,
+        "writes": args.writes,
+        "errors": errors,
+        "requestsPerWrite": round(counter['requests'] / args.writes, 2),
+        "meanMs": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50Ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99Ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="myDFS small-write latency: classic vs. fused write path")
+    parser.add_argument("--file-servers", type=int, default=3, help="文件服务器数")
+    parser.add_argument("--directories", type=int, default=1, help="路径服务器分片数")
+    parser.add_argument("--client-rtt", type=float, nargs="+", default=[0, 1, 5], help="依次测试的模拟客户端往返时间（毫秒）")
+    parser.add_argument("--writes", type=int, default=500, help="每次测试的写入次数")
+    parser.add_argument("--files", type=int, default=32, help="轮流覆盖写入的文件数")
+    parser.add_argument("--size", type=int, default=1024, help="每次写入的字节数")
+    parser.add_argument("--directory-args", default="--metadata-dir ''", help="路径服务器的额外命令行参数")
+    parser.add_argument("--file-server-args", default="", help="文件服务器的额外命令行参数，例如\"--mode asyncio\"")
+    args = parser.parse_args()
+
+    runs = []
+    with LocalCluster(args.file_servers, shlex.split(args.directory_args), fileServerArgs=shlex.split(args.file_server_args), directories=args.directories) as cluster:
+        for rtt in args.client_rtt:
+            classic = measure(cluster, False, rtt, args)
+            fused = measure(cluster, True, rtt, args)
+            fused['speedup'] = round(classic['meanMs'] / fused['meanMs'], 2) if fused['meanMs'] else None
+            runs.extend([classic, fused])
+    config = {key: value for key, value in vars(args).items() if key != "client_rtt"}
+    print(json.dumps({"config": config, "runs": runs}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,90 @@
 import socket
 import sys
-import json
+import os
 import time
 import argparse
 import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Common import protocol
+from Common.channel import ConnectionPool
+from Common.hashRing import HashRing
+from Common.partitionMap import PartitionMap
+from Common import delta
+from Client.fileCache import FileCache, DEFAULT_MEMORY_BYTES, DEFAULT_SPILL_BYTES
+from Client.writeBuffer import WriteBuffer
+from Client.leases import CallbackLeases
 
 DIRECTORY_SERVER_ADDRESS = "127.0.0.1"
 DIRECTORY_SERVER_PORT = 8080
 LOCK_SERVER_ADDRESS = "127.0.0.1"
 LOCK_SERVER_PORT = 8888
 
+LATENCY_SMOOTHING = 0.2      #副本响应时间的指数移动平均系数
+MIN_LATENCY = 0.0001         #估计副本响应时间的下限（秒），尚未测量过的副本按此值估计
+STRIPE_WORKERS = 8           #并发读写条带的线程数
+LOCK_WAIT_MARGIN = 5         #阻塞等待锁时，客户端在服务器端的等待时限之外额外等待的时间（秒），用于容忍网络延迟
+WRITE_BACK_DELAY = 0.5       #写回模式下，缓冲的写入最多延迟多少秒写入文件服务器
+WRITE_BACK_BYTES = 8 * 1024 * 1024    #写回模式下，单个文件缓冲的数据达到此长度时立即写回；不小于此长度的单次写入不缓冲
+LEASE_MARGIN = 2             #写回模式下，缓冲的写入在锁的租期到期前至少这么多秒写回
+MAX_REDIRECTS = 3            #一次元数据请求最多跟随多少次路径服务器分片的wrong-shard响应
+PLACEMENT_CACHE = 65536      #融合写入时记住的文件主副本位置的数量上限，超过时全部清空
+
 class Client():
-    def __init__(self, directoryAddress, directoryPort, lockAddress, lockPort):
+    def __init__(self, directoryAddress, directoryPort, lockAddress, lockPort, cacheBytes=DEFAULT_MEMORY_BYTES, cacheSpillDirectory=None, cacheSpillBytes=DEFAULT_SPILL_BYTES,
+                 compression=None, compressionLevel=None, compressionThreshold=protocol.COMPRESSION_THRESHOLD,
+                 writeBack=False, writeBackDelay=WRITE_BACK_DELAY, writeBackBytes=WRITE_BACK_BYTES, deltaThreshold=None, callbacks=False,
+                 fusedWrites=False):
         '''
         : 初始化分布式文件系统客户端
-        : directoryAddress: str,文件服务器IP地址
+        : directoryAddress: str,文件服务器IP地址；路径服务器分为多个分片时为其中任意一个分片
         : directoryPort: str,文件服务器端口
         : lockAddress: str,锁定服务IP地址
         : lockPort: str,锁定服务端口
+        : cacheBytes: int,客户端文件缓存内存层的容量（字节）
+        : cacheSpillDirectory: str,客户端文件缓存磁盘溢出层所在的目录，为None时不使用磁盘溢出层
+        : cacheSpillBytes: int,磁盘溢出层的容量（字节）
+        : compression: str,文件数据的压缩算法（zlib/lzma），为None时不压缩；写入时数据块按该算法压缩，读取时请求文件服务器按该算法压缩
+        : compressionLevel: int,写入时的压缩级别，为None时使用该算法的默认级别
+        : compressionThreshold: int,写入时小于该长度的数据块不压缩
+        : writeBack: bool,是否启用写回模式：持有文件的排他锁时，对该文件的写入先缓冲在客户端，由后台线程延迟写回并合并同一文件的多次写入
+        : writeBackDelay: float,缓冲的写入最多延迟多少秒写回
+        : writeBackBytes: int,单个文件缓冲的数据达到此长度时立即写回
+        : deltaThreshold: int,替换整个已有文件的新内容不小于此长度时使用增量写入，只发送与旧版本不同的数据块；为None时不使用增量写入
+        : callbacks: bool,是否订阅路径服务器的回调：文件被其他客户端写入时由路径服务器主动通知，回调承诺的租期内完整读取缓存中的文件不需要任何网络往返
+        : fusedWrites: bool,是否使用融合写入：写入只向文件服务器发送一个请求，由文件服务器检查锁并向路径服务器登记，客户端只需要一次网络往返（文件服务器须指定--lock-port）
+        : 附注: 写回模式下，releaseLock/close/flush/shutdown返回之前缓冲的写入都已经写入文件服务器；本客户端随后的读取总能读到自己缓冲的写入
         '''
         self.id = str(uuid.uuid1())
         self.masterAddr = directoryAddress    #文件服务器IP地址
         self.directoryPort = directoryPort    #文件服务器端口
         self.lockAddr = lockAddress           #锁定服务IP地址
         self.lockPort = lockPort              #锁定服务端口
-        self.fileCache = {}                   #客户端文件缓存
+        self.fileCache = FileCache(cacheBytes, cacheSpillDirectory, cacheSpillBytes)   #客户端文件缓存，按LRU顺序淘汰
+        self.pool = ConnectionPool()          #到路径服务器、锁服务器和文件服务器的持久连接池，同一连接上的请求以流水线方式发送
+        self.partitionMap = None              #缓存的路径服务器分区表，针对单个文件的元数据请求直接发给文件名所属的分片；为None时发给上面的路径服务器
+        self.fileServers = {}                 #文件服务器列表，由servers请求获得
+        self.ring = None                      #与路径服务器相同的一致性哈希环，用于在本地计算文件的存放位置
+        self.latency = {}                     #(文件服务器地址, 端口) -> 读请求响应时间的移动平均值（秒），用于选择副本
+        self.compressor = protocol.Compressor(compression, compressionLevel, compressionThreshold) if compression else None
+        self.stripePool = ThreadPoolExecutor(max_workers=STRIPE_WORKERS)    #并发读写大文件的各个条带
+        self.heldLocks = {}                   #文件名 -> list,本客户端通过obtainLock获得且尚未释放的锁，含mode/offset/length/lockid和租期到期时间expires
+        self.heldLocksLock = threading.Lock()
+        self.writeBuffer = None               #写回模式下的写回缓冲区
+        self.writeBackBytes = writeBackBytes
+        self.flushErrors = {}                 #文件名 -> 后台写回失败时的响应，由下一次flush返回
+        self.deltaThreshold = deltaThreshold
+        self.leases = CallbackLeases() if callbacks else None    #路径服务器给出的回调承诺，为None时不订阅回调
+        self.subscriptions = {}               #(路径服务器分片地址, 端口) -> 回调连接
+        self.subscriptionLock = threading.Lock()
+        self.fusedWrites = fusedWrites
+        self.placements = {}                  #文件名 -> (地址, 端口),融合写入时文件主副本所在的文件服务器；为None时该文件不使用融合写入（切分为条带）
+        if writeBack:
+            self.writeBuffer = WriteBuffer(writeBackDelay)
+            self.flusher = threading.Thread(target=self._flushWorker, daemon=True)
+            self.flusher.start()
 
     def open(self, docname):
         '''
@@ -32,154 +92,954 @@ class Client():
         : docname: str,文件名
         '''
 
-        #1. 客户端建立到文件服务器的链接
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((self.masterAddr, self.directoryPort))
-
-        #2. 客户端发送一个open类型的请求报文给服务器，指示打开指定的文件
-        message = json.dumps({"request": "open", "docname": docname, "clientid": self.id})
-        sock.sendall(message.encode())
-        response = sock.recv(1024)
+        #1. 客户端通过连接池中的长连接发送一个open类型的请求报文给服务器，指示打开指定的文件
+        response = self._directoryCall(docname, {"request": "open", "docname": docname, "clientid": self.id})
 
         return response
 
     def close(self, docname):
         '''
-        : 客户端关闭一个文件
+        : 客户端关闭一个文件；写回模式下先写回该文件缓冲的写入
         : docname: str,文件名
         '''
+        self._flushDocument(docname)
 
-        #1. 客户端建立到文件服务器的链接
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((self.masterAddr, self.directoryPort))
-
-        #2. 客户端发送一个close类型的请求报文给服务器，指示关闭指定的文件
-        message = json.dumps({"request": "close", "docname": docname, "clientid": self.id})
-        sock.sendall(message.encode())
-        response = sock.recv(2048)
+        #1. 客户端通过连接池中的长连接发送一个close类型的请求报文给服务器，指示关闭指定的文件
+        response = self._directoryCall(docname, {"request": "close", "docname": docname, "clientid": self.id})
         return response
 
-    def checkLock(self, docname):
+    def checkLock(self, docname, mode=None, offset=None, length=None):
         '''
         : 客户端检查一个文件的锁状态
         : docname: str,文件名
+        : mode: str,打算进行的访问："shared"（读）或"exclusive"（写），默认为exclusive
+        : offset: int,访问范围的起始偏移，默认为0
+        : length: int,访问范围的长度，默认为-1（到文件末尾）
+        : return -> dict,其他客户端在该范围上持有与mode冲突的锁时为locked
         '''
 
-        #1. 客户端建立到锁服务器的链接
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((self.lockAddr, self.lockPort))
-
-        #2. 客户端发送一个checklock类型的请求报文给服务器，指示要获得指定文件的锁的状态
-        message = json.dumps({"request": "checklock", "docname": docname, "clientid": self.id})
-        sock.sendall(message.encode())
-        response = sock.recv(1024)
+        #1. 客户端通过连接池中的长连接发送一个checklock类型的请求报文给服务器，指示要获得指定文件的锁的状态
+        message = self._lockMessage("checklock", docname, mode, offset, length)
+        response = self.pool.call(self.lockAddr, self.lockPort, message)
 
         return response
 
-    def obtainLock(self, docname):
+    def _lockMessage(self, requestType, docname, mode, offset, length):
+        message = {"request": requestType, "docname": docname, "clientid": self.id}
+        if mode is not None:
+            message['mode'] = mode
+        if offset is not None:
+            message['offset'] = offset
+        if length is not None:
+            message['length'] = length
+        return message
+
+    def obtainLock(self, docname, wait=None, mode=None, offset=None, length=None):
         '''
         : 为指定的打开的文件获得锁
         : docname: str,文件名
+        : wait: float,文件已被其他客户端锁定时最多等待的秒数；为None时不等待，立即返回locked
+        : mode: str,"shared"（共享锁，多个客户端可以同时持有）或"exclusive"（排他锁），默认为exclusive
+        : offset: int,锁定范围的起始偏移，默认为0
+        : length: int,锁定范围的长度，默认为-1（到文件末尾）
+        : 附注: 等待的请求在锁服务器上按先进先出的顺序排队，锁被释放或到期时立即授予队首的请求，客户端不需要反复重试
+        '''
+
+        #1. 客户端通过连接池中的长连接发送一个obtainlock类型的请求报文给服务器，指示为指定的文件获得锁
+        message = self._lockMessage("obtainlock", docname, mode, offset, length)
+        requested = time.monotonic()
+        if not wait:
+            return self._recordLock(self.pool.call(self.lockAddr, self.lockPort, message), requested)
+
+        #2. 阻塞模式：服务器在锁被授予或等待超时时才发送响应；服务器没有按时响应时，客户端自行放弃等待
+        future = self.pool.submit(self.lockAddr, self.lockPort, dict(message, wait=wait))
+        try:
+            return self._recordLock(future.result(timeout=wait + LOCK_WAIT_MARGIN), time.monotonic())
+        except FutureTimeoutError:
+            return {"response": "locked", "docname": docname, "waited": True}
+
+    def _recordLock(self, response, requested):
+        '''
+        : 记录obtainLock获得的锁，写回模式据此判断写入能否缓冲；租期从发送请求时算起，比服务器上的到期时间略早
+        : response: dict,obtainlock响应报文
+        : requested: float,发送请求（或收到授予响应）时的time.monotonic()
+        : return -> dict,原响应报文
         '''
+        if response['response'] in ("lockgranted", "lockregranted"):
+            lock = {key: response[key] for key in ("lockid", "mode", "offset", "length")}
+            lock['expires'] = requested + response['timeout']
+            with self.heldLocksLock:
+                #续期后服务器上的旧锁已被替换为新锁
+                held = [other for other in self.heldLocks.get(response['docname'], [])
+                        if (other['mode'], other['offset'], other['length']) != (lock['mode'], lock['offset'], lock['length'])]
+                self.heldLocks[response['docname']] = held + [lock]
+        return response
 
-        #1. 客户端建立到锁服务器的链接
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((self.lockAddr, self.lockPort))
+    def _leaseDeadline(self, docname, offset, length):
+        '''
+        : 返回本客户端持有的、覆盖写入范围的排他锁最晚需要写回缓冲数据的时间
+        : docname: str,文件名
+        : offset: int,写入的起始偏移，为None时表示替换整个文件
+        : length: int,写入的长度
+        : return -> float,time.monotonic()时间；没有这样的锁或租期即将到期时为None
+        '''
+        start, end = (0, None) if offset is None else (offset, offset + length)
+        best = None
+        with self.heldLocksLock:
+            for lock in self.heldLocks.get(docname, []):
+                if lock['mode'] != "exclusive" or lock['offset'] > start:
+                    continue
+                if lock['length'] != -1 and (end is None or lock['offset'] + lock['length'] < end):
+                    continue
+                best = max(best or 0, lock['expires'] - LEASE_MARGIN)
+        if best is None or best <= time.monotonic():
+            return None
+        return best
 
-        #2. 客户端发送一个obtainlock类型的请求报文给服务器，指示为指定的文件获得锁
-        message = json.dumps({"request": "obtainlock", "docname": docname, "clientid": self.id})
-        sock.sendall(message.encode())
-        response = sock.recv(1024)
+    def releaseLock(self, docname, lockid=None, offset=None, length=None):
+        '''
+        : 释放自己持有的文件锁，锁随即被授予等待该文件的下一个客户端
+        : docname: str,文件名
+        : lockid: int,只释放obtainLock返回的该把锁；为None时释放指定范围（默认为整个文件）上自己持有的所有锁
+        : offset: int,释放范围的起始偏移
+        : length: int,释放范围的长度
+        '''
+        #1. 写回模式下，释放锁之前先写回该文件缓冲的写入；写回失败时不释放锁，返回失败的响应
+        flushed = self._flushDocument(docname)
+        if flushed is not None and not self._written(flushed):
+            return flushed
 
+        message = self._lockMessage("releaselock", docname, None, offset, length)
+        if lockid is not None:
+            message['lockid'] = lockid
+        response = self.pool.call(self.lockAddr, self.lockPort, message)
+        if response['response'] == "unlocked":
+            with self.heldLocksLock:
+                if lockid is not None:
+                    held = [lock for lock in self.heldLocks.get(docname, []) if lock['lockid'] != lockid]
+                elif offset is None and length is None:
+                    held = []
+                else:
+                    released = {"offset": offset or 0, "length": -1 if length is None else length}
+                    held = [lock for lock in self.heldLocks.get(docname, []) if not self._overlaps(lock, released)]
+                if held:
+                    self.heldLocks[docname] = held
+                else:
+                    self.heldLocks.pop(docname, None)
         return response
 
-    def read(self, docname):
+    def _overlaps(self, a, b):
+        endA = float("inf") if a['length'] == -1 else a['offset'] + a['length']
+        endB = float("inf") if b['length'] == -1 else b['offset'] + b['length']
+        return a['offset'] < endB and b['offset'] < endA
+
+    def read(self, docname, offset=0, length=-1, sink=None):
         '''
         : 读取指定文件名的文件
         : docname: str,文件名
+        : offset: int,读取的起始偏移
+        : length: int,读取的字节数，-1表示读到文件末尾
+        : sink: 可选的二进制输出流，指定时文件数据逐块写入该流而不在内存中保留，适用于大文件
         '''
 
+        #0. 写回模式下，缓冲了完整替换的文件直接从缓冲区读取，只缓冲了部分改写的文件先写回再读取
+        buffered = self._bufferedRead(docname)
+        if buffered is not None:
+            data = buffered[offset:] if length < 0 else buffered[offset:offset+length]
+            response = {"response": "read", "docname": docname, "offset": offset, "length": len(data), "size": len(buffered), "buffered": True}
+            if sink is not None:
+                sink.write(data)
+            else:
+                response['data'] = data
+            return response
+
+        #0.1 持有回调承诺时，缓存中的副本就是最新版本，直接返回，不需要任何网络往返
+        if offset == 0 and length < 0 and sink is None:
+            cached = self._leasedCopy(docname)
+            if cached is not None:
+                return cached
+
         #1. 首先，调用打开文件方法open，该方法将通知路径服务器打开文件，该方法的返回值中包含该文件的具体位置信息
-        fileServerInfo = json.loads(self.open(docname))
+        fileServerInfo = self.open(docname)
 
         #2. 然后，检查open方法的服务器响应报文（返回值）fileServerInfo的'isFile'字段，该字段为True表示目标文件存在，否则目标文件不存在
         if fileServerInfo['isFile']:
 
             #3. 若fileServerInfo['isFile']==True，即该文件存在，则首先检查该文件是否在缓存中，并且通过timestamp字段检查缓存中的副本是否为最新版本
-            if (docname in self.fileCache) and (self.fileCache[docname]['timestamp'] >= fileServerInfo['timestamp']):
-                fileCacheFileInfo = self.fileCache[docname]       #3.1 若为最新版本，则直接返回缓存中的目标文件副本即可
-                print("Read '" + docname + "' from fileCache!")
-                return fileCacheFileInfo
+            #-- 缓存中保存的是完整的文件，因此只有完整读取（不指定范围和输出流）时才使用缓存
+            wholeFile = offset == 0 and length < 0 and sink is None
+            fileCacheFileInfo = self.fileCache.get(docname) if wholeFile else None
+            if fileCacheFileInfo is not None and (fileCacheFileInfo['timestamp'] >= fileServerInfo['timestamp']):
+                return fileCacheFileInfo       #3.1 若为最新版本，则直接返回缓存中的目标文件副本即可
             else:                                          #3.2 若不为最新版本，则根据fileServerInfo的具体位置信息访问文件服务器获得最新版本，并更新缓存中的目标文件副本为最新版本
-                addr = fileServerInfo['address']   #从fileServerInfo中获取文件所在的服务器IP地址
-                port = int(fileServerInfo['port']) #从fileServerInfo中负责文件I/O的服务器端口
-
-                #4. 客户端再与存有文件的服务器建立连接
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.connect((addr, port))
+                #4. 切分为条带的大文件由多个线程同时从各条带所在的文件服务器读取
+                if fileServerInfo.get('stripes'):
+                    response = self._readStripes(docname, fileServerInfo, offset, length, sink)
+                else:
+                    #5. 文件有多个副本时，按各副本的负载和响应时间排序，依次尝试，直到某个副本成功返回文件
+                    #-- 客户端通过连接池中到该文件服务器的长连接发送一个read类型的请求报文，指示要从指定文件所在的服务器获得指定的文件的最新版本
+                    #-- 响应报文之后紧跟着原始数据块，由连接的接收线程在_receiveData中接收
+                    response = self._readReplicas(docname, self.rankReplicas(fileServerInfo), offset, length, sink)
 
-                #5. 客户端发送一个read类型的请求报文给服务器，指示要从指定文件所在的服务器获得指定的文件的最新版本
-                message = json.dumps({"request": "read", "docname": docname, "clientid": self.id})
-                sock.sendall(message.encode())
-
-                #6. 使用建立的连接获得最新版本的目标文件，并更新缓存中的副本
-                response = sock.recv(1024)
-
-                self.fileCache['docname'] = json.loads(response)
+                #6. 更新缓存中的副本
+                if wholeFile and response['response'] == "read":
+                    response['timestamp'] = fileServerInfo['timestamp']
+                    self.fileCache.put(docname, response)
 
                 #7. 返回含有读取文件结果的服务器响应报文
                 return response
         else:
         	return docname + "不存在!"
 
-    def write(self, docname, data):
+    def _readReplicas(self, docname, replicas, offset=0, length=-1, sink=None):
+        '''
+        : 依次尝试从各副本读取文件，直到某个副本成功返回文件
+        : replicas: list,[(地址, 端口)]，按尝试顺序排列
+        : return -> dict,成功的read响应；各副本都没有返回文件时为最后一个副本的响应
+        '''
+        message = {"request": "read", "docname": docname, "clientid": self.id, "offset": offset, "length": length, "compression": self._acceptedCompression()}
+        response = None
+        for addr, port in replicas:
+            try:
+                started = time.monotonic()
+                response = self.pool.call(addr, port, message, onResponse=lambda conn, response: self._receiveData(conn, response, sink))
+            except (OSError, protocol.ProtocolError):
+                if sink is not None:
+                    raise      #数据可能已经部分写入输出流，不能再从其他副本重新读取
+                continue
+            self.recordLatency(addr, port, time.monotonic() - started)
+            if response['response'] == "read":
+                break
+        if response is None:
+            raise ConnectionError("文件" + docname + "的所有副本均不可用")
+        return response
+
+    def _receiveData(self, conn, response, sink=None):
+        '''
+        : 接收read响应报文之后紧跟着的原始数据块
+        : conn: protocol.Connection,与文件服务器之间的连接
+        : response: dict,read响应报文
+        : sink: 可选的二进制输出流，指定时数据逐块写入该流，否则数据保存在响应报文的data字段中
+        : return -> dict,read响应报文
+        '''
+        if response['response'] != "read":
+            return response
+
+        if sink is not None:
+            for chunk in conn.recvChunks(response['length']):
+                sink.write(chunk)
+        else:
+            data = bytearray(response['length'])
+            conn.recvChunksInto(memoryview(data))
+            response['data'] = bytes(data)
+        return response
+
+    def _acceptedCompression(self):
+        '''
+        : read报文中的compression字段：客户端可以接受的压缩算法；接收时按各数据块帧头的标志位解压，实际使用的算法由文件服务器决定
+        '''
+        return [self.compressor.codec] if self.compressor is not None else None
+
+    def _readStripes(self, docname, fileinfo, offset, length, sink=None):
+        '''
+        : 读取切分为条带的文件：按文件的最终长度预先分配缓冲区，各条带由线程池并发读取，直接接收到缓冲区中对应的位置
+        : docname: str,文件名
+        : fileinfo: dict,路径服务器返回的文件位置信息，含size/stripeSize/stripes
+        : offset: int,读取的起始偏移
+        : length: int,读取的字节数，-1表示读到文件末尾
+        : sink: 可选的二进制输出流，指定时全部条带读取完成后写入该流
+        : return -> dict,与文件服务器read响应报文格式相同的响应
+        '''
+        size = fileinfo['size']
+        stripeSize = fileinfo['stripeSize']
+        offset = min(max(offset, 0), size)
+        if length < 0 or offset + length > size:
+            length = size - offset
+
+        #部分改写留下的空洞和比条带长度短的条带在缓冲区中保持为0
+        data = bytearray(length)
+        view = memoryview(data)
+        futures = []
+        for index, stripe in enumerate(fileinfo['stripes']):
+            start = max(offset, index * stripeSize)
+            end = min(offset + length, (index + 1) * stripeSize)
+            if start < end:
+                futures.append(self.stripePool.submit(self._readStripe, stripe, start - index * stripeSize, end - start, view[start-offset:end-offset]))
+        for future in futures:
+            future.result()
+
+        response = {"response": "read", "docname": docname, "offset": offset, "length": length, "size": size, "stripes": len(fileinfo['stripes'])}
+        if sink is not None:
+            sink.write(data)
+        else:
+            response['data'] = bytes(data)
+        return response
+
+    def _readStripe(self, stripe, offset, length, target):
+        '''
+        : 从条带的各个副本中依次尝试，读取条带中的一段数据到target中
+        : 部分改写越过文件末尾时，中间的条带可能从未写入，各副本都没有该条带时按空洞处理，target保持为0
+        : return -> dict,文件服务器的read响应报文
+        '''
+        message = {"request": "read", "docname": stripe['docname'], "clientid": self.id, "offset": offset, "length": length, "compression": self._acceptedCompression()}
+        missing = None
+        for addr, port in self.rankReplicas(stripe):
+            try:
+                started = time.monotonic()
+                response = self.pool.call(addr, port, message, onResponse=lambda conn, response: self._receiveInto(conn, response, target))
+            except (OSError, protocol.ProtocolError):
+                continue
+            self.recordLatency(addr, port, time.monotonic() - started)
+            if response['response'] == "read":
+                return response
+            missing = response
+        if missing is not None:
+            return missing
+        raise ConnectionError("条带" + stripe['docname'] + "的所有副本均不可用")
+
+    def _receiveInto(self, conn, response, target):
+        if response['response'] == "read":
+            conn.recvChunksInto(target[:response['length']])
+        return response
+
+    def rankReplicas(self, fileinfo):
+        '''
+        : 将文件的各个副本按预计的响应时间从小到大排序
+        : 预计响应时间 = (到该副本的未完成请求数 + 1) * 该副本的平均响应时间；尚未测量过的副本按MIN_LATENCY估计，因而会被优先尝试
+        : fileinfo: dict,路径服务器返回的文件位置信息
+        : return -> list,(文件服务器地址, 端口)
+        '''
+        replicas = fileinfo.get('replicas') or [fileinfo]
+        endpoints = [(replica['address'], int(replica['port'])) for replica in replicas]
+
+        def cost(endpoint):
+            return (self.pool.inFlight(*endpoint) + 1) * max(self.latency.get(endpoint, 0.0), MIN_LATENCY)
+        return sorted(endpoints, key=cost)
+
+    def recordLatency(self, address, port, elapsed):
+        '''
+        : 更新指定文件服务器的平均响应时间
+        '''
+        key = (address, int(port))
+        previous = self.latency.get(key)
+        self.latency[key] = elapsed if previous is None else previous + LATENCY_SMOOTHING * (elapsed - previous)
+
+    def partitions(self):
+        '''
+        : 从路径服务器获得分区表并缓存，之后针对单个文件的元数据请求直接发给文件名所属的分片
+        : 附注: 不调用本方法时，客户端在第一次收到wrong-shard响应时获得分区表
+        : return -> PartitionMap
+        '''
+        response = self.pool.call(self.masterAddr, self.directoryPort, {"request": "partitions", "clientid": self.id})
+        if response.get('partitions') is not None:
+            self._updatePartitions(response['partitions'])
+        return self.partitionMap
+
+    def _updatePartitions(self, message):
+        partitionMap = PartitionMap.fromMessage(message)
+        if self.partitionMap is None or partitionMap.epoch >= self.partitionMap.epoch:
+            self.partitionMap = partitionMap
+
+    def _directoryCall(self, docname, message):
+        '''
+        : 将针对单个文件的元数据请求发给文件名所属的路径服务器分片；分片返回wrong-shard时用其附带的分区表更新缓存后重新发送
+        : docname: str,文件名
+        : message: dict,请求报文
+        : return -> dict,响应报文
+        '''
+        for attempt in range(MAX_REDIRECTS + 1):
+            if self.partitionMap is None:
+                address, port = self.masterAddr, self.directoryPort
+            else:
+                address, port = self.partitionMap.endpoint(docname)
+            self._subscribe(address, port)
+            sentAt = time.monotonic()
+            response = self.pool.call(address, port, message)
+            if response['response'] != "wrong-shard":
+                self._grantLease(docname, sentAt, response.get('lease'), response.get('timestamp'))
+                return response
+            self._updatePartitions(response['partitions'])
+        return {"response": "error", "error": "路径服务器分片的分区表不一致"}
+
+    def _subscribe(self, address, port):
+        '''
+        : 订阅回调时，确保已经与路径服务器分片建立回调连接；连接建立之后该分片才会给出回调承诺
+        '''
+        if self.leases is None:
+            return
+        key = (address, int(port))
+        with self.subscriptionLock:
+            if key in self.subscriptions:
+                return
+            try:
+                conn = protocol.connect(address, port)
+                conn.send({"request": "callbacks", "clientid": self.id})
+                conn.recv()
+            except (OSError, protocol.ProtocolError):
+                return      #没有回调连接时分片不给出承诺，读取照常询问文件的版本
+            self.subscriptions[key] = conn
+        threading.Thread(target=self._callbackLoop, args=(key, conn), daemon=True).start()
+
+    def _callbackLoop(self, key, conn):
+        '''
+        : 回调连接的接收线程：处理路径服务器推送的失效通知并确认；连接断开时可能漏掉了通知，因此放弃全部回调承诺
+        '''
+        try:
+            while True:
+                notice = conn.recv()
+                if notice is None:
+                    break
+                if notice.get('response') == "invalidate":
+                    self.leases.invalidate(notice['docnames'])
+                    for docname in notice['docnames']:
+                        self.fileCache.invalidate(docname)
+                    conn.send({"request": "invalidated", "seq": notice['seq']})
+        except (OSError, protocol.ProtocolError):
+            pass
+        finally:
+            with self.subscriptionLock:
+                if self.subscriptions.get(key) is conn:
+                    del self.subscriptions[key]
+            self.leases.clear()
+            conn.close()
+
+    def _grantLease(self, docname, sentAt, lease, timestamp):
+        if self.leases is not None and lease and timestamp is not None:
+            self.leases.grant(docname, sentAt, lease, timestamp)
+
+    def _leasedCopy(self, docname):
+        '''
+        : 持有文件未到期的回调承诺，且缓存中的副本不旧于承诺对应的版本时，返回缓存的副本
+        : return -> dict,缓存项；否则为None，需要询问路径服务器
+        '''
+        if self.leases is None:
+            return None
+        timestamp = self.leases.valid(docname)
+        if timestamp is None:
+            return None
+        cached = self.fileCache.get(docname)
+        if cached is not None and cached['timestamp'] >= timestamp:
+            return cached
+        return None
+
+    def servers(self):
+        '''
+        : 从路径服务器获得文件服务器列表，并重新构造本地的一致性哈希环
+        : return -> dict,文件服务器ID -> 文件服务器信息
+        '''
+        response = self.pool.call(self.masterAddr, self.directoryPort, {"request": "servers", "clientid": self.id})
+        self.fileServers = response['servers']
+        self.ring = HashRing(self.fileServers, response['vnodes'])
+        return self.fileServers
+
+    def cluster(self):
+        '''
+        : 从路径服务器获得集群状态：各文件服务器的地址、最近一次心跳距今的时间和负载指标
+        : return -> dict,cluster响应报文
+        '''
+        return self.pool.call(self.masterAddr, self.directoryPort, {"request": "cluster", "clientid": self.id})
+
+    def locate(self, docname):
+        '''
+        : 在本地通过一致性哈希环计算文件的存放位置，不需要询问路径服务器
+        : 附注: 迁移尚未完成的文件可能仍在原来的服务器上，此时以路径服务器的文件路径映射为准
+        : docname: str,文件名
+        : return -> dict,文件服务器信息（含uuid/address/port）；没有文件服务器时返回None
+        '''
+        if self.ring is None or len(self.ring) == 0:
+            self.servers()
+        nodeID = self.ring.lookup(docname)
+        if nodeID is None:
+            return None
+        return dict(self.fileServers[nodeID], uuid=nodeID)
+
+    def lookup(self, docnames):
+        '''
+        : 通过一次lookup请求获得一批文件的位置信息
+        : docnames: list,文件名列表
+        : return -> dict,文件名 -> 文件位置信息（含address/port/timestamp），不存在的文件对应None
+        '''
+        #按文件名所属的分片分组，各分片的lookup请求同时发出；被分片拒绝的文件名在更新分区表后重新分组发送
+        docnames = list(docnames)
+        files = {}
+        for attempt in range(MAX_REDIRECTS + 1):
+            if self.partitionMap is None:
+                groups = {(self.masterAddr, self.directoryPort): docnames}
+            else:
+                groups = self.partitionMap.group(docnames)
+            for address, port in groups:
+                self._subscribe(address, port)
+            sentAt = time.monotonic()
+            futures = [(self.pool.submit(address, port, {"request": "lookup", "docnames": names, "clientid": self.id}), names) for (address, port), names in groups.items()]
+            docnames = []
+            for future, names in futures:
+                response = future.result()
+                if response['response'] == "wrong-shard":
+                    self._updatePartitions(response['partitions'])
+                    docnames.extend(names)
+                    continue
+                files.update(response['files'])
+                for docname, fileinfo in response['files'].items():
+                    if fileinfo is not None:
+                        self._grantLease(docname, sentAt, response.get('lease'), fileinfo['timestamp'])
+            if not docnames:
+                return files
+        raise protocol.ProtocolError("路径服务器分片的分区表不一致")
+
+    def stat(self, docname):
+        '''
+        : 获得文件的长度、版本时间戳和位置；名称为目录时type为directory
+        : docname: str,文件名或目录名
+        : return -> dict,stat响应报文；文件和目录都不存在时为stat-null
+        '''
+        self._flushDocument(docname)
+        response = self._directoryCall(docname, {"request": "stat", "docname": docname, "clientid": self.id})
+        if response['response'] == "stat-null" and self.partitionMap is not None and len(self.partitionMap) > 1:
+            #目录下的文件可能都在其他分片上
+            if self.list(docname.rstrip("/") + "/", limit=1)['entries']:
+                response = {"response": "stat", "docname": docname, "type": "directory"}
+        return response
+
+    def list(self, prefix="", cursor=None, limit=None, recursive=False):
+        '''
+        : 按名称顺序分页列出以prefix开头的文件和子目录
+        : prefix: str,名称前缀，列出目录时应以"/"结尾
+        : cursor: str,上一页响应中的cursor，为None时从第一项开始
+        : limit: int,本页最多返回的项数，为None时使用路径服务器的默认值
+        : recursive: bool,为True时列出prefix下全部层级的文件，否则只列出直接位于其下的文件和子目录
+        : return -> dict,list响应报文：entries为各项（name/type，文件另有size/timestamp），cursor为下一页的游标，没有更多项时为None
+        '''
+        if self.partitionMap is None:
+            self.partitions()
+        message = {"request": "list", "prefix": prefix, "cursor": cursor, "limit": limit, "recursive": recursive, "clientid": self.id}
+        futures = [self.pool.submit(address, port, message) for address, port in self.partitionMap.shards]
+        responses = [future.result() for future in futures]
+        if len(responses) == 1:
+            return responses[0]
+
+        #合并各分片的结果：还有更多项的分片中，最小的游标之前的项已经完整，本页到此为止；同一个子目录可能出现在多个分片中，只保留一次
+        cursors = [response['cursor'] for response in responses if response['cursor'] is not None]
+        boundary = min(cursors) if cursors else None
+        entries = {}
+        for response in responses:
+            for entry in response['entries']:
+                if boundary is None or entry['name'] <= boundary:
+                    entries.setdefault(entry['name'], entry)
+        entries = [entries[name] for name in sorted(entries)]
+        if limit is not None and len(entries) > limit:
+            entries = entries[:limit]
+            boundary = entries[-1]['name']
+        return {"response": "list", "prefix": prefix, "entries": entries, "cursor": boundary}
+
+    def readMany(self, docnames):
+        '''
+        : 批量读取文件
+        : docnames: list,文件名列表
+        : return -> dict,文件名 -> read响应报文（或缓存项），不存在的文件对应None；各副本都没有返回文件时为最后一个副本的响应
+        '''
+        if self.writeBuffer is not None:
+            for docname in docnames:
+                self._flushDocument(docname)
+
+        #1. 持有回调承诺的文件直接从缓存返回，其余文件通过一次lookup请求获得全部文件的位置信息和时间戳
+        docnames = list(docnames)
+        results = {}
+        for docname in docnames:
+            cached = self._leasedCopy(docname)
+            if cached is not None:
+                results[docname] = cached
+        fileInfos = self.lookup([docname for docname in docnames if docname not in results])
+
+        #2. 缓存中已有最新版本的文件直接从缓存返回，其余文件需要从文件服务器读取
+        pending = []
+        for docname, fileinfo in fileInfos.items():
+            if fileinfo is None:
+                results[docname] = None
+                continue
+            cached = self.fileCache.get(docname)
+            if cached is not None and cached['timestamp'] >= fileinfo['timestamp']:
+                results[docname] = cached
+                continue
+            if fileinfo.get('stripes'):
+                #切分为条带的大文件本身已经并发读取各条带
+                response = self._readStripes(docname, fileinfo, 0, -1)
+                response['timestamp'] = fileinfo['timestamp']
+                self.fileCache.put(docname, response)
+                results[docname] = response
+                continue
+            pending.append(docname)
+
+        #3. 向各个文件服务器同时发送read请求：同一服务器上的请求在连接上流水线发送，不同服务器之间并发进行
+        #-- 每个文件从发送时预计响应最快的副本读取，副本上未完成的请求越多越不容易被选中，请求随之在各副本之间分散
+        futures = {}
+        ranked = {}
+        for docname in pending:
+            ranked[docname] = self.rankReplicas(fileInfos[docname])
+            addr, port = ranked[docname][0]
+            message = {"request": "read", "docname": docname, "clientid": self.id, "offset": 0, "length": -1, "compression": self._acceptedCompression()}
+            try:
+                futures[docname] = self.pool.submit(addr, port, message, onResponse=self._receiveData)
+            except (OSError, protocol.ProtocolError):
+                futures[docname] = None
+
+        #4. 等待全部读取完成并更新缓存
+        #-- 首选副本不可用或没有返回文件（例如尚未复制到该副本）时，与read相同地依次尝试其余副本
+        for docname, future in futures.items():
+            try:
+                response = future.result() if future is not None else None
+            except (OSError, protocol.ProtocolError):
+                response = None
+            if response is None or response['response'] != "read":
+                try:
+                    response = self._readReplicas(docname, ranked[docname][1:])
+                except ConnectionError:
+                    if response is None:
+                        raise
+            if response['response'] == "read":
+                response['timestamp'] = fileInfos[docname]['timestamp']
+                self.fileCache.put(docname, response)
+            results[docname] = response
+        return results
+
+    def write(self, docname, data, offset=None):
         '''
         : 将更新信息写入文件
         : docname: str,要写入的文件名
-        : data: str,要写入的文件的数据
+        : data: str/bytes,要写入的文件的数据；也可以是已打开的二进制文件对象，此时数据从该文件中流式读取并发送
+        : offset: int,写入的起始偏移，为None时表示用data替换整个文件
         '''
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        #0. 写回模式下，持有覆盖写入范围的排他锁时写入先缓冲在客户端，由后台线程写回
+        #-- 从文件对象流式上传和较大的写入不缓冲；直接写入之前先写回该文件缓冲的写入，保持写入顺序
+        lease = self._leaseDeadline(docname, offset, self._dataLength(data))
+        if self.writeBuffer is not None:
+            if lease is not None and not hasattr(data, "read") and len(data) < self.writeBackBytes:
+                buffered = self.writeBuffer.add(docname, data, offset, lease)
+                self.fileCache.invalidate(docname)
+                if buffered >= self.writeBackBytes:
+                    flushed = self._flushDocument(docname)
+                    if flushed is not None and not self._written(flushed):
+                        return flushed
+                return {"response": "write", "docname": docname, "written": len(data), "buffered": True}
+            flushed = self._flushDocument(docname)
+            if flushed is not None and not self._written(flushed):
+                return flushed
+        return self._writeThrough(docname, data, offset, lease is not None)
 
+    def _writeThrough(self, docname, data, offset, lockHeld=False):
+        '''
+        : 将写入直接发送给文件服务器
+        : lockHeld: bool,本客户端是否持有覆盖写入范围的排他锁，持有时不需要再向锁服务器检查锁状态
+        '''
+        #0. 融合写入：数据连同写入请求一起发给文件主副本所在的文件服务器，由它检查锁、向路径服务器登记之后写入，只需要一次网络往返
+        #-- 文件实际在其他服务器上时，该服务器已经完成登记，返回的位置信息代替第5步中路径服务器的响应；融合写入不可用时按以下步骤写入
+        length = self._dataLength(data)
+        fused = None
+        if self.fusedWrites and not self._mayDelta(data, offset, length):
+            fused = self._writeFused(docname, data, offset, length, lockHeld)
+        if fused is None:
+            fileServerInfo = self._registerWrite(docname, data, offset, length, lockHeld)
+            if isinstance(fileServerInfo, str):
+                return fileServerInfo
+        elif fused['response'] == "locked":
+            return "Cannot write as file is locked by another client!"
+        elif fused['response'] == "write":
+            self._cacheWritten(docname, data, offset, fused, fused['timestamp'])
+            return fused
+        else:
+            fileServerInfo = fused
+        timestamp = fileServerInfo['timestamp']
+
+        if fileServerInfo.get('stripes'):
+            response = self._writeStripes(docname, fileServerInfo, data, offset, length, timestamp)
+            self._cacheWritten(docname, data, offset, response, timestamp)
+            return response
+
+        addr = fileServerInfo['address']
+        port = int(fileServerInfo['port'])
+
+        #6. 客户端向文件所在的服务器发送write-data请求报文，将需要写入的数据放在该报文中，指示服务器重新写入文件，并更新fileCache中缓存的文件的版本（若没有则在缓存中创建该文件）
+        #附注: 需要特别注意，write-data请求报文和write请求报文不相同；write请求报文是发给根结点的，是要请求所要写的文件所在的服务器的IP和端口号；而write-data请求报文是发送给文件所在的服务器的，是要请求该服务器将数据写入指定文件
+
+        #文件有多个副本时采用链式复制：数据发给主副本，由主副本沿chain字段中的其余副本依次转发，全部副本写入后才返回响应
+        chain = [{"address": replica['address'], "port": replica['port']} for replica in fileServerInfo.get('replicas', [])[1:]]
+        content = {"request": "write", "docname": docname, "offset": offset, "length": length, "chain": chain, "clientid": self.id, "timestamp": timestamp}
+
+        #替换已有的较大文件时先尝试增量写入，文件服务器上的版本在此期间被修改或没有可以复用的数据块时改为发送完整内容
+        response = None
+        if self._mayDelta(data, offset, length) and fileServerInfo.get('isFile'):
+            response = self._writeDelta(addr, port, content, data)
+
+        #客户端通过连接池向文件所在服务器发送write-data请求报文，报文之后紧跟着原始数据块
+        if response is None:
+            response = self.pool.call(addr, port, content, sendBody=self._bodySender(data, length))
+        self._cacheWritten(docname, data, offset, response, timestamp)
+        return response
+
+    def _registerWrite(self, docname, data, offset, length, lockHeld):
+        '''
+        : 写入的第1~5步：向锁服务器检查锁，再向路径服务器发送write请求
+        : return -> dict,路径服务器的write响应；被其他客户端锁定时为错误信息（str）
+        '''
         #1. 获得需要写入的目标的文件的锁信息lockcheck
-        lockcheck = json.loads(client.checkLock(docname))
+        #-- 部分改写时只检查被改写的字节范围，其他客户端锁定文件的其他部分不影响本次写入
+        if lockHeld:
+            lockcheck = {"response": "lockowned"}
+        elif offset is None:
+            lockcheck = self.checkLock(docname)
+        else:
+            lockcheck = self.checkLock(docname, "exclusive", offset, self._dataLength(data))
 
         #2. 若文件锁信息表项lockcheck['response']="locked"，说明目标文件此时被其他客户端锁定，这时不能写该文件，故直接返回错误信息
         if lockcheck['response'] == "locked":
             return "Cannot write as file is locked by another client!"
 
-        #3. 若文件锁信息表象lockcheck['response']!='locked'，这时目标文件未被其他客户端锁定，这时可以准备写该文件，首先创建到文件所在服务器的链接
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((self.masterAddr, self.directoryPort))
-
-        #5. 客户端发送一个write类型的请求报文给服务器，指示将要修改指定的文件
+        #3. 若文件锁信息表象lockcheck['response']!='locked'，这时目标文件未被其他客户端锁定，这时可以准备写该文件
+        #4. 客户端发送一个write类型的请求报文给路径服务器，指示将要修改指定的文件
         timestamp = time.time()   #生成最新时间戳，作为更新版本号使用
 
-        message = json.dumps({"request": "write", "docname": docname, "clientid": self.id, "timestamp": timestamp})
-        sock.sendall(message.encode())
+        #5. 客户端受到服务器响应，该响应回送一个报文response，报文中包含目标文件所在的服务器IP地址和端口号
+        #-- 报文中的写入范围用于决定大文件是否切分为条带
+        return self._directoryCall(docname, {"request": "write", "docname": docname, "clientid": self.id, "timestamp": timestamp,
+                                             "offset": offset, "length": length})
 
-        #6. 客户端受到服务器响应，该响应回送一个报文response，报文中包含目标文件所在的服务器IP地址和端口号
-        response = sock.recv(1024)
+    def _writeFused(self, docname, data, offset, length, lockHeld):
+        '''
+        : 融合写入：向文件主副本所在的文件服务器发送fusedwrite请求，报文之后紧跟着原始数据块
+        : 主副本的位置取自之前写入时记住的位置，新文件按一致性哈希环计算（路径服务器为新文件选择存放位置时优先选择收到数据的服务器）
+        : return -> dict,write响应；被锁定时为locked响应；文件在其他服务器上时为write-redirect响应（含位置信息）；不能使用融合写入时为None
+        '''
+        target = self.placements.get(docname, ())
+        if target == ():
+            server = self.locate(docname)
+            if server is None:
+                return None
+            target = (server['address'], int(server['port']))
+        if target is None:
+            return None
 
-        fileServerInfo = json.loads(response)
+        #文件的回调承诺由路径服务器在登记写入时给出，因此同样需要先订阅文件名所属分片的回调
+        if self.partitionMap is None:
+            self._subscribe(self.masterAddr, self.directoryPort)
+        else:
+            self._subscribe(*self.partitionMap.endpoint(docname))
+        content = {"request": "fusedwrite", "docname": docname, "offset": offset, "length": length, "clientid": self.id, "timestamp": time.time(),
+                   "lockHeld": lockHeld}
+        sentAt = time.monotonic()
+        try:
+            response = self.pool.call(target[0], target[1], content, sendBody=self._bodySender(data, length))
+        except (OSError, protocol.ProtocolError):
+            self.placements.pop(docname, None)     #文件服务器已经失效，按第1~5步重新获得文件的位置
+            return None
 
-        addr = fileServerInfo['address']
-        port = int(fileServerInfo['port'])
+        if len(self.placements) >= PLACEMENT_CACHE:
+            self.placements.clear()
+        if response['response'] == "write":
+            self.placements[docname] = target
+            response['timestamp'] = content['timestamp']
+            self._grantLease(docname, sentAt, response.get('lease'), content['timestamp'])
+        elif response['response'] == "write-redirect":
+            self.placements[docname] = None if response.get('stripes') else (response['address'], int(response['port']))
+            self._grantLease(docname, sentAt, response.get('lease'), content['timestamp'])
+        elif response['response'] != "locked":
+            return None
+        return response
 
-        #7. 客户端根据响应报文response的信息，再与存有文件的服务器建立连接
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((addr, port))
+    def _mayDelta(self, data, offset, length):
+        #替换整个已有文件且新内容足够长时可能使用增量写入，需要先向路径服务器获得文件的位置
+        return self.deltaThreshold is not None and offset is None and not hasattr(data, "read") and length >= self.deltaThreshold
 
-        #8. 客户端向文件所在的服务器发送write-data请求报文，将需要写入的数据放在该报文中，指示服务器重新写入文件，并更新fileCache中缓存的文件的版本（若没有则在缓存中创建该文件）
-        #附注: 需要特别注意，write-data请求报文和write请求报文不相同；write请求报文是发给根结点的，是要请求所要写的文件所在的服务器的IP和端口号；而write-data请求报文是发送给文件所在的服务器的，是要请求该服务器将数据写入指定文件
-        content = {"request": "write", "docname": docname, "data": data, "clientid": self.id, "timestamp": timestamp}
+    def _bodySender(self, data, length):
+        '''
+        : 返回发送写入数据的函数sendBody(conn)：data为文件对象时从其当前位置流式发送length字节
+        '''
+        if hasattr(data, "read"):
+            start = data.tell()
+            return lambda conn: conn.sendFile(data, start, length, self.compressor)
+        return lambda conn: conn.sendChunks(data, self.compressor)
 
-        self.fileCache[docname] = content
+    def _cacheWritten(self, docname, data, offset, response, timestamp):
+        #完整替换文件内容时缓存新的版本；部分改写或从文件流式上传时，缓存中的旧副本已经失效
+        #-- 缓存的条目与完整读取时文件服务器的read响应格式相同，命中缓存的read/readMany总是返回同一种响应
+        if response['response'] == "write" and offset is None and not hasattr(data, "read"):
+            data = bytes(data)
+            self.fileCache.put(docname, {"response": "read", "docname": docname, "offset": 0, "length": len(data), "size": len(data),
+                                         "timestamp": timestamp, "data": data})
+        else:
+            self.fileCache.invalidate(docname)
 
-        message = json.dumps(content)
-        sock.sendall(message.encode())     #客户端向文件所在服务器发送write-data请求报文
+    def _writeDelta(self, addr, port, content, data):
+        '''
+        : 增量写入：获得文件当前版本的数据块签名，只发送签名中没有的数据块，其余部分由文件服务器从旧版本复制
+        : addr: str,文件主副本所在的文件服务器地址
+        : port: int,文件服务器端口
+        : content: dict,完整写入时的write请求报文
+        : data: bytes-like,文件的新内容
+        : return -> dict,write响应报文；文件不存在、版本已经改变或没有可以复用的数据块时为None，由调用者发送完整内容
+        '''
+        signatures = self.pool.call(addr, port, {"request": "signatures", "docname": content['docname'], "clientid": self.id})
+        if signatures['response'] != "signatures":
+            return None
+        ops, literals = delta.diff(data, signatures['digests'], signatures['sizes'], signatures['params'])
+        literalLength = sum(len(literal) for literal in literals)
+        if literalLength == len(data):
+            return None
+
+        def sendBody(conn):
+            for literal in literals:
+                conn.sendChunks(literal, self.compressor)
 
-        response = sock.recv(1024)
+        message = dict(content, request="delta", base=signatures['version'], ops=ops, length=literalLength, size=len(data))
+        response = self.pool.call(addr, port, message, sendBody=sendBody)
+        if response['response'] == "delta-stale":
+            return None
         return response
 
+    def _writeStripes(self, docname, fileinfo, data, offset, length, timestamp):
+        '''
+        : 写入切分为条带的文件：写入范围按条带切开，各部分由线程池并发写入各条带所在的文件服务器
+        : docname: str,文件名
+        : fileinfo: dict,路径服务器返回的write响应，含size/stripeSize/stripes
+        : data: bytes/已打开的二进制文件对象,要写入的数据
+        : offset: int,写入的起始偏移，为None时表示替换整个文件
+        : length: int,写入的数据长度
+        : timestamp: float,版本时间戳
+        : return -> dict,汇总后的write响应；某个条带写入失败时返回该条带的响应
+        '''
+        stripeSize = fileinfo['stripeSize']
+        base = offset or 0
+        fileStart = data.tell() if hasattr(data, "read") else 0
+        futures = []
+        for index, stripe in enumerate(fileinfo['stripes']):
+            start = max(base, index * stripeSize)
+            end = min(base + length, (index + 1) * stripeSize)
+            if start >= end and offset is not None:
+                continue      #部分改写时跳过不在写入范围内的条带；替换整个文件时每个条带都要重写
+            stripeOffset = None if offset is None else start - index * stripeSize
+            futures.append(self.stripePool.submit(self._writeStripe, stripe, data, fileStart + start - base, max(end - start, 0), stripeOffset, timestamp))
+
+        responses = [future.result() for future in futures]
+        for response in responses:
+            if response['response'] != "write":
+                return response
+        return {"response": "write", "docname": docname, "written": sum(response['written'] for response in responses), "size": fileinfo['size'],
+                "stripes": len(fileinfo['stripes']), "replicas": min(response.get('replicas', 1) for response in responses), "timestamp": timestamp}
+
+    def _writeStripe(self, stripe, data, dataOffset, count, offset, timestamp):
+        '''
+        : 将data中从dataOffset开始的count字节写入条带，条带的各副本之间采用链式复制
+        : return -> dict,条带主副本的write响应报文
+        '''
+        chain = [{"address": replica['address'], "port": replica['port']} for replica in stripe['replicas'][1:]]
+        content = {"request": "write", "docname": stripe['docname'], "offset": offset, "length": count, "chain": chain, "clientid": self.id, "timestamp": timestamp}
+        if hasattr(data, "read"):
+            sendBody = lambda conn: conn.sendFile(data, dataOffset, count, self.compressor)
+        else:
+            sendBody = lambda conn: conn.sendChunks(memoryview(data)[dataOffset:dataOffset+count], self.compressor)
+        return self.pool.call(stripe['address'], int(stripe['port']), content, sendBody=sendBody)
+
+    def _written(self, response):
+        return isinstance(response, dict) and response.get('response') == "write"
+
+    def _bufferedRead(self, docname):
+        '''
+        : 写回模式下读取文件之前调用：等待该文件正在进行的写回完成；缓冲了完整替换时返回其内容，否则写回缓冲的部分改写
+        : return -> bytes,缓冲的完整文件内容；没有缓冲完整替换时为None
+        '''
+        if not self._mayBuffer(docname):
+            return None
+        with self.writeBuffer.documentLock(docname):
+            data = self.writeBuffer.replacement(docname)
+            if data is None:
+                self._flushLocked(docname)
+            return data
+
+    def _flushDocument(self, docname):
+        '''
+        : 写回一个文件缓冲的写入
+        : return -> dict,最后一次写入的响应（或失败的响应）；没有缓冲的写入时为None
+        '''
+        if not self._mayBuffer(docname):
+            return None
+        with self.writeBuffer.documentLock(docname):
+            return self._flushLocked(docname)
+
+    def _mayBuffer(self, docname):
+        #只有持有锁的文件会缓冲写入；锁释放之后仍留在缓冲区中的只有写回失败、等待重试的数据
+        return self.writeBuffer is not None and (docname in self.heldLocks or docname in self.writeBuffer)
+
+    def _flushLocked(self, docname):
+        #调用者须持有该文件的写回锁，使同一文件的各次写回按顺序进行
+        entry = self.writeBuffer.take(docname)
+        if entry is None:
+            return None
+        response = None
+        try:
+            for offset, data in entry.writes():
+                response = self._writeThrough(docname, data, offset, self._leaseDeadline(docname, offset, len(data)) is not None)
+                if not self._written(response):
+                    break
+        except (OSError, protocol.ProtocolError) as e:
+            response = {"response": "error", "docname": docname, "error": str(e)}
+        if not self._written(response):
+            self.writeBuffer.restore(docname, entry)
+        return response
+
+    def _flushWorker(self):
+        '''
+        : 后台写回线程：在各文件的写回截止时间写回其缓冲的写入；失败的写回放回缓冲区稍后重试，失败的响应由下一次flush返回
+        '''
+        while True:
+            due = self.writeBuffer.waitDue()
+            if due is None:
+                return
+            for docname in due:
+                response = self._flushDocument(docname)
+                if response is not None and not self._written(response):
+                    self.flushErrors[docname] = response
+
+    def flush(self, docname=None):
+        '''
+        : 写回缓冲的写入，返回时数据已经写入文件服务器
+        : docname: str,只写回该文件；为None时写回全部文件
+        : return -> dict,文件名 -> 最后一次写入的响应；后台写回曾经失败的文件对应其失败的响应（再次写回成功时为成功的响应）
+        '''
+        if self.writeBuffer is None:
+            return {}
+        docnames = [docname] if docname is not None else self.writeBuffer.docnames()
+        results = {name: self.flushErrors.pop(name) for name in list(self.flushErrors) if docname is None or name == docname}
+        for name in docnames:
+            response = self._flushDocument(name)
+            if response is not None:
+                results[name] = response
+        return results
+
+    def _dataLength(self, data):
+        '''
+        : 返回待写入数据的长度；data为已打开的文件对象时为从当前位置到文件末尾的长度
+        '''
+        if hasattr(data, "read"):
+            return os.fstat(data.fileno()).st_size - data.tell()
+        return len(data)
+
+    def shutdown(self):
+        '''
+        : 写回全部缓冲的写入，然后关闭客户端持有的所有长连接
+        '''
+        if self.writeBuffer is not None:
+            self.flush()
+            self.writeBuffer.close()
+        self.stripePool.shutdown(wait=False)
+        self.pool.close()
+        with self.subscriptionLock:
+            subscriptions, self.subscriptions = list(self.subscriptions.values()), {}
+        for conn in subscriptions:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)     #使回调连接的接收线程退出
+            except OSError:
+                pass
 
 # simple test for the client library
 if __name__ == '__main__':
@@ -189,7 +1049,7 @@ if __name__ == '__main__':
     response = ""
 
     while typeOfCommand != "exit":
-        typeOfCommand = input("请输入一个操作指令[open/close/checklock/read/write]，输入exit以退出:")
+        typeOfCommand = input("请输入一个操作指令[open/close/checklock/obtainlock/releaselock/read/readmany/write/flush/stat/list/cachestats/cluster]，输入exit以退出:")
 
         if typeOfCommand == "open":
             docname = str(input("请输入文件名称: "))
@@ -200,14 +1060,36 @@ if __name__ == '__main__':
         elif typeOfCommand == "checklock":
             docname = str(input("请输入文件名称: "))
             response = client.checkLock(docname)
+        elif typeOfCommand == "obtainlock":
+            docname = str(input("请输入文件名称: "))
+            response = client.obtainLock(docname)
+        elif typeOfCommand == "releaselock":
+            docname = str(input("请输入文件名称: "))
+            response = client.releaseLock(docname)
         elif typeOfCommand == "read":
             docname = str(input("请输入文件名称: "))
             response = client.read(docname)
+        elif typeOfCommand == "readmany":
+            docnames = str(input("请输入文件名称（以空格分隔）: ")).split()
+            response = client.readMany(docnames)
         elif typeOfCommand == "write":
             docname = str(input("请输入文件名称: "))
             data = str(input("请输入要写入的文件内容: "))
             response = client.write(docname, data)
+        elif typeOfCommand == "flush":
+            response = client.flush()
+        elif typeOfCommand == "stat":
+            docname = str(input("请输入文件名称: "))
+            response = client.stat(docname)
+        elif typeOfCommand == "list":
+            prefix = str(input("请输入目录（以/结尾，直接回车表示根目录）: "))
+            response = client.list(prefix)
+        elif typeOfCommand == "cachestats":
+            response = client.fileCache.stats()
+        elif typeOfCommand == "cluster":
+            response = client.cluster()
         elif typeOfCommand == "exit":
+            client.shutdown()
             response = "成功退出系统!"
         else:
             response = "输入的指令不合法，请重新输入"
@@ -0,0 +1,172 @@
+import os
+import threading
+import hashlib
+from collections import OrderedDict
+
+from Common import protocol
+
+#客户端文件缓存
+#-- 内存层按LRU顺序保存最近使用的文件，总字节数不超过给定的上限，超出时淘汰最久未使用的文件
+#-- 可选的磁盘溢出层：被内存层淘汰的文件写入本地目录，磁盘层同样按LRU顺序淘汰，再次访问时重新载入内存层
+#-- 缓存项为带有data(bytes)和timestamp字段的dict，文件大小按data的长度计算
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024      #内存层默认容量
+DEFAULT_SPILL_BYTES = 1024 * 1024 * 1024     #磁盘溢出层默认容量
+
+
+class FileCache():
+    '''
+    : 有容量上限的两级LRU文件缓存，并统计命中、未命中和淘汰次数
+    '''
+    def __init__(self, maxBytes=DEFAULT_MEMORY_BYTES, spillDirectory=None, maxSpillBytes=DEFAULT_SPILL_BYTES):
+        '''
+        : 初始化文件缓存
+        : maxBytes: int,内存层容量（字节）
+        : spillDirectory: str,磁盘溢出层所在的目录，为None时不使用磁盘溢出层
+        : maxSpillBytes: int,磁盘溢出层容量（字节）
+        '''
+        self.maxBytes = maxBytes
+        self.spillDirectory = spillDirectory
+        self.maxSpillBytes = maxSpillBytes
+        self.lock = threading.Lock()
+
+        self.memory = OrderedDict()      #文件名 -> 缓存项，按最近使用顺序排列（末尾为最近使用）
+        self.memoryBytes = 0
+        self.spilled = OrderedDict()     #文件名 -> 溢出文件的大小，按最近使用顺序排列
+        self.spilledBytes = 0
+
+        self.hits = 0            #内存层命中次数
+        self.spillHits = 0       #磁盘溢出层命中次数
+        self.misses = 0          #未命中次数
+        self.evictions = 0       #从缓存中彻底淘汰的文件数
+        self.spills = 0          #从内存层转移到磁盘溢出层的文件数
+
+        if spillDirectory is not None:
+            os.makedirs(spillDirectory, exist_ok=True)
+
+    def __contains__(self, docname):
+        with self.lock:
+            return docname in self.memory or docname in self.spilled
+
+    def get(self, docname):
+        '''
+        : 从缓存中读取文件
+        : docname: str,文件名
+        : return -> 缓存项；若文件不在缓存中则返回None
+        '''
+        with self.lock:
+            entry = self.memory.get(docname)
+            if entry is not None:
+                self.memory.move_to_end(docname)
+                self.hits += 1
+                return entry
+
+            if docname in self.spilled:
+                entry = self._loadSpilled(docname)
+                if entry is not None:
+                    self.spillHits += 1
+                    self._insert(docname, entry)
+                    return entry
+
+            self.misses += 1
+            return None
+
+    def put(self, docname, entry):
+        '''
+        : 将文件加入缓存，替换已有的副本
+        : docname: str,文件名
+        : entry: dict,缓存项，必须含有data和timestamp字段
+        '''
+        with self.lock:
+            self._remove(docname)
+            if len(entry['data']) > self.maxBytes:
+                #单个文件超过内存层容量时不缓存
+                return
+            self._insert(docname, entry)
+
+    def invalidate(self, docname):
+        '''
+        : 从缓存中删除文件（例如该文件被部分改写后，缓存中的副本已经失效）
+        : docname: str,文件名
+        '''
+        with self.lock:
+            self._remove(docname)
+
+    def stats(self):
+        '''
+        : 返回缓存的统计信息
+        : return -> dict
+        '''
+        with self.lock:
+            lookups = self.hits + self.spillHits + self.misses
+            return {
+                "hits": self.hits,
+                "spillHits": self.spillHits,
+                "misses": self.misses,
+                "hitRate": (self.hits + self.spillHits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "memoryFiles": len(self.memory),
+                "memoryBytes": self.memoryBytes,
+                "spilledFiles": len(self.spilled),
+                "spilledBytes": self.spilledBytes,
+            }
+
+    def _insert(self, docname, entry):
+        self.memory[docname] = entry
+        self.memoryBytes += len(entry['data'])
+        while self.memoryBytes > self.maxBytes:
+            victim, victimEntry = self.memory.popitem(last=False)
+            self.memoryBytes -= len(victimEntry['data'])
+            self._spill(victim, victimEntry)
+
+    def _remove(self, docname):
+        entry = self.memory.pop(docname, None)
+        if entry is not None:
+            self.memoryBytes -= len(entry['data'])
+        if docname in self.spilled:
+            self._dropSpilled(docname)
+
+    def _spillPath(self, docname):
+        return os.path.join(self.spillDirectory, hashlib.sha1(docname.encode("utf-8")).hexdigest())
+
+    def _spill(self, docname, entry):
+        '''
+        : 将被内存层淘汰的文件写入磁盘溢出层；未启用磁盘溢出层时直接淘汰
+        '''
+        size = len(entry['data'])
+        if self.spillDirectory is None or size > self.maxSpillBytes:
+            self.evictions += 1
+            return
+
+        with open(self._spillPath(docname), "wb") as spillFile:
+            for part in protocol.encodeFrame(entry):
+                spillFile.write(part)
+        self.spilled[docname] = size
+        self.spilledBytes += size
+        self.spills += 1
+
+        while self.spilledBytes > self.maxSpillBytes:
+            victim = next(iter(self.spilled))
+            self._dropSpilled(victim)
+            self.evictions += 1
+
+    def _loadSpilled(self, docname):
+        '''
+        : 从磁盘溢出层中取出文件，并将其从磁盘溢出层中删除（随后由调用者放回内存层）
+        '''
+        try:
+            with open(self._spillPath(docname), "rb") as spillFile:
+                codec, flags, body = protocol.readFrame(spillFile)
+            entry = protocol.decodeBody(codec, body)
+        except (OSError, TypeError, protocol.ProtocolError):
+            entry = None
+        self._dropSpilled(docname)
+        return entry
+
+    def _dropSpilled(self, docname):
+        self.spilledBytes -= self.spilled.pop(docname)
+        try:
+            os.remove(self._spillPath(docname))
+        except OSError:
+            pass
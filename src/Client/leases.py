@@ -0,0 +1,77 @@
+import threading
+import time
+
+#客户端持有的回调承诺（见Server.callbacks）
+#-- 路径服务器在返回文件的版本时间戳时给出回调承诺，租期内该文件被其他客户端写入时会通过回调连接通知本客户端
+#-- 因此在承诺的租期内，缓存中不旧于承诺对应版本的副本就是最新版本，读取时不需要询问路径服务器
+#-- 失效通知与给出承诺的响应经过不同的连接，通知可能先于响应到达：请求发出之后收到过该文件的失效通知时，响应中的承诺不被接受
+#-- 回调连接断开时可能漏掉失效通知，此时放弃全部承诺
+
+PRUNE_EVERY = 4096       #每记录这么多次失效通知，清理一次不再需要的失效时间
+
+
+class CallbackLeases():
+    '''
+    : 文件名 -> 回调承诺（租期到期时间和对应的版本时间戳）
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.leases = {}             #文件名 -> (到期时间(time.monotonic()), 版本时间戳)
+        self.invalidated = {}        #文件名 -> 最近一次收到失效通知的时间
+        self.clearedAt = float("-inf")    #最近一次放弃全部承诺的时间
+        self.longest = 0             #见过的最长租期，早于此的失效时间不会再影响任何承诺
+        self.notices = 0
+
+    def grant(self, docname, sentAt, lease, timestamp):
+        '''
+        : 记录路径服务器响应中的回调承诺
+        : docname: str,文件名
+        : sentAt: float,请求发出的时间(time.monotonic())，租期从此时开始计算
+        : lease: float,承诺的租期（秒）
+        : timestamp: float,响应中文件的版本时间戳
+        : return -> bool,是否接受了该承诺
+        '''
+        with self.lock:
+            if sentAt <= self.clearedAt or self.invalidated.get(docname, float("-inf")) >= sentAt:
+                return False
+            self.leases[docname] = (sentAt + lease, timestamp)
+            self.longest = max(self.longest, lease)
+            return True
+
+    def valid(self, docname):
+        '''
+        : return -> float,持有未到期的承诺时为承诺对应的版本时间戳，否则为None
+        '''
+        with self.lock:
+            lease = self.leases.get(docname)
+            if lease is None:
+                return None
+            if lease[0] <= time.monotonic():
+                del self.leases[docname]
+                return None
+            return lease[1]
+
+    def invalidate(self, docnames):
+        '''
+        : 收到失效通知：放弃这些文件的承诺
+        '''
+        now = time.monotonic()
+        with self.lock:
+            for docname in docnames:
+                self.leases.pop(docname, None)
+                self.invalidated[docname] = now
+            self.notices += 1
+            if self.notices % PRUNE_EVERY == 0:
+                self.invalidated = {docname: at for docname, at in self.invalidated.items() if at > now - self.longest}
+
+    def clear(self):
+        '''
+        : 回调连接断开：放弃全部承诺，断开之前发出的请求中的承诺也不再接受
+        '''
+        with self.lock:
+            self.leases.clear()
+            self.clearedAt = time.monotonic()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.leases)
@@ -0,0 +1,209 @@
+import time
+import bisect
+import threading
+
+#客户端写回缓冲区
+#-- 客户端持有某个文件的排他锁时，对该文件的写入先保存在缓冲区中，由后台线程延迟写入文件服务器，期间对同一文件的多次写入合并为一次
+#-- 每个文件的待写数据（PendingWrites）有两种形式：
+#-- a. 完整替换：缓冲了一次替换整个文件的写入，此后的部分改写直接修改这份完整内容，写回时发送一次完整替换
+#-- b. 若干互不重叠的改写范围：只缓冲了部分改写，重叠或相邻的改写合并为一个范围，后写入的数据覆盖先写入的数据，写回时每个范围发送一次部分改写
+#-- 每个文件的写回截止时间为其第一次缓冲写入的时间加上写回延迟，并且不晚于所持有的锁的租期
+
+
+class PendingWrites():
+    '''
+    : 一个文件的待写数据
+    '''
+    def __init__(self, deadline):
+        '''
+        : deadline: float,最晚的写回时间（time.monotonic()）
+        '''
+        self.deadline = deadline
+        self.replace = None       #bytearray,缓冲了完整替换时为文件的完整新内容，否则为None
+        self.starts = []          #各改写范围的起始偏移，升序
+        self.extents = []         #与starts对应的各改写范围的数据(bytearray)
+
+    def size(self):
+        '''
+        : return -> int,缓冲的字节数
+        '''
+        if self.replace is not None:
+            return len(self.replace)
+        return sum(len(data) for data in self.extents)
+
+    def apply(self, data, offset=None):
+        '''
+        : 合并一次写入
+        : data: bytes-like,写入的数据
+        : offset: int,写入的起始偏移，为None时表示替换整个文件
+        '''
+        if offset is None:
+            self.replace = bytearray(data)
+            self.starts, self.extents = [], []
+        elif self.replace is not None:
+            end = offset + len(data)
+            if end > len(self.replace):
+                self.replace.extend(bytes(end - len(self.replace)))     #写入范围超出文件末尾时中间的空洞填0，与文件服务器上的部分改写一致
+            self.replace[offset:end] = data
+        else:
+            self._merge(offset, data)
+
+    def _merge(self, offset, data):
+        #1. 找到与[offset, end]重叠或相邻的全部范围
+        end = offset + len(data)
+        first = bisect.bisect_left(self.starts, offset)
+        if first > 0 and self.starts[first - 1] + len(self.extents[first - 1]) >= offset:
+            first -= 1
+        last = first
+        while last < len(self.starts) and self.starts[last] <= end:
+            last += 1
+
+        #2. 合并为一个范围：先放入旧数据，再用新数据覆盖
+        if first == last:
+            self.starts.insert(first, offset)
+            self.extents.insert(first, bytearray(data))
+            return
+        start = min(offset, self.starts[first])
+        stop = max(end, self.starts[last - 1] + len(self.extents[last - 1]))
+        merged = bytearray(stop - start)
+        for position, extent in zip(self.starts[first:last], self.extents[first:last]):
+            merged[position - start:position - start + len(extent)] = extent
+        merged[offset - start:end - start] = data
+        self.starts[first:last] = [start]
+        self.extents[first:last] = [merged]
+
+    def writes(self):
+        '''
+        : return -> list,写回时依次发送的(起始偏移, 数据)，起始偏移为None表示替换整个文件
+        '''
+        if self.replace is not None:
+            return [(None, self.replace)]
+        return list(zip(self.starts, self.extents))
+
+    def underneath(self, newer):
+        '''
+        : 将本对象（较早的待写数据）与之后缓冲的newer合并，用于写回失败后把数据放回缓冲区
+        : return -> PendingWrites,合并后的待写数据
+        '''
+        if newer.replace is not None:
+            return newer
+        for offset, data in newer.writes():
+            self.apply(data, offset)
+        return self
+
+
+class WriteBuffer():
+    '''
+    : 按文件保存待写数据的写回缓冲区；写回本身由客户端完成
+    '''
+    def __init__(self, delay):
+        '''
+        : delay: float,第一次缓冲写入之后最多延迟多少秒写回
+        '''
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)    #出现新的截止时间时唤醒写回线程
+        self.pending = {}                                  #文件名 -> PendingWrites
+        self.documentLocks = {}                            #文件名 -> threading.Lock
+        self.closed = False
+
+    def __contains__(self, docname):
+        with self.lock:
+            return docname in self.pending
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+    def add(self, docname, data, offset=None, leaseDeadline=None):
+        '''
+        : 缓冲一次写入
+        : docname: str,文件名
+        : data: bytes-like,写入的数据
+        : offset: int,写入的起始偏移，为None时表示替换整个文件
+        : leaseDeadline: float,锁的租期到期前必须写回的时间（time.monotonic()）
+        : return -> int,该文件缓冲的字节数
+        '''
+        with self.lock:
+            entry = self.pending.get(docname)
+            if entry is None:
+                deadline = time.monotonic() + self.delay
+                if leaseDeadline is not None:
+                    deadline = min(deadline, leaseDeadline)
+                entry = self.pending[docname] = PendingWrites(deadline)
+                self.changed.notify()
+            elif leaseDeadline is not None and leaseDeadline < entry.deadline:
+                entry.deadline = leaseDeadline
+                self.changed.notify()
+            entry.apply(data, offset)
+            return entry.size()
+
+    def replacement(self, docname):
+        '''
+        : 缓冲了完整替换时返回文件的完整新内容，用于在写回之前读到自己写入的数据
+        : return -> bytes,没有缓冲完整替换时为None
+        '''
+        with self.lock:
+            entry = self.pending.get(docname)
+            if entry is None or entry.replace is None:
+                return None
+            return bytes(entry.replace)
+
+    def documentLock(self, docname):
+        '''
+        : 返回文件的写回锁：写回一个文件的过程中持有该锁，读取该文件之前需要等待正在进行的写回完成
+        '''
+        with self.lock:
+            lock = self.documentLocks.get(docname)
+            if lock is None:
+                lock = self.documentLocks[docname] = threading.Lock()
+            return lock
+
+    def take(self, docname):
+        '''
+        : 取出一个文件的待写数据，之后对该文件的写入重新开始缓冲
+        : return -> PendingWrites,没有待写数据时为None
+        '''
+        with self.lock:
+            return self.pending.pop(docname, None)
+
+    def restore(self, docname, entry):
+        '''
+        : 写回失败时将取出的待写数据放回缓冲区，排在取出之后新缓冲的写入之前，并在写回延迟之后重试
+        '''
+        with self.lock:
+            entry.deadline = time.monotonic() + self.delay
+            newer = self.pending.get(docname)
+            self.pending[docname] = entry if newer is None else entry.underneath(newer)
+            self.changed.notify()
+
+    def docnames(self):
+        with self.lock:
+            return list(self.pending)
+
+    def bufferedBytes(self):
+        with self.lock:
+            return sum(entry.size() for entry in self.pending.values())
+
+    def waitDue(self):
+        '''
+        : 阻塞到有文件到达写回截止时间，或缓冲区被关闭
+        : return -> list,已经到达截止时间的文件名；缓冲区被关闭时为None
+        '''
+        with self.lock:
+            while not self.closed:
+                now = time.monotonic()
+                due = [docname for docname, entry in self.pending.items() if entry.deadline <= now]
+                if due:
+                    return due
+                earliest = min((entry.deadline for entry in self.pending.values()), default=None)
+                self.changed.wait(None if earliest is None else earliest - now)
+            return None
+
+    def close(self):
+        '''
+        : 关闭缓冲区，使写回线程退出；调用之前应先写回全部待写数据
+        '''
+        with self.lock:
+            self.closed = True
+            self.changed.notify_all()
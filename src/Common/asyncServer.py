@@ -0,0 +1,230 @@
+import asyncio
+import socket
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Common import protocol
+
+#基于asyncio事件循环的服务器框架，作为socketserver.ThreadingMixIn多线程模式的替代
+#-- 所有连接由一个事件循环线程处理，不再为每个连接创建一个操作系统线程
+#-- 普通请求直接在事件循环中调用与多线程模式相同的请求处理函数handleRequest
+#-- 需要收发原始数据块的请求（例如文件服务器的read/write）交给对应的流式处理协程，其中阻塞的磁盘I/O通过有界线程池执行
+
+DISK_WORKERS = 8       #执行阻塞磁盘I/O的线程数
+DISK_BACKLOG = 64      #同时等待执行的磁盘I/O任务上限，超过后新的任务在事件循环中等待，避免任务队列无限增长
+
+
+class AsyncConnection():
+    '''
+    : 事件循环模式下的报文连接，提供与protocol.Connection对应的协程接口
+    '''
+    def __init__(self, reader, writer, server):
+        self.reader = reader
+        self.writer = writer
+        self.server = server
+        self.bytesIn = 0       #累计接收的字节数（含帧头）
+        self.bytesOut = 0      #累计发送的字节数（含帧头）
+
+    async def recv(self):
+        '''
+        : 接收一个报文
+        : return -> dict,报文；若对端已关闭连接则返回None
+        '''
+        frame = await self._readFrame()
+        if frame is None:
+            return None
+        codec, flags, body = frame
+        return protocol.decodeBody(codec, body)
+
+    async def _readFrame(self):
+        try:
+            header = await self.reader.readexactly(protocol.HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if not e.partial:
+                return None
+            raise protocol.ProtocolError("连接在报文中途关闭")
+        codec, flags, size = protocol.HEADER.unpack(header)
+        try:
+            body = await self.reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise protocol.ProtocolError("连接在报文中途关闭")
+        self.bytesIn += protocol.HEADER.size + size
+        return codec, flags, body
+
+    async def send(self, message):
+        '''
+        : 发送一个报文
+        : message: dict,报文
+        '''
+        for part in protocol.encodeFrame(message):
+            self.writer.write(part)
+            self.bytesOut += memoryview(part).nbytes
+        await self.writer.drain()
+
+    async def sendFile(self, fileobj, offset, count, compressor=None):
+        '''
+        : 将文件中的一段数据以原始数据块的形式发送，数据由事件循环通过sendfile直接从文件拷贝到套接字
+        : fileobj: 已打开的二进制文件对象
+        : offset: int,起始偏移
+        : count: int,发送的字节数
+        : compressor: protocol.Compressor,指定时数据块的读取和压缩在线程池中执行，压缩后由事件循环发送
+        '''
+        loop = asyncio.get_running_loop()
+        end = offset + count
+        while offset < end:
+            size = min(protocol.CHUNK_SIZE, end - offset)
+            if compressor is not None:
+                flags, chunk = await self.runBlocking(self._compressBlock, fileobj, offset, size, compressor)
+                self.writer.write(protocol.HEADER.pack(protocol.CODEC_RAW, flags, len(chunk)))
+                self.writer.write(chunk)
+                self.bytesOut += protocol.HEADER.size + len(chunk)
+                await self.writer.drain()
+                offset += size
+                continue
+            self.writer.write(protocol.HEADER.pack(protocol.CODEC_RAW, 0, size))
+            await self.writer.drain()
+            await loop.sendfile(self.writer.transport, fileobj, offset, size)
+            self.bytesOut += protocol.HEADER.size + size
+            offset += size
+
+    def _compressBlock(self, fileobj, offset, size, compressor):
+        return compressor.frame(os.pread(fileobj.fileno(), size, offset))
+
+    async def sendChunks(self, data, compressor=None):
+        '''
+        : 将一段内存中的数据切分为若干原始数据块发送
+        : data: bytes-like,待发送的数据
+        : compressor: protocol.Compressor,指定时各数据块在线程池中压缩后发送
+        '''
+        view = memoryview(data).cast("B")
+        for pos in range(0, len(view), protocol.CHUNK_SIZE):
+            chunk = view[pos:pos+protocol.CHUNK_SIZE]
+            flags = 0
+            if compressor is not None:
+                flags, chunk = await self.runBlocking(compressor.frame, chunk)
+            self.writer.write(protocol.HEADER.pack(protocol.CODEC_RAW, flags, len(chunk)))
+            self.writer.write(chunk)
+            self.bytesOut += protocol.HEADER.size + len(chunk)
+            await self.writer.drain()
+
+    async def sendFramed(self, fileobj, offset, count):
+        '''
+        : 原样发送文件中已经分好帧的数据，见protocol.Connection.sendFramed
+        '''
+        if count > 0:
+            await self.writer.drain()
+            await asyncio.get_running_loop().sendfile(self.writer.transport, fileobj, offset, count)
+            self.bytesOut += count
+
+    async def _recvRawChunk(self):
+        frame = await self._readFrame()
+        if frame is None:
+            raise protocol.ProtocolError("连接在数据传输中途关闭")
+        codec, flags, body = frame
+        if codec != protocol.CODEC_RAW:
+            raise protocol.ProtocolError("期望原始数据块，实际收到编码类型: " + str(codec))
+        return flags, body
+
+    async def recvChunk(self):
+        '''
+        : 接收一个原始数据块，压缩的数据块在线程池中解压
+        : return -> bytes,数据块内容
+        '''
+        flags, body = await self._recvRawChunk()
+        if flags:
+            return await self.runBlocking(protocol.decompressChunk, flags, body)
+        return body
+
+    def syncChunks(self, count, loop):
+        '''
+        : 供线程池中的阻塞代码使用的数据块迭代器：每取一个数据块，都由事件循环从连接中接收
+        : count: int,需要接收的总字节数
+        : loop: 连接所在的事件循环
+        : return -> 生成器，逐个产生数据块
+        '''
+        while count > 0:
+            #数据块由事件循环接收，解压在调用者所在的线程中进行
+            flags, chunk = asyncio.run_coroutine_threadsafe(self._recvRawChunk(), loop).result()
+            chunk = protocol.decompressChunk(flags, chunk)
+            if len(chunk) > count:
+                raise protocol.ProtocolError("数据块长度超出声明的数据总长度")
+            count -= len(chunk)
+            yield chunk
+
+    async def runBlocking(self, func, *args):
+        '''
+        : 在有界线程池中执行阻塞的函数（例如磁盘I/O）
+        : return -> 函数的返回值
+        '''
+        async with self.server.diskSlots:
+            return await asyncio.get_running_loop().run_in_executor(self.server.executor, func, *args)
+
+
+class AsyncServer():
+    '''
+    : 基于asyncio事件循环的服务器，接口与socketserver.TCPServer保持一致（socket属性、serve_forever方法）
+    '''
+    def __init__(self, server_address, handleRequest, streamHandlers=None, diskWorkers=DISK_WORKERS, metrics=None):
+        '''
+        : 初始化服务器并立即绑定监听端口
+        : server_address: (str, int),监听地址和端口，端口为0时由系统分配
+        : handleRequest: 函数handleRequest(message) -> dict,处理普通请求报文并返回响应报文
+        : streamHandlers: dict,请求类型 -> 协程handler(conn, message)，用于需要收发原始数据块的请求，由该协程自行发送响应
+        : diskWorkers: int,执行阻塞磁盘I/O的线程数
+        : metrics: Common.metrics.Metrics,指定时记录每个请求的处理时间、收发字节数和活动连接数
+        '''
+        self.handleRequest = handleRequest
+        self.metrics = metrics
+        self.streamHandlers = streamHandlers or {}
+        self.executor = ThreadPoolExecutor(max_workers=diskWorkers)
+        self.diskSlots = None
+        self.socket = socket.create_server(server_address, backlog=1024)
+
+    async def _handleClient(self, reader, writer):
+        conn = AsyncConnection(reader, writer, self)
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.connectionOpened()
+        try:
+            while True:
+                bytesIn = conn.bytesIn
+                message = await conn.recv()
+                if message is None:
+                    break
+                started = time.perf_counter()
+                bytesOut = conn.bytesOut
+                error = False
+                handler = self.streamHandlers.get(message.get('request'))
+                if handler is not None:
+                    await handler(conn, message)
+                else:
+                    response = self.handleRequest(message)
+                    error = response.get('response') in ("error", "Error")
+                    await conn.send(protocol.replyTo(message, response))
+                if metrics is not None:
+                    metrics.record(message.get('request'), time.perf_counter() - started, conn.bytesIn - bytesIn, conn.bytesOut - bytesOut, error)
+        except (ConnectionError, protocol.ProtocolError):
+            pass
+        finally:
+            if metrics is not None:
+                metrics.connectionClosed()
+            writer.close()
+
+    async def _serve(self):
+        self.diskSlots = asyncio.Semaphore(DISK_BACKLOG)
+        server = await asyncio.start_server(self._handleClient, sock=self.socket, limit=protocol.READ_BUFFER_SIZE)
+        async with server:
+            await server.serve_forever()
+
+    def serve_forever(self):
+        '''
+        : 运行事件循环，处理请求直到进程退出
+        '''
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.executor.shutdown(wait=False)
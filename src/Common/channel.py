@@ -0,0 +1,186 @@
+import socket
+import threading
+import itertools
+from concurrent.futures import Future
+
+from Common import protocol
+
+#客户端使用的持久连接池
+#-- 每个服务器端点（IP地址+端口）对应若干条长连接（Channel），连接在多次请求之间复用，不再为每个请求建立新的TCP连接
+#-- 每条连接支持请求流水线：请求报文带有请求ID（rid），发送后无需等待响应即可继续发送下一个请求，
+#-- 连接上的接收线程按rid将响应分发给对应的请求
+#-- 服务器按请求到达的顺序依次处理同一连接上的请求，因此紧跟在响应报文后的原始数据块总是属于该响应
+
+PIPELINE_DEPTH = 16      #单条连接上允许同时等待响应的请求数，超过后连接池优先建立新连接
+MAX_CHANNELS = 4         #每个服务器端点最多建立的连接数
+
+
+class Channel():
+    '''
+    : 到单个服务器端点的一条支持流水线的长连接
+    '''
+    def __init__(self, address, port):
+        '''
+        : 建立到指定服务器的长连接，并启动接收线程
+        : address: str,服务器IP地址
+        : port: int,服务器端口
+        '''
+        self.address = address
+        self.port = int(port)
+        self.conn = protocol.connect(address, port)
+        self.sendLock = threading.Lock()     #保证一个请求报文及其后续数据块连续发送
+        self.pendingLock = threading.Lock()
+        self.pending = {}                    #等待响应的请求表：rid -> (Future, 响应处理函数)
+        self.requestIds = itertools.count(1)
+        self.closed = False
+
+        self.reader = threading.Thread(target=self._readLoop, daemon=True)
+        self.reader.start()
+
+    def inFlight(self):
+        '''
+        : 返回该连接上正在等待响应的请求数
+        '''
+        return len(self.pending)
+
+    def submit(self, message, sendBody=None, onResponse=None):
+        '''
+        : 在该连接上发送一个请求，不等待响应
+        : message: dict,请求报文，发送前会被加上请求ID字段rid
+        : sendBody: 可选函数sendBody(conn)，在请求报文之后紧接着发送原始数据块
+        : onResponse: 可选函数onResponse(conn, response)，在接收线程中处理响应报文（例如接收紧随其后的数据块），其返回值作为请求的结果
+        : return -> Future,请求的结果，默认为响应报文
+        '''
+        future = Future()
+        with self.sendLock:
+            if self.closed:
+                raise ConnectionError("连接已关闭")
+            rid = next(self.requestIds)
+            message = dict(message, rid=rid)
+            with self.pendingLock:
+                self.pending[rid] = (future, onResponse)
+            try:
+                self.conn.send(message)
+                if sendBody is not None:
+                    sendBody(self.conn)
+            except Exception as e:
+                self._fail(e)
+                raise
+        return future
+
+    def _readLoop(self):
+        '''
+        : 接收线程：依次读取响应报文，并根据rid交给对应的请求
+        '''
+        try:
+            while True:
+                response = self.conn.recv()
+                if response is None:
+                    raise ConnectionError("服务器关闭了连接")
+                with self.pendingLock:
+                    future, onResponse = self.pending.pop(response.get('rid'), (None, None))
+                if future is None:
+                    raise protocol.ProtocolError("收到未知请求ID的响应: " + str(response.get('rid')))
+                try:
+                    result = onResponse(self.conn, response) if onResponse else response
+                except Exception as e:
+                    #响应处理函数出错时无法确定数据块是否已被完整读取，连接状态不可再信任，只能关闭连接
+                    future.set_exception(e)
+                    raise
+                future.set_result(result)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        '''
+        : 连接出错后关闭连接，并使所有等待中的请求失败
+        '''
+        self.close()
+        with self.pendingLock:
+            pending = list(self.pending.values())
+            self.pending.clear()
+        for future, onResponse in pending:
+            if not future.done():
+                future.set_exception(ConnectionError("连接中断: " + str(error)))
+
+    def close(self):
+        '''
+        : 关闭连接，接收线程随之退出
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+
+class ConnectionPool():
+    '''
+    : 按服务器端点管理长连接的连接池，可被多个线程同时使用
+    '''
+    def __init__(self, maxChannels=MAX_CHANNELS, pipelineDepth=PIPELINE_DEPTH):
+        '''
+        : 初始化连接池
+        : maxChannels: int,每个服务器端点最多建立的连接数
+        : pipelineDepth: int,单条连接上希望同时等待响应的最大请求数
+        '''
+        self.maxChannels = maxChannels
+        self.pipelineDepth = pipelineDepth
+        self.lock = threading.Lock()
+        self.channels = {}      #(address, port) -> [Channel]
+
+    def channel(self, address, port):
+        '''
+        : 为指定端点选择一条连接：优先复用等待请求最少的连接，所有连接都已满载且未达到上限时建立新连接
+        : return -> Channel
+        '''
+        key = (address, int(port))
+        with self.lock:
+            channels = [ch for ch in self.channels.get(key, []) if not ch.closed]
+            self.channels[key] = channels
+            best = min(channels, key=Channel.inFlight, default=None)
+            if best is not None and (best.inFlight() < self.pipelineDepth or len(channels) >= self.maxChannels):
+                return best
+        channel = Channel(address, port)
+        with self.lock:
+            self.channels.setdefault(key, []).append(channel)
+        return channel
+
+    def inFlight(self, address, port):
+        '''
+        : 返回到指定端点的所有连接上正在等待响应的请求数，可作为该端点当前负载的估计
+        '''
+        with self.lock:
+            return sum(ch.inFlight() for ch in self.channels.get((address, int(port)), []) if not ch.closed)
+
+    def submit(self, address, port, message, sendBody=None, onResponse=None):
+        '''
+        : 向指定端点发送一个请求，不等待响应
+        : 参数含义同Channel.submit
+        : return -> Future
+        '''
+        try:
+            return self.channel(address, port).submit(message, sendBody, onResponse)
+        except (OSError, protocol.ProtocolError):
+            #复用的长连接可能已经被服务器关闭，此时换一条新连接重试一次
+            return self.channel(address, port).submit(message, sendBody, onResponse)
+
+    def call(self, address, port, message, sendBody=None, onResponse=None):
+        '''
+        : 向指定端点发送一个请求并等待结果
+        : return -> 请求的结果
+        '''
+        return self.submit(address, port, message, sendBody, onResponse).result()
+
+    def close(self):
+        '''
+        : 关闭连接池中的所有连接
+        '''
+        with self.lock:
+            channels = [ch for chs in self.channels.values() for ch in chs]
+            self.channels = {}
+        for channel in channels:
+            channel.close()
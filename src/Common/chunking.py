@@ -0,0 +1,71 @@
+import re
+import zlib
+
+#内容定义的分块，供分块存储（Server.chunkStore）和增量写入（Common.delta）使用
+#-- 只在"候选字节"（CANDIDATE_BYTES中的字节）处考虑切分，候选位置由正则表达式在C代码中查找，
+#-- 对候选位置之前WINDOW个字节计算crc32，其低位全为0时在该位置之后切分；边界只取决于附近的内容，
+#-- 因此在文件中插入或删除数据只影响附近的一两个数据块，其余数据块保持不变
+#-- 数据块长度限制在[minChunk, maxChunk]之间，没有合适边界的数据（例如全0）按maxChunk切分
+
+MIN_CHUNK = 8 * 1024
+MAX_CHUNK = 256 * 1024
+WINDOW = 48
+BOUNDARY_MASK = 0x7FF          #候选位置成为边界的概率为1/2048，对随机数据平均块长约64KiB
+CANDIDATE_BYTES = re.compile(b"[\x0a\x2c\x3b\x47\x71\x9e\xc3\xf1]")
+CANDIDATE_RATIO = 32           #随机数据中平均每隔多少个字节出现一个候选字节
+
+
+class Chunker():
+    '''
+    : 流式的内容定义分块器：依次输入数据，输出切分好的数据块
+    '''
+    def __init__(self, minChunk=MIN_CHUNK, maxChunk=MAX_CHUNK, mask=BOUNDARY_MASK):
+        '''
+        : minChunk: int,数据块的最小长度
+        : maxChunk: int,数据块的最大长度
+        : mask: int,候选位置的crc32与mask按位与为0时成为边界，平均块长约为CANDIDATE_RATIO * (mask + 1)
+        '''
+        self.minChunk = max(minChunk, WINDOW)
+        self.maxChunk = maxChunk
+        self.mask = mask
+        self.buffer = bytearray()
+        self.scanned = 0        #缓冲区中已经查找过边界的位置，避免重复查找
+
+    def feed(self, data):
+        '''
+        : 输入数据
+        : data: bytes-like
+        : return -> 生成器，依次产生已经确定边界的数据块
+        '''
+        self.buffer += data
+        return self._cut(False)
+
+    def finish(self):
+        '''
+        : 输入结束
+        : return -> 生成器，依次产生剩余的数据块
+        '''
+        return self._cut(True)
+
+    def _cut(self, final):
+        buf = self.buffer
+        while buf:
+            limit = min(len(buf), self.maxChunk)
+            cut = None
+            for match in CANDIDATE_BYTES.finditer(buf, max(self.scanned, self.minChunk - 1), limit):
+                end = match.start() + 1
+                if zlib.crc32(buf[end - WINDOW:end]) & self.mask == 0:
+                    cut = end
+                    break
+            if cut is None:
+                if len(buf) >= self.maxChunk:
+                    cut = self.maxChunk
+                elif final:
+                    cut = len(buf)
+                else:
+                    self.scanned = max(limit - 1, 0)     #最后一个字节还可能与之后的数据组成边界窗口，下次从这里继续查找
+                    return
+            chunk = bytes(buf[:cut])
+            del buf[:cut]
+            self.scanned = 0
+            yield chunk
@@ -0,0 +1,134 @@
+import math
+import hashlib
+
+from Common.chunking import Chunker, CANDIDATE_RATIO
+from Common import protocol
+
+#增量写入（与rsync相同的思路：只发送文件中变化的部分）
+#-- 文件服务器将文件当前版本切分为数据块，返回各数据块的签名（摘要和长度）；
+#-- 客户端用同样的参数切分新内容，摘要与某个旧数据块相同的数据块只发送其在旧版本中的位置（复制指令），其余数据块作为字面数据发送；
+#-- 文件服务器按指令从旧版本复制数据、插入字面数据，生成文件的新版本
+#-- rsync在客户端对每个字节位置滚动计算校验和来寻找与旧数据块相同的位置；这里改为按内容定义的边界切分（Common.chunking，
+#-- 其边界由候选字节之前窗口内的crc32决定），切分在C代码中完成，插入或删除数据后边界同样会重新对齐，
+#-- 因此改动之后的内容仍然能与旧数据块匹配，且不需要逐字节的Python循环
+#-- 平均块长按文件长度选择：块越小改动需要重传的字面数据越少，但签名越多，取两者之和近似最小的块长
+
+DIGEST_SIZE = 16                  #数据块摘要（BLAKE2b）的字节数
+SIGNATURE_BYTES = 24              #每个数据块的签名在报文中大约占用的字节数（摘要和长度）
+MIN_AVERAGE = 2 * 1024            #平均块长的下限
+MAX_AVERAGE = 256 * 1024          #平均块长的上限
+
+
+def deltaParams(size):
+    '''
+    : 根据文件长度选择分块参数，使签名的总长度与一次小改动需要重传的字面数据长度相当
+    : size: int,文件长度
+    : return -> dict,Chunker的参数minChunk/maxChunk/mask
+    '''
+    average = min(max(math.sqrt(size * SIGNATURE_BYTES), MIN_AVERAGE), MAX_AVERAGE)
+    candidates = 1
+    while candidates * CANDIDATE_RATIO * 2 <= average:
+        candidates *= 2
+    return {"minChunk": int(average // 4), "maxChunk": int(average * 4), "mask": candidates - 1}
+
+def blockDigest(block):
+    return hashlib.blake2b(block, digest_size=DIGEST_SIZE).digest()
+
+def signatures(pieces, params):
+    '''
+    : 计算文件内容的签名
+    : pieces: 可迭代对象，依次产生文件内容的各部分
+    : params: dict,deltaParams返回的分块参数
+    : return -> (bytes,依次拼接的各数据块摘要, list,各数据块的长度)
+    '''
+    chunker = Chunker(**params)
+    digests = []
+    sizes = []
+    for piece in pieces:
+        for block in chunker.feed(piece):
+            digests.append(blockDigest(block))
+            sizes.append(len(block))
+    for block in chunker.finish():
+        digests.append(blockDigest(block))
+        sizes.append(len(block))
+    return b"".join(digests), sizes
+
+def diff(data, digests, sizes, params):
+    '''
+    : 将新内容与旧版本的签名比较，生成增量指令
+    : data: bytes-like,文件的新内容
+    : digests: bytes,旧版本各数据块的摘要
+    : sizes: list,旧版本各数据块的长度
+    : params: dict,生成签名时使用的分块参数
+    : return -> (list,指令[旧版本中的偏移, 长度]，偏移为None表示字面数据, list,依次发送的字面数据)
+    '''
+    #1. 旧版本中每个摘要第一次出现的位置
+    known = {}
+    offset = 0
+    for i, size in enumerate(sizes):
+        known.setdefault((digests[i*DIGEST_SIZE:(i+1)*DIGEST_SIZE], size), offset)
+        offset += size
+
+    #2. 切分新内容，相邻的复制指令（旧版本中连续的数据块）和相邻的字面数据分别合并
+    ops = []
+    literals = []
+    chunker = Chunker(**params)
+    for block in list(chunker.feed(data)) + list(chunker.finish()):
+        source = known.get((blockDigest(block), len(block)))
+        if source is not None:
+            if ops and ops[-1][0] is not None and ops[-1][0] + ops[-1][1] == source:
+                ops[-1][1] += len(block)
+            else:
+                ops.append([source, len(block)])
+        else:
+            if ops and ops[-1][0] is None:
+                ops[-1][1] += len(block)
+            else:
+                ops.append([None, len(block)])
+            literals.append(block)
+    return ops, literals
+
+def validate(ops, baseSize, literalLength, size):
+    '''
+    : 检查增量指令：复制范围在旧版本之内，字面数据和结果的总长度与报文中声明的长度一致
+    : return -> str,错误信息；指令合法时为None
+    '''
+    literal = 0
+    total = 0
+    for op in ops:
+        if not isinstance(op, (list, tuple)) or len(op) != 2 or not isinstance(op[1], int) or op[1] < 0:
+            return "非法的增量指令: " + str(op)
+        source, length = op
+        if source is None:
+            literal += length
+        elif not isinstance(source, int) or source < 0 or source + length > baseSize:
+            return "复制范围超出文件的旧版本"
+        total += length
+    if literal != literalLength or total != size:
+        return "增量指令与声明的长度不符"
+    return None
+
+def patch(ops, readBase, literalChunks):
+    '''
+    : 按增量指令生成文件的新内容
+    : ops: list,已经过validate检查的增量指令
+    : readBase: 函数readBase(offset, size) -> bytes,读取旧版本中的一段数据
+    : literalChunks: 迭代器，依次产生字面数据（数据块的边界与指令无关）
+    : return -> 生成器，依次产生新内容的各部分，每部分不超过protocol.CHUNK_SIZE
+    '''
+    pending = memoryview(b"")
+    for source, length in ops:
+        if source is not None:
+            for pos in range(0, length, protocol.CHUNK_SIZE):
+                yield readBase(source + pos, min(protocol.CHUNK_SIZE, length - pos))
+            continue
+        while length > 0:
+            if not pending:
+                chunk = next(literalChunks, None)
+                if chunk is None:
+                    raise protocol.ProtocolError("字面数据少于增量指令声明的长度")
+                pending = memoryview(chunk)
+            piece = pending[:length]
+            pending = pending[len(piece):]
+            length -= len(piece)
+            yield piece
@@ -0,0 +1,35 @@
+#文件名的合法性检查，由路径服务器和文件服务器共同使用
+#-- 文件名中的"/"为目录分隔符，文件服务器把文件保存在bucket中对应的子目录下，因此文件名必须是bucket内的相对路径：
+#-- 不能以"/"开头，不能有空的段，也不能有"."、".."或以"."开头的段；
+#-- 以"."开头的段同时保留给文件服务器的内部目录（分块存储的.chunks/.manifests、压缩副本的.compressed）
+
+SEPARATOR = "/"
+
+
+def validDocname(docname):
+    '''
+    : 判断文件名是否合法
+    : docname: str,文件名
+    : return -> bool
+    '''
+    if not isinstance(docname, str) or not docname or "\0" in docname:
+        return False
+    return all(segment and not segment.startswith(".") for segment in docname.split(SEPARATOR))
+
+
+def validPrefix(prefix):
+    '''
+    : 判断列出目录时的名称前缀是否合法：空前缀表示根目录，以"/"结尾的前缀表示目录，其余部分须为合法的文件名
+    : prefix: str,名称前缀
+    : return -> bool
+    '''
+    if prefix == "":
+        return True
+    return isinstance(prefix, str) and validDocname(prefix[:-1] if prefix.endswith(SEPARATOR) else prefix)
+
+
+def invalidDocname(docname):
+    '''
+    : 文件名不合法时的响应报文
+    '''
+    return {"response": "Error", "error": "不合法的文件名: %r" % (docname,), "docname": docname}
@@ -0,0 +1,98 @@
+import bisect
+import hashlib
+
+#一致性哈希环
+#-- 每个文件服务器在环上占据VIRTUAL_NODES个虚拟节点，文件名哈希后顺时针找到的第一个虚拟节点所属的服务器即为该文件的存放位置
+#-- 路径服务器和客户端使用相同的服务器列表构造哈希环，即可各自独立地计算出文件所在的服务器
+#-- 加入一个新服务器时，只有落在新虚拟节点与其前驱之间的文件需要迁移到新服务器
+
+VIRTUAL_NODES = 128
+
+
+def hashKey(key):
+    '''
+    : 计算字符串在哈希环上的位置
+    : key: str
+    : return -> int,64位哈希值
+    '''
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing():
+    '''
+    : 带虚拟节点的一致性哈希环
+    '''
+    def __init__(self, nodes=(), vnodes=VIRTUAL_NODES):
+        '''
+        : 初始化哈希环
+        : nodes: 可迭代对象,初始的节点ID
+        : vnodes: int,每个节点的虚拟节点数
+        '''
+        self.vnodes = vnodes
+        self.points = []     #虚拟节点在环上的位置，升序排列
+        self.owners = []     #与points一一对应的节点ID
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def add(self, node):
+        '''
+        : 向环中加入一个节点
+        : node: str,节点ID
+        '''
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.vnodes):
+            point = hashKey(node + "#" + str(i))
+            index = bisect.bisect(self.points, point)
+            self.points.insert(index, point)
+            self.owners.insert(index, node)
+
+    def remove(self, node):
+        '''
+        : 从环中删除一个节点
+        : node: str,节点ID
+        '''
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, owner in kept]
+        self.owners = [owner for point, owner in kept]
+
+    def lookup(self, key):
+        '''
+        : 计算给定的键（文件名）所属的节点
+        : key: str
+        : return -> 节点ID；环为空时返回None
+        '''
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, hashKey(key)) % len(self.points)
+        return self.owners[index]
+
+    def successors(self, key):
+        '''
+        : 从键（文件名）在环上的位置开始顺时针遍历，依次产生互不相同的节点，第一个即为lookup的结果
+        : 用于为文件选择多个副本所在的节点
+        : key: str
+        : return -> 生成器，依次产生节点ID
+        '''
+        if not self.points:
+            return
+        start = bisect.bisect(self.points, hashKey(key))
+        seen = set()
+        for i in range(len(self.points)):
+            owner = self.owners[(start + i) % len(self.points)]
+            if owner not in seen:
+                seen.add(owner)
+                yield owner
+                if len(seen) == len(self.nodes):
+                    return
@@ -0,0 +1,186 @@
+import os
+import gc
+import json
+import threading
+
+#路径服务器元数据（文件服务器列表和文件路径映射）的持久化
+#-- 每次修改元数据都先以记录的形式追加写入预写日志（WAL），每条记录为一行JSON，载入时由C实现的json模块解析，百万条记录只需数秒
+#-- 日志按代（generation）分段：生成快照时切换到新一代日志，快照保存切换时刻的全部元数据，写完后删除旧的日志段
+#-- 重启时先载入快照，再按顺序重放快照之后的日志段，即可恢复全部元数据；日志末尾不完整的记录（进程在写入途中退出）被截掉
+#-- 记录中保存的是修改后的完整表项，重放同一条记录多次的结果相同，因此快照与日志之间有少量重叠也不影响恢复的结果
+
+SNAPSHOT_EVERY = 100000       #追加这么多条日志记录后生成一次快照
+SNAPSHOT_BATCH = 4096         #快照中每行保存的文件路径映射表项数
+SNAPSHOT_NAME = "snapshot"
+LOG_PREFIX = "wal."
+
+
+def applyRecord(record, servers, files):
+    '''
+    : 将一条日志记录应用到元数据上
+    : record: dict,日志记录
+    : servers: dict,文件服务器列表
+    : files: dict,文件路径映射
+    '''
+    op = record['op']
+    if op == "server":
+        servers[record['uuid']] = record['info']
+    elif op == "dropserver":
+        servers.pop(record['uuid'], None)
+    elif op == "file":
+        files[record['docname']] = record['info']
+    elif op == "delete":
+        files.pop(record['docname'], None)
+    else:
+        raise ValueError("未知的日志记录类型: " + str(op))
+
+
+class MetadataLog():
+    '''
+    : 追加写入的元数据日志，带有周期性快照
+    '''
+    def __init__(self, directory, snapshotEvery=SNAPSHOT_EVERY, fsync=False):
+        '''
+        : 初始化元数据日志，随后需要调用recover载入已有的元数据并打开日志
+        : directory: str,保存日志和快照的目录
+        : snapshotEvery: int,追加多少条记录后需要生成快照，0表示不自动生成快照
+        : fsync: bool,是否在每条记录写入后调用fsync，使记录在操作系统崩溃或断电后也不丢失；否则只保证进程退出后不丢失
+        '''
+        self.directory = directory
+        self.snapshotEvery = snapshotEvery
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.logFile = None
+        self.appended = 0              #当前日志段中的记录数
+        self.snapshotting = False
+        os.makedirs(directory, exist_ok=True)
+
+    def _logPath(self, generation):
+        return os.path.join(self.directory, LOG_PREFIX + str(generation))
+
+    def _logGenerations(self):
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith(LOG_PREFIX) and name[len(LOG_PREFIX):].isdigit():
+                generations.append(int(name[len(LOG_PREFIX):]))
+        return sorted(generations)
+
+    def recover(self):
+        '''
+        : 载入快照并重放之后的日志段，然后打开新的日志段用于追加
+        : return -> (文件服务器列表, 文件路径映射, 重放的日志记录数)
+        '''
+        #载入过程中会创建大量对象，暂停循环垃圾回收以免其被反复触发
+        gc.disable()
+        try:
+            return self._recover()
+        finally:
+            gc.enable()
+
+    def _recover(self):
+        servers = {}
+        files = {}
+        generation = 0
+
+        #1. 载入快照：第一行含有快照对应的日志代数和文件服务器列表，之后每行含有一批文件路径映射
+        path = os.path.join(self.directory, SNAPSHOT_NAME)
+        if os.path.isfile(path):
+            with open(path, "rb") as snapshot:
+                header = json.loads(snapshot.readline())
+                generation = header['generation']
+                servers.update(header['servers'])
+                for line in snapshot:
+                    files.update(json.loads(line))
+
+        #2. 依次重放快照之后的各个日志段
+        replayed = 0
+        generations = [g for g in self._logGenerations() if g >= generation]
+        for g in generations:
+            replayed += self._replay(self._logPath(g), servers, files)
+
+        #3. 打开新一代的日志段，之后的修改追加到其中
+        self.generation = max(generations + [generation]) + 1
+        self.logFile = open(self._logPath(self.generation), "ab")
+        self.appended = replayed
+        return servers, files, replayed
+
+    def _replay(self, path, servers, files):
+        count = 0
+        good = 0
+        with open(path, "r+b") as logFile:
+            for line in logFile:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                applyRecord(record, servers, files)
+                good += len(line)
+                count += 1
+            #进程在写入记录的途中退出时，截掉末尾不完整的记录
+            logFile.truncate(good)
+        return count
+
+    def append(self, record):
+        '''
+        : 追加一条日志记录；调用者应在修改元数据的同一把锁之内调用，使日志中记录的顺序与实际修改的顺序一致
+        : record: dict,日志记录
+        : return -> bool,是否应当生成快照
+        '''
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self.lock:
+            self.logFile.write(line)
+            self.logFile.flush()
+            if self.fsync:
+                os.fsync(self.logFile.fileno())
+            self.appended += 1
+            due = self.snapshotEvery > 0 and self.appended >= self.snapshotEvery and not self.snapshotting
+            if due:
+                self.snapshotting = True
+            return due
+
+    def rotate(self):
+        '''
+        : 切换到新一代的日志段；调用者应在持有元数据锁时调用，并同时复制当前的元数据，随后用writeSnapshot将其写入快照
+        : return -> int,新日志段的代数，也就是快照对应的代数
+        '''
+        with self.lock:
+            self.logFile.close()
+            self.generation += 1
+            self.logFile = open(self._logPath(self.generation), "ab")
+            self.appended = 0
+            return self.generation
+
+    def writeSnapshot(self, generation, servers, files):
+        '''
+        : 将元数据写入快照，完成后删除快照之前的日志段；可以在后台线程中执行
+        : generation: int,rotate返回的代数
+        : servers: dict,rotate时刻的文件服务器列表
+        : files: dict,rotate时刻的文件路径映射
+        '''
+        try:
+            path = os.path.join(self.directory, SNAPSHOT_NAME)
+            temp = path + ".tmp"
+            with open(temp, "wb") as snapshot:
+                snapshot.write(json.dumps({"generation": generation, "servers": servers}).encode("utf-8") + b"\n")
+                items = list(files.items())
+                for start in range(0, len(items), SNAPSHOT_BATCH):
+                    snapshot.write(json.dumps(dict(items[start:start + SNAPSHOT_BATCH]), separators=(",", ":")).encode("utf-8") + b"\n")
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(temp, path)      #快照写完后才替换旧快照，写入途中退出时旧快照和日志仍然完整
+
+            for g in self._logGenerations():
+                if g < generation:
+                    os.remove(self._logPath(g))
+        finally:
+            with self.lock:
+                self.snapshotting = False
+
+    def close(self):
+        with self.lock:
+            if self.logFile is not None:
+                self.logFile.close()
+                self.logFile = None
@@ -0,0 +1,246 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#三个服务器共用的运行指标
+#-- 按请求类型统计请求数、错误数、处理延迟的直方图以及收发的字节数，另有活动连接数、自定义计数器、直方图（例如锁的等待时间）和即时读取的指标
+#-- 指标可以通过各服务器的stats请求以字典形式读取，也可以导出为Prometheus文本格式，或由--metrics-port指定的HTTP端口供Prometheus抓取
+#-- 每次记录只在一把锁内做几次加法和一次二分查找，开销远小于处理请求本身
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)   #直方图各桶的上界（秒）
+MAX_REQUEST_TYPES = 64       #分别统计的请求类型数上限，之后出现的类型（例如非法请求）都计入OTHER，避免指标数量随请求内容无限增长
+OTHER = "other"
+PREFIX = "mydfs"
+
+
+class Histogram():
+    '''
+    : 固定分桶的直方图
+    '''
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)      #最后一个桶为+Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        '''
+        : 估计分位数：返回累计数达到q的桶的上界，落在最后一个桶时返回最大的有限上界
+        '''
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.buckets[min(i, len(self.buckets) - 1)]
+        return self.buckets[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "p999": self.quantile(0.999),
+            "buckets": [[bound, count] for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts)],
+        }
+
+
+class Metrics():
+    '''
+    : 一个服务器进程的全部运行指标
+    '''
+    def __init__(self, server):
+        '''
+        : server: str,服务器名称，作为Prometheus指标的server标签
+        '''
+        self.server = server
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = {}          #请求类型 -> 请求数
+        self.errors = {}            #请求类型 -> 返回错误响应的请求数
+        self.latency = {}           #请求类型 -> Histogram
+        self.bytesIn = {}           #请求类型 -> 接收的字节数（含请求报文和之后的数据块）
+        self.bytesOut = {}          #请求类型 -> 发送的字节数
+        self.activeConnections = 0
+        self.connections = 0        #累计建立的连接数
+        self.counters = {}          #自定义计数器
+        self.histograms = {}        #自定义直方图
+        self.gauges = {}            #名称 -> 无参函数，读取指标时调用
+
+    def _requestKey(self, requestType):
+        requestType = str(requestType)
+        if not requestType.isidentifier():
+            return OTHER       #请求类型会成为Prometheus标签值，只接受标识符形式的名称
+        if requestType in self.requests or len(self.requests) < MAX_REQUEST_TYPES:
+            return requestType
+        return OTHER
+
+    def record(self, requestType, elapsed, bytesIn=0, bytesOut=0, error=False):
+        '''
+        : 记录一个处理完成的请求
+        : requestType: str,请求类型
+        : elapsed: float,处理时间（秒）
+        : bytesIn: int,接收的字节数
+        : bytesOut: int,发送的字节数
+        : error: bool,是否返回了错误响应
+        '''
+        with self.lock:
+            key = self._requestKey(requestType)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if error:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(elapsed)
+            self.bytesIn[key] = self.bytesIn.get(key, 0) + bytesIn
+            self.bytesOut[key] = self.bytesOut.get(key, 0) + bytesOut
+
+    def connectionOpened(self):
+        with self.lock:
+            self.activeConnections += 1
+            self.connections += 1
+
+    def connectionClosed(self):
+        with self.lock:
+            self.activeConnections -= 1
+
+    def increment(self, name, count=1):
+        '''
+        : 增加自定义计数器
+        '''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def observe(self, name, value):
+        '''
+        : 向自定义直方图中加入一个观测值（秒）
+        '''
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, func):
+        '''
+        : 注册一个即时读取的指标，例如文件数
+        : func: 无参函数，返回数值
+        '''
+        self.gauges[name] = func
+
+    def snapshot(self):
+        '''
+        : return -> dict,全部指标的当前值
+        '''
+        gauges = {name: func() for name, func in self.gauges.items()}
+        with self.lock:
+            return {
+                "server": self.server,
+                "uptime": time.time() - self.started,
+                "activeConnections": self.activeConnections,
+                "connections": self.connections,
+                "requests": {key: {
+                    "count": count,
+                    "errors": self.errors.get(key, 0),
+                    "bytesIn": self.bytesIn.get(key, 0),
+                    "bytesOut": self.bytesOut.get(key, 0),
+                    "latency": self.latency[key].snapshot(),
+                } for key, count in self.requests.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+                "gauges": gauges,
+            }
+
+    def prometheus(self):
+        '''
+        : 将全部指标导出为Prometheus文本格式
+        : return -> str
+        '''
+        lines = []
+        server = 'server="%s"' % self.server
+
+        def metric(name, kind, samples):
+            lines.append("# TYPE %s_%s %s" % (PREFIX, name, kind))
+            for labels, value in samples:
+                lines.append("%s_%s{%s} %s" % (PREFIX, name, labels, repr(float(value)) if isinstance(value, float) else value))
+
+        def histogram(name, labels, data):
+            cumulative = 0
+            for bound, count in zip(list(data.buckets) + ["+Inf"], data.counts):
+                cumulative += count
+                lines.append('%s_%s_bucket{%s,le="%s"} %d' % (PREFIX, name, labels, bound, cumulative))
+            lines.append("%s_%s_sum{%s} %r" % (PREFIX, name, labels, data.sum))
+            lines.append("%s_%s_count{%s} %d" % (PREFIX, name, labels, data.count))
+
+        gauges = {name: func() for name, func in self.gauges.items()}
+        with self.lock:
+            labels = {key: '%s,request="%s"' % (server, key) for key in self.requests}
+            metric("requests_total", "counter", [(labels[key], count) for key, count in self.requests.items()])
+            metric("request_errors_total", "counter", [(labels[key], self.errors.get(key, 0)) for key in self.requests])
+            metric("received_bytes_total", "counter", [(labels[key], self.bytesIn.get(key, 0)) for key in self.requests])
+            metric("sent_bytes_total", "counter", [(labels[key], self.bytesOut.get(key, 0)) for key in self.requests])
+            lines.append("# TYPE %s_request_duration_seconds histogram" % PREFIX)
+            for key in self.requests:
+                histogram("request_duration_seconds", labels[key], self.latency[key])
+            metric("active_connections", "gauge", [(server, self.activeConnections)])
+            metric("connections_total", "counter", [(server, self.connections)])
+            for name, count in self.counters.items():
+                metric(name + "_total", "counter", [(server, count)])
+            for name, data in self.histograms.items():
+                lines.append("# TYPE %s_%s_seconds histogram" % (PREFIX, name))
+                histogram(name + "_seconds", server, data)
+        for name, value in gauges.items():
+            metric(name, "gauge", [(server, value)])
+        return "\n".join(lines) + "\n"
+
+
+def statsResponse(metrics, msg):
+    '''
+    : 生成stats请求的响应报文；请求中format为"prometheus"时附带Prometheus文本格式的指标
+    : metrics: Metrics,服务器的运行指标
+    : msg: dict,stats请求报文
+    : return -> dict
+    '''
+    response = {"response": "stats", "server": metrics.server, "metrics": metrics.snapshot()}
+    if msg.get('format') == "prometheus":
+        response['text'] = metrics.prometheus()
+    return response
+
+
+def serveHttp(metrics, address, port):
+    '''
+    : 在后台线程中启动HTTP服务，GET /metrics返回Prometheus文本格式的指标
+    : metrics: Metrics,服务器的运行指标
+    : address: str,监听的IP地址
+    : port: int,监听的端口
+    : return -> ThreadingHTTPServer
+    '''
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,76 @@
+from Common.hashRing import hashKey
+
+#文件路径映射（FILE_ADDRESS）的分区表
+#-- 文件名按哈希值划分到PARTITIONS个分区，每个分区由一个路径服务器（分片）负责，各分片只保存自己负责的分区中的文件路径映射，
+#-- 因此元数据请求分散到多个路径服务器进程上，吞吐量随分片数近似线性增长
+#-- 分区表很小（分片地址列表 + 每个分区所属的分片），客户端缓存分区表并直接把请求发给文件名所属的分片；
+#-- 分片收到不属于自己的文件名时返回wrong-shard响应并附带自己的分区表，客户端用它替换缓存的分区表后重新发送请求
+#-- 分区数固定，分片与分区的对应关系由owners给出（默认第i个分区属于第i % 分片数个分片），调整分片时只需修改owners
+
+PARTITIONS = 64
+
+
+def parseShards(text):
+    '''
+    : 解析命令行中的分片列表
+    : text: str,以逗号分隔的"地址:端口"
+    : return -> list,[[地址, 端口]]
+    '''
+    shards = []
+    for item in text.split(","):
+        address, port = item.strip().rsplit(":", 1)
+        shards.append([address, int(port)])
+    return shards
+
+
+class PartitionMap():
+    '''
+    : 文件名 -> 分区 -> 路径服务器分片
+    '''
+    def __init__(self, shards, partitions=PARTITIONS, owners=None, epoch=0):
+        '''
+        : shards: list,各分片的[地址, 端口]
+        : partitions: int,分区数
+        : owners: list,每个分区所属分片的序号，为None时按分区号轮流分配
+        : epoch: int,分区表的版本号，修改分片或owners时增加
+        '''
+        self.shards = [[address, int(port)] for address, port in shards]
+        self.partitions = partitions
+        self.owners = list(owners) if owners is not None else [p % len(self.shards) for p in range(partitions)]
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.shards)
+
+    def partitionOf(self, docname):
+        return hashKey(docname) % self.partitions
+
+    def shardOf(self, docname):
+        '''
+        : return -> int,文件名所属分片的序号
+        '''
+        return self.owners[self.partitionOf(docname)]
+
+    def endpoint(self, docname):
+        '''
+        : return -> (地址, 端口),文件名所属分片的地址
+        '''
+        address, port = self.shards[self.shardOf(docname)]
+        return address, port
+
+    def group(self, docnames):
+        '''
+        : 按所属分片对一批文件名分组
+        : return -> dict,(地址, 端口) -> list,文件名
+        '''
+        groups = {}
+        for docname in docnames:
+            groups.setdefault(self.endpoint(docname), []).append(docname)
+        return groups
+
+    def toMessage(self):
+        return {"epoch": self.epoch, "partitions": self.partitions, "shards": self.shards, "owners": self.owners}
+
+    @classmethod
+    def fromMessage(cls, message):
+        return cls(message['shards'], message['partitions'], message['owners'], message.get('epoch', 0))
@@ -0,0 +1,536 @@
+import struct
+import json
+import base64
+import socket
+import os
+import zlib
+import lzma
+
+#三个服务器与客户端共用的报文分帧协议
+#-- 每个报文由一个定长帧头和一个变长报文体组成，帧头格式为: 编码类型(1字节) + 标志位(1字节) + 报文体长度(4字节，网络字节序)
+#-- 报文体默认使用紧凑的二进制编码（见_encodeValue），JSON编码只作为调试用途保留，接收方根据帧头中的编码类型自动选择解码方式
+#-- 接收方先精确读取帧头，再按帧头给出的长度精确读取整个报文体，因此任意大小的报文都不会被截断
+#-- 原始数据块可以压缩传输，帧头的标志位给出压缩算法（FLAG_ZLIB/FLAG_LZMA），接收方据此自动解压，因此压缩与否只由发送方决定
+
+CODEC_RAW = 0        #原始数据块，报文体为未经编码的文件数据，用于流式传输文件内容
+CODEC_BINARY = 1     #紧凑二进制编码
+CODEC_JSON = 2       #JSON编码，仅用于调试
+
+CODEC_NAMES = {"binary": CODEC_BINARY, "json": CODEC_JSON}
+
+WIRE_CODEC = CODEC_NAMES.get(os.environ.get("DFS_WIRE_CODEC", "binary"), CODEC_BINARY)   #发送报文时使用的默认编码，可通过环境变量DFS_WIRE_CODEC=json切换为调试编码
+
+HEADER = struct.Struct("!BBI")
+MAX_BODY_SIZE = 0xFFFFFFFF
+
+READ_BUFFER_SIZE = 256 * 1024          #接收端缓冲区大小
+ZERO_COPY_THRESHOLD = 64 * 1024        #超过该大小的bytes字段不再拷贝进报文缓冲区，而是作为独立的分片直接发送
+CHUNK_SIZE = 1024 * 1024               #流式传输文件数据时单个数据块的最大长度
+
+FLAG_ZLIB = 0x01       #原始数据块经过zlib压缩
+FLAG_LZMA = 0x02       #原始数据块经过lzma压缩
+COMPRESSION_FLAGS = {"zlib": FLAG_ZLIB, "lzma": FLAG_LZMA}
+COMPRESSION_LEVELS = {"zlib": 6, "lzma": 1}     #各压缩算法的默认压缩级别；lzma的高级别压缩速度远低于网络带宽，默认使用最低级别
+COMPRESSION_THRESHOLD = 4096           #小于该长度的数据块不压缩，压缩带来的节省抵不上额外的开销
+COMPRESSION_SAMPLE = 4096              #较大的数据块先用zlib最低级别试压缩开头的这么多字节，几乎压缩不了（例如已经压缩过的数据）时不再压缩整个数据块
+
+_INT = struct.Struct("!q")
+_FLOAT = struct.Struct("!d")
+_LEN = struct.Struct("!I")
+_KEYLEN = struct.Struct("!H")
+
+
+class ProtocolError(Exception):
+    '''
+    : 报文格式错误或连接在报文中途断开时抛出的异常
+    '''
+    pass
+
+
+def _encodeValue(value, out, parts):
+    '''
+    : 将一个值以二进制编码追加到缓冲区中
+    : value: 待编码的值，支持None/bool/int/float/str/bytes/list/tuple/dict
+    : out: bytearray,当前正在填充的缓冲区
+    : parts: list,已经完成的报文分片列表；较大的bytes字段会作为单独的分片加入该列表以避免拷贝
+    : return -> 编码后当前正在填充的缓冲区
+    '''
+    if value is None:
+        out += b"N"
+    elif value is True:
+        out += b"T"
+    elif value is False:
+        out += b"F"
+    elif isinstance(value, int):
+        out += b"i"
+        out += _INT.pack(value)
+    elif isinstance(value, float):
+        out += b"d"
+        out += _FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += b"s"
+        out += _LEN.pack(len(data))
+        out += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        size = memoryview(value).nbytes
+        out += b"b"
+        out += _LEN.pack(size)
+        if size >= ZERO_COPY_THRESHOLD:
+            parts.append(out)
+            parts.append(memoryview(value).cast("B"))
+            out = bytearray()
+        else:
+            out += value
+    elif isinstance(value, (list, tuple)):
+        out += b"l"
+        out += _LEN.pack(len(value))
+        for item in value:
+            out = _encodeValue(item, out, parts)
+    elif isinstance(value, dict):
+        out += b"m"
+        out += _LEN.pack(len(value))
+        for key, item in value.items():
+            key = str(key).encode("utf-8")
+            out += _KEYLEN.pack(len(key))
+            out += key
+            out = _encodeValue(item, out, parts)
+    else:
+        raise TypeError("无法编码的报文字段类型: " + type(value).__name__)
+    return out
+
+
+def _decodeValue(view, pos):
+    '''
+    : 从二进制报文体的指定位置解码出一个值
+    : view: memoryview,报文体
+    : pos: int,起始位置
+    : return -> (解码得到的值, 下一个值的起始位置)
+    '''
+    tag = view[pos]
+    pos += 1
+    if tag == 0x4E:     # N
+        return None, pos
+    elif tag == 0x54:   # T
+        return True, pos
+    elif tag == 0x46:   # F
+        return False, pos
+    elif tag == 0x69:   # i
+        return _INT.unpack_from(view, pos)[0], pos + _INT.size
+    elif tag == 0x64:   # d
+        return _FLOAT.unpack_from(view, pos)[0], pos + _FLOAT.size
+    elif tag == 0x73:   # s
+        size = _LEN.unpack_from(view, pos)[0]
+        pos += _LEN.size
+        return str(view[pos:pos+size], "utf-8"), pos + size
+    elif tag == 0x62:   # b
+        size = _LEN.unpack_from(view, pos)[0]
+        pos += _LEN.size
+        return view[pos:pos+size].tobytes(), pos + size
+    elif tag == 0x6C:   # l
+        count = _LEN.unpack_from(view, pos)[0]
+        pos += _LEN.size
+        items = []
+        for i in range(count):
+            item, pos = _decodeValue(view, pos)
+            items.append(item)
+        return items, pos
+    elif tag == 0x6D:   # m
+        count = _LEN.unpack_from(view, pos)[0]
+        pos += _LEN.size
+        items = {}
+        for i in range(count):
+            size = _KEYLEN.unpack_from(view, pos)[0]
+            pos += _KEYLEN.size
+            key = str(view[pos:pos+size], "utf-8")
+            pos += size
+            items[key], pos = _decodeValue(view, pos)
+        return items, pos
+    else:
+        raise ProtocolError("未知的字段类型标记: " + repr(chr(tag)))
+
+
+def _jsonDefault(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    raise TypeError("无法编码的报文字段类型: " + type(value).__name__)
+
+
+def _jsonObjectHook(value):
+    if len(value) == 1 and "__bytes__" in value:
+        return base64.b64decode(value["__bytes__"])
+    return value
+
+
+class Compressor():
+    '''
+    : 原始数据块的压缩器，由发送方使用；数据块太小或压缩后没有变小时按未压缩的原始数据块发送
+    '''
+    def __init__(self, codec, level=None, threshold=COMPRESSION_THRESHOLD):
+        '''
+        : codec: str,压缩算法，COMPRESSION_FLAGS中的一个
+        : level: int,压缩级别，为None时使用该算法的默认级别
+        : threshold: int,参与压缩的数据块的最小长度
+        '''
+        if codec not in COMPRESSION_FLAGS:
+            raise ValueError("不支持的压缩算法: " + str(codec))
+        self.codec = codec
+        self.level = COMPRESSION_LEVELS[codec] if level is None else level
+        self.threshold = threshold
+        self.flag = COMPRESSION_FLAGS[codec]
+        self.rawBytes = 0         #交给压缩器的数据总长度
+        self.wireBytes = 0        #实际发送的数据总长度
+
+    def frame(self, chunk):
+        '''
+        : 压缩一个数据块
+        : chunk: bytes-like,数据块
+        : return -> (帧头标志位, 需要发送的数据)
+        '''
+        flags, payload = 0, chunk
+        if len(chunk) >= self.threshold and self._compressible(chunk):
+            if self.codec == "zlib":
+                compressed = zlib.compress(chunk, self.level)
+            else:
+                compressed = lzma.compress(chunk, preset=self.level)
+            if len(compressed) < len(chunk):
+                flags, payload = self.flag, compressed
+        self.rawBytes += len(chunk)
+        self.wireBytes += len(payload)
+        return flags, payload
+
+    def _compressible(self, chunk):
+        if len(chunk) < 4 * COMPRESSION_SAMPLE:
+            return True
+        return len(zlib.compress(chunk[:COMPRESSION_SAMPLE], 1)) < COMPRESSION_SAMPLE * 0.95
+
+    def stats(self):
+        return {"codec": self.codec, "level": self.level, "rawBytes": self.rawBytes, "wireBytes": self.wireBytes}
+
+
+def decompressChunk(flags, body):
+    '''
+    : 按帧头的标志位解压一个原始数据块
+    : flags: int,帧头标志位
+    : body: bytes-like,数据块
+    : return -> bytes-like,解压后的数据块
+    '''
+    #发送方的数据块在压缩前不超过CHUNK_SIZE，解压结果超过该长度的数据块视为格式错误，避免解压出任意大小的数据
+    if flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        chunk = decompressor.decompress(body, CHUNK_SIZE)
+        complete = decompressor.eof and not decompressor.unconsumed_tail
+    elif flags & FLAG_LZMA:
+        decompressor = lzma.LZMADecompressor()
+        chunk = decompressor.decompress(body, CHUNK_SIZE)
+        complete = decompressor.eof
+    else:
+        return body
+    if not complete:
+        raise ProtocolError("压缩的数据块不完整或解压后超过CHUNK_SIZE")
+    return chunk
+
+
+def negotiateCompression(offered, supported):
+    '''
+    : 从请求方可以接受的压缩算法中，按请求方的偏好顺序选出本方也支持的第一个
+    : offered: list,请求方可以接受的压缩算法，可以为None
+    : supported: list,本方允许使用的压缩算法
+    : return -> str,选定的压缩算法；没有共同支持的算法时返回None
+    '''
+    for codec in offered or []:
+        if codec in supported and codec in COMPRESSION_FLAGS:
+            return codec
+    return None
+
+
+def encodeFrame(message, codec=None, flags=0):
+    '''
+    : 将一个报文编码为完整的帧（帧头+报文体）
+    : message: dict,报文
+    : codec: int,报文体编码类型，默认为WIRE_CODEC
+    : flags: int,帧头标志位
+    : return -> 帧的分片列表，按顺序发送即可
+    '''
+    codec = codec or WIRE_CODEC
+    parts = []
+    if codec == CODEC_JSON:
+        body = json.dumps(message, default=_jsonDefault).encode("utf-8")
+        parts.append(body)
+    else:
+        body = _encodeValue(message, bytearray(), parts)
+        parts.append(body)
+
+    size = sum(memoryview(part).nbytes for part in parts)
+    if size > MAX_BODY_SIZE:
+        raise ProtocolError("报文体长度超过上限: " + str(size))
+
+    #帧头与第一个分片合并发送，避免小报文产生两次系统调用
+    parts[0] = HEADER.pack(codec, flags, size) + parts[0]
+    return parts
+
+
+def decodeBody(codec, body):
+    '''
+    : 根据编码类型解码报文体
+    : codec: int,报文体编码类型
+    : body: bytes-like,报文体
+    : return -> dict,报文
+    '''
+    if codec == CODEC_BINARY:
+        view = memoryview(body)
+        message, pos = _decodeValue(view, 0)
+        if pos != len(view):
+            raise ProtocolError("报文体长度与内容不符")
+        return message
+    elif codec == CODEC_JSON:
+        return json.loads(bytes(body), object_hook=_jsonObjectHook)
+    else:
+        raise ProtocolError("未知的报文编码类型: " + str(codec))
+
+
+def readExact(rfile, size):
+    '''
+    : 从缓冲读取流中精确读取指定长度的数据
+    : rfile: 带缓冲的二进制读取流
+    : size: int,需要读取的字节数
+    : return -> bytearray,读取到的数据；若在读取任何数据之前连接已关闭则返回None
+    '''
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    while pos < size:
+        count = rfile.readinto(view[pos:])
+        if not count:
+            if pos == 0:
+                return None
+            raise ProtocolError("连接在报文中途关闭")
+        pos += count
+    return buf
+
+
+def readFrame(rfile):
+    '''
+    : 读取一个完整的帧
+    : rfile: 带缓冲的二进制读取流
+    : return -> (编码类型, 标志位, 报文体)；若连接已关闭则返回None
+    '''
+    header = readExact(rfile, HEADER.size)
+    if header is None:
+        return None
+    codec, flags, size = HEADER.unpack(header)
+    if size == 0:
+        return codec, flags, b""
+    body = readExact(rfile, size)
+    if body is None:
+        raise ProtocolError("连接在报文中途关闭")
+    return codec, flags, body
+
+
+def replyTo(request, response):
+    '''
+    : 将请求报文中的请求ID（rid）复制到响应报文中，使流水线客户端能够将响应与请求对应起来
+    : request: dict,请求报文
+    : response: dict,响应报文
+    : return -> dict,带有请求ID的响应报文
+    '''
+    if "rid" in request:
+        response["rid"] = request["rid"]
+    return response
+
+
+def sendParts(sock, parts):
+    '''
+    : 按顺序发送帧的所有分片
+    : sock: socket,目标连接
+    : parts: list,encodeFrame返回的分片列表
+    : return -> int,发送的字节数
+    '''
+    sent = 0
+    for part in parts:
+        if len(part):
+            sock.sendall(part)
+            sent += memoryview(part).nbytes
+    return sent
+
+
+class Connection():
+    '''
+    : 基于分帧协议的报文连接，封装了一个TCP套接字及其接收缓冲区
+    '''
+    def __init__(self, sock, codec=None):
+        '''
+        : 初始化报文连接
+        : sock: socket,已建立的TCP连接
+        : codec: int,发送报文使用的编码类型，默认为WIRE_CODEC
+        '''
+        self.sock = sock
+        self.codec = codec or WIRE_CODEC
+        self.bytesIn = 0       #累计接收的字节数（含帧头），供服务器统计每个请求收发的数据量
+        self.bytesOut = 0      #累计发送的字节数（含帧头）
+        self.rfile = sock.makefile("rb", buffering=READ_BUFFER_SIZE)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)     #连接在多次请求之间保持，由TCP保活机制探测失效的对端
+        except (OSError, AttributeError):
+            pass
+
+    def send(self, message):
+        '''
+        : 发送一个报文
+        : message: dict,报文
+        '''
+        self.bytesOut += sendParts(self.sock, encodeFrame(message, self.codec))
+
+    def recv(self):
+        '''
+        : 接收一个报文
+        : return -> dict,报文；若对端已关闭连接则返回None
+        '''
+        frame = readFrame(self.rfile)
+        if frame is None:
+            return None
+        codec, flags, body = frame
+        self.bytesIn += HEADER.size + len(body)
+        return decodeBody(codec, body)
+
+    def sendChunks(self, data, compressor=None):
+        '''
+        : 将一段内存中的数据切分为若干原始数据块发送
+        : data: bytes-like,待发送的数据
+        : compressor: Compressor,指定时各数据块压缩后发送
+        '''
+        view = memoryview(data).cast("B")
+        for pos in range(0, len(view), CHUNK_SIZE):
+            chunk = view[pos:pos+CHUNK_SIZE]
+            flags = 0
+            if compressor is not None:
+                flags, chunk = compressor.frame(chunk)
+            self.sock.sendall(HEADER.pack(CODEC_RAW, flags, len(chunk)))
+            self.sock.sendall(chunk)
+            self.bytesOut += HEADER.size + len(chunk)
+
+    def sendFile(self, fileobj, offset, count, compressor=None):
+        '''
+        : 将文件中的一段数据以原始数据块的形式发送，数据通过os.sendfile由内核直接从文件拷贝到套接字
+        : fileobj: 已打开的二进制文件对象
+        : offset: int,起始偏移
+        : count: int,发送的字节数
+        : compressor: Compressor,指定时数据需要先读入内存压缩，不再使用sendfile
+        '''
+        end = offset + count
+        while offset < end:
+            size = min(CHUNK_SIZE, end - offset)
+            if compressor is not None:
+                flags, chunk = compressor.frame(os.pread(fileobj.fileno(), size, offset))
+                self.sock.sendall(HEADER.pack(CODEC_RAW, flags, len(chunk)))
+                self.sock.sendall(chunk)
+                self.bytesOut += HEADER.size + len(chunk)
+                offset += size
+                continue
+            self.sock.sendall(HEADER.pack(CODEC_RAW, 0, size))
+            self.bytesOut += HEADER.size + size
+            if hasattr(os, "sendfile"):
+                sent = 0
+                while sent < size:
+                    count = os.sendfile(self.sock.fileno(), fileobj.fileno(), offset + sent, size - sent)
+                    if count == 0:
+                        raise ProtocolError("文件在发送过程中被截断")
+                    sent += count
+            else:
+                self.sock.sendfile(fileobj, offset, size)
+            offset += size
+
+    def sendFramed(self, fileobj, offset, count):
+        '''
+        : 原样发送文件中已经分好帧的数据（例如预先压缩好的文件副本，其内容为依次排列的帧头+数据块）
+        : fileobj: 已打开的二进制文件对象
+        : offset: int,起始偏移
+        : count: int,发送的字节数
+        '''
+        if count > 0:
+            self.sock.sendfile(fileobj, offset, count)
+            self.bytesOut += count
+
+    def recvChunk(self):
+        '''
+        : 接收一个原始数据块
+        : return -> bytearray,数据块内容
+        '''
+        frame = readFrame(self.rfile)
+        if frame is None:
+            raise ProtocolError("连接在数据传输中途关闭")
+        codec, flags, body = frame
+        if codec != CODEC_RAW:
+            raise ProtocolError("期望原始数据块，实际收到编码类型: " + str(codec))
+        self.bytesIn += HEADER.size + len(body)
+        return decompressChunk(flags, body)
+
+    def recvChunks(self, count):
+        '''
+        : 依次接收原始数据块，直到累计接收到指定长度的数据
+        : count: int,需要接收的总字节数
+        : return -> 生成器，逐个产生数据块
+        '''
+        while count > 0:
+            chunk = self.recvChunk()
+            if len(chunk) > count:
+                raise ProtocolError("数据块长度超出声明的数据总长度")
+            count -= len(chunk)
+            yield chunk
+
+    def recvChunksInto(self, view):
+        '''
+        : 接收原始数据块并直接写入预先分配好的缓冲区，直到缓冲区被填满
+        : view: memoryview,目标缓冲区
+        '''
+        pos = 0
+        while pos < len(view):
+            header = readExact(self.rfile, HEADER.size)
+            if header is None:
+                raise ProtocolError("连接在数据传输中途关闭")
+            codec, flags, size = HEADER.unpack(header)
+            if codec != CODEC_RAW:
+                raise ProtocolError("数据块与声明的数据总长度不符")
+            if flags:
+                #压缩的数据块只能先完整接收再解压到缓冲区中
+                body = readExact(self.rfile, size)
+                if body is None:
+                    raise ProtocolError("连接在数据传输中途关闭")
+                self.bytesIn += HEADER.size + size
+                chunk = decompressChunk(flags, body)
+                if pos + len(chunk) > len(view):
+                    raise ProtocolError("数据块与声明的数据总长度不符")
+                view[pos:pos+len(chunk)] = chunk
+                pos += len(chunk)
+                continue
+            if pos + size > len(view):
+                raise ProtocolError("数据块与声明的数据总长度不符")
+            done = 0
+            while done < size:
+                count = self.rfile.readinto(view[pos+done:pos+size])
+                if not count:
+                    raise ProtocolError("连接在数据传输中途关闭")
+                done += count
+            pos += size
+            self.bytesIn += HEADER.size + size
+
+    def close(self):
+        '''
+        : 关闭连接
+        '''
+        try:
+            self.rfile.close()
+        finally:
+            self.sock.close()
+
+
+def connect(address, port, codec=None):
+    '''
+    : 建立到指定服务器的报文连接
+    : address: str,服务器IP地址
+    : port: int,服务器端口
+    : return -> Connection
+    '''
+    sock = socket.create_connection((address, int(port)))
+    return Connection(sock, codec)
@@ -0,0 +1,178 @@
+import itertools
+import threading
+import time
+
+#路径服务器的回调承诺（与AFS的callback相同的思路）
+#-- 客户端通过一条专用的回调连接订阅后，路径服务器在返回文件的版本时间戳时同时给出一个回调承诺（租期为lease秒）：
+#-- 租期内该文件被其他客户端写入时，路径服务器主动通过回调连接通知该客户端，因此客户端在租期内可以直接使用缓存的文件，不需要询问路径服务器
+#-- 写入请求在收回全部承诺（收到各客户端的确认，或等待超时）之后才返回，此后其他客户端不会再使用旧版本
+#-- 没有在超时之内确认的客户端的回调连接被关闭：客户端发现连接断开时放弃全部承诺；网络分区等情况下客户端最多在租期到期之前使用旧版本
+
+CALLBACK_LEASE = 30          #回调承诺的租期（秒）
+CALLBACK_TIMEOUT = 2         #写入时等待客户端确认的时限（秒）
+
+
+class CallbackChannel():
+    '''
+    : 一个客户端的回调连接；通知由写入请求所在的线程发送，确认由该连接的接收循环交给acknowledge
+    '''
+    def __init__(self, clientid, send, close):
+        '''
+        : clientid: str,客户端ID
+        : send: 函数send(message),在回调连接上发送一个报文，可以在任意线程中调用
+        : close: 函数close(),关闭回调连接
+        '''
+        self.clientid = clientid
+        self.send = send
+        self.close = close
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+        self.waiting = {}          #通知序号 -> threading.Event，收到确认时设置
+        self.closed = False
+
+    def notify(self, docnames):
+        '''
+        : 发送一次失效通知
+        : docnames: list,失效的文件名
+        : return -> threading.Event,收到客户端确认时被设置；发送失败时为None
+        '''
+        with self.lock:
+            if self.closed:
+                return None
+            seq = next(self.sequence)
+            event = self.waiting[seq] = threading.Event()
+            try:
+                self.send({"response": "invalidate", "seq": seq, "docnames": docnames})
+            except Exception:
+                del self.waiting[seq]
+                return None
+        return event
+
+    def acknowledge(self, seq):
+        with self.lock:
+            event = self.waiting.pop(seq, None)
+        if event is not None:
+            event.set()
+
+    def shutdown(self):
+        '''
+        : 关闭回调连接，并使正在等待确认的写入立即返回
+        '''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            waiting, self.waiting = self.waiting, {}
+        for event in waiting.values():
+            event.set()
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class CallbackTable():
+    '''
+    : 文件名 -> 持有回调承诺的客户端，以及各客户端的回调连接
+    '''
+    def __init__(self, lease=CALLBACK_LEASE, timeout=CALLBACK_TIMEOUT):
+        '''
+        : lease: float,回调承诺的租期（秒），0表示不给出承诺
+        : timeout: float,写入时等待客户端确认的时限（秒）
+        '''
+        self.lease = lease
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.holders = {}          #文件名 -> {客户端ID: 承诺到期时间(time.monotonic())}
+        self.channels = {}         #客户端ID -> CallbackChannel
+
+        self.promises = 0
+        self.breaks = 0
+        self.timeouts = 0
+
+    def attach(self, channel):
+        '''
+        : 客户端建立回调连接；同一客户端之前的回调连接被关闭
+        '''
+        with self.lock:
+            previous = self.channels.get(channel.clientid)
+            self.channels[channel.clientid] = channel
+        if previous is not None:
+            previous.shutdown()
+
+    def detach(self, channel):
+        '''
+        : 回调连接断开
+        '''
+        with self.lock:
+            if self.channels.get(channel.clientid) is channel:
+                del self.channels[channel.clientid]
+        channel.shutdown()
+
+    def promise(self, docname, clientid):
+        '''
+        : 给客户端一个文件的回调承诺；应与读取文件的版本时间戳在同一把锁内完成，使之后的写入一定能收回该承诺
+        : return -> float,承诺的租期（秒）；客户端没有回调连接时为None
+        '''
+        if not self.lease:
+            return None
+        with self.lock:
+            if clientid not in self.channels:
+                return None
+            self.holders.setdefault(docname, {})[clientid] = time.monotonic() + self.lease
+            self.promises += 1
+        return self.lease
+
+    def revoke(self, docname, writer=None):
+        '''
+        : 文件被写入时收回其他客户端的回调承诺；应与修改文件的版本时间戳在同一把锁内完成
+        : docname: str,文件名
+        : writer: str,写入者的客户端ID，其承诺不被收回
+        : return -> list,需要通知的CallbackChannel，由调用者在释放锁之后通过breakCallbacks通知
+        '''
+        now = time.monotonic()
+        with self.lock:
+            holders = self.holders.pop(docname, {})
+            kept = holders.pop(writer, None)
+            if kept is not None:
+                self.holders[docname] = {writer: kept}
+            return [self.channels[clientid] for clientid, expires in holders.items() if expires > now and clientid in self.channels]
+
+    def breakCallbacks(self, docname, channels):
+        '''
+        : 通知被收回承诺的客户端，等待全部确认；超时没有确认的客户端的回调连接被关闭
+        '''
+        if not channels:
+            return
+        pending = [(channel, channel.notify([docname])) for channel in channels]
+        deadline = time.monotonic() + self.timeout
+        for channel, event in pending:
+            if event is None or not event.wait(max(deadline - time.monotonic(), 0)):
+                with self.lock:
+                    self.timeouts += 1
+                self.detach(channel)
+        with self.lock:
+            self.breaks += len(channels)
+
+    def expire(self):
+        '''
+        : 删除已经到期的承诺
+        '''
+        now = time.monotonic()
+        with self.lock:
+            for docname in list(self.holders):
+                holders = {clientid: expires for clientid, expires in self.holders[docname].items() if expires > now}
+                if holders:
+                    self.holders[docname] = holders
+                else:
+                    del self.holders[docname]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clients": len(self.channels),
+                "files": len(self.holders),
+                "promises": self.promises,
+                "breaks": self.breaks,
+                "timeouts": self.timeouts,
+            }
@@ -0,0 +1,290 @@
+import os
+import json
+import hashlib
+import threading
+
+from Common.chunking import Chunker
+
+#基于内容分块的文件存储（可选的文件服务器存储后端）
+#-- 文件内容按内容定义的边界切分为数据块，每个数据块以其SHA-256值命名，保存在存储目录的.chunks子目录中，内容相同的数据块只保存一份
+#-- 每个文件对应.manifests子目录中的一个清单，按顺序记录组成该文件的数据块及其长度
+#-- 数据块的引用计数在启动时根据全部清单重新计算，没有被任何清单引用的数据块（例如写入途中进程退出留下的数据块）随之删除
+#-- 切分方法见Common.chunking
+
+CHUNK_DIRECTORY = ".chunks"
+MANIFEST_DIRECTORY = ".manifests"
+NAME_LOCKS = 256             #按文件名哈希分配的写入锁的个数，同一文件的写入和删除依次进行
+
+
+class ChunkedFile():
+    '''
+    : 已打开的分块文件，代替普通文件对象传给读取流程
+    '''
+    def __init__(self, store, chunks, size):
+        self.store = store
+        self.chunks = chunks      #[(数据块哈希, 长度)]
+        self.size = size
+
+    def segments(self, offset, length):
+        '''
+        : 将文件中的一段范围转换为数据块文件中的若干段
+        : offset: int,起始偏移
+        : length: int,长度
+        : return -> 生成器，依次产生(数据块文件路径, 数据块内的偏移, 字节数)
+        '''
+        end = offset + length
+        position = 0
+        for digest, size in self.chunks:
+            if position >= end:
+                break
+            if position + size > offset:
+                start = max(offset - position, 0)
+                stop = min(end - position, size)
+                yield self.store.chunkPath(digest), start, stop - start
+            position += size
+
+    def read(self, offset, length):
+        '''
+        : 读取文件中的一段范围，返回其内容
+        '''
+        parts = []
+        for path, start, count in self.segments(offset, length):
+            with open(path, "rb") as chunkFile:
+                chunkFile.seek(start)
+                parts.append(chunkFile.read(count))
+        return b"".join(parts)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChunkStore():
+    '''
+    : 按内容寻址、带引用计数的数据块存储
+    '''
+    def __init__(self, root, durability=None):
+        '''
+        : 打开存储目录，并根据已有的清单计算数据块的引用计数
+        : root: str,存储目录（文件服务器的bucket）
+        : durability: Server.durability.Durability,新的数据块和清单的刷盘方式，为None时不主动刷盘
+        '''
+        self.root = root
+        self.durability = durability
+        self.chunkDirectory = os.path.join(root, CHUNK_DIRECTORY)
+        self.manifestDirectory = os.path.join(root, MANIFEST_DIRECTORY)
+        os.makedirs(self.chunkDirectory, exist_ok=True)
+        os.makedirs(self.manifestDirectory, exist_ok=True)
+        self.lock = threading.Lock()      #保护引用计数和清单的替换
+        self.nameLocks = [threading.Lock() for i in range(NAME_LOCKS)]
+        self.refcounts = {}
+        self.storedBytes = 0              #数据块实际占用的字节数
+        self.logicalBytes = 0             #全部文件的总长度
+        self._rebuild()
+
+    def _rebuild(self):
+        #文件名中的"/"为目录分隔符，对应的清单保存在清单目录的子目录下
+        for root, dirs, files in os.walk(self.manifestDirectory):
+            for filename in files:
+                if filename.endswith(".tmp"):
+                    os.remove(os.path.join(root, filename))
+                    continue
+                manifest = self._loadManifest(os.path.relpath(os.path.join(root, filename), self.manifestDirectory).replace(os.sep, "/"))
+                self.logicalBytes += manifest['size']
+                for digest, size in manifest['chunks']:
+                    self._addRef(digest, size)
+        for prefix in os.listdir(self.chunkDirectory):
+            for name in os.listdir(os.path.join(self.chunkDirectory, prefix)):
+                if name not in self.refcounts:
+                    os.remove(os.path.join(self.chunkDirectory, prefix, name))
+
+    def chunkPath(self, digest):
+        return os.path.join(self.chunkDirectory, digest[:2], digest)
+
+    def _manifestPath(self, name):
+        return os.path.join(self.manifestDirectory, name)
+
+    def _loadManifest(self, name):
+        with open(self._manifestPath(name), "rb") as manifestFile:
+            return json.loads(manifestFile.read())
+
+    def _addRef(self, digest, size):
+        count = self.refcounts.get(digest, 0)
+        if count == 0:
+            self.storedBytes += size
+        self.refcounts[digest] = count + 1
+
+    def _dropRef(self, digest, size):
+        count = self.refcounts[digest] - 1
+        if count > 0:
+            self.refcounts[digest] = count
+            return
+        del self.refcounts[digest]
+        self.storedBytes -= size
+        try:
+            os.remove(self.chunkPath(digest))
+        except FileNotFoundError:
+            pass
+
+    def _nameLock(self, name):
+        return self.nameLocks[hash(name) % NAME_LOCKS]
+
+    def _storeChunk(self, chunk, created):
+        '''
+        : 保存一个数据块并取得它的一个引用；内容相同的数据块已经存在时不再写入
+        : 引用在写入清单之前取得，其他文件释放该数据块的最后一个引用时不会删除它；写入失败时由调用者释放
+        : created: set,新写入的数据块所在的目录加入其中，由调用者在替换清单之前统一刷盘
+        : return -> (数据块哈希, 长度)
+        '''
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.chunkPath(digest)
+        if not os.path.isfile(path):
+            self._writeChunk(path, chunk, created)
+        with self.lock:
+            self._addRef(digest, len(chunk))
+            if not os.path.isfile(path):
+                #检查之后、取得引用之前，数据块的最后一个引用被其他写入释放而删除
+                self._writeChunk(path, chunk, created)
+        return digest, len(chunk)
+
+    def _writeChunk(self, path, chunk, created):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = path + "." + str(threading.get_ident()) + ".tmp"
+        with open(temp, "wb") as chunkFile:
+            chunkFile.write(chunk)
+            if self.durability is not None:
+                chunkFile.flush()
+                self.durability.syncFile(chunkFile)
+        os.replace(temp, path)
+        created.add(os.path.dirname(path))
+
+    def exists(self, name):
+        return os.path.isfile(self._manifestPath(name))
+
+    def version(self, name):
+        '''
+        : 返回文件当前版本的标识：清单每次被替换时都会改变
+        : return -> str
+        '''
+        stat = os.stat(self._manifestPath(name))
+        return "%d:%d:%d" % (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def open(self, name):
+        '''
+        : 打开文件
+        : name: str,文件名
+        : return -> ChunkedFile
+        '''
+        manifest = self._loadManifest(name)
+        return ChunkedFile(self, manifest['chunks'], manifest['size'])
+
+    def write(self, name, chunks, offset=None):
+        '''
+        : 写入文件：新内容经过分块后，只有之前不存在的数据块被写入磁盘
+        : name: str,文件名
+        : chunks: 可迭代对象，依次产生待写入的数据块
+        : offset: int,写入的起始偏移；为None时表示用新内容替换整个文件
+        : return -> (写入的字节数, 写入后的文件总长度)
+        '''
+        #同一文件的写入依次进行：部分改写读取的旧数据块不会被同时进行的替换删除
+        with self._nameLock(name):
+            return self._write(name, chunks, offset)
+
+    def _write(self, name, chunks, offset):
+        counter = [0]
+        if offset is None:
+            stream = self._counted(chunks, counter)
+        else:
+            #部分改写：新内容 = 原文件中offset之前的部分 + 写入的数据 + 原文件中写入范围之后的部分，未改动部分的数据块与原来相同，不会重复保存
+            old = self.open(name) if self.exists(name) else ChunkedFile(self, [], 0)
+            stream = self._patched(old, chunks, offset, counter)
+
+        chunker = Chunker()
+        entries = []
+        created = set()
+        size = 0
+        try:
+            for data in stream:
+                for chunk in chunker.feed(data):
+                    entries.append(self._storeChunk(chunk, created))
+                    size += len(chunk)
+            for chunk in chunker.finish():
+                entries.append(self._storeChunk(chunk, created))
+                size += len(chunk)
+
+            #清单引用的数据块必须先于清单持久化
+            if self.durability is not None:
+                for directory in created:
+                    self.durability.syncDirectory(directory)
+            self._replaceManifest(name, {"size": size, "chunks": entries})
+        except BaseException:
+            #写入中止时释放已经取得的引用，只被本次写入引用的数据块随之删除
+            with self.lock:
+                for digest, chunkSize in entries:
+                    self._dropRef(digest, chunkSize)
+            raise
+        if self.durability is not None:
+            self.durability.syncDirectory(os.path.dirname(self._manifestPath(name)))
+        return counter[0], size
+
+    def _counted(self, chunks, counter):
+        for chunk in chunks:
+            counter[0] += len(chunk)
+            yield chunk
+
+    def _patched(self, old, chunks, offset, counter):
+        yield old.read(0, min(offset, old.size))
+        if offset > old.size:
+            yield bytes(offset - old.size)
+        for chunk in self._counted(chunks, counter):
+            yield chunk
+        end = offset + counter[0]
+        if end < old.size:
+            for path, start, count in old.segments(end, old.size - end):
+                with open(path, "rb") as chunkFile:
+                    chunkFile.seek(start)
+                    yield chunkFile.read(count)
+
+    def _replaceManifest(self, name, manifest):
+        #清单中各数据块的引用已经由_storeChunk取得，这里只释放旧清单的引用
+        path = self._manifestPath(name)
+        temp = path + "." + str(threading.get_ident()) + ".tmp"
+        if "/" in name:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp, "w") as manifestFile:
+            json.dump(manifest, manifestFile)
+            if self.durability is not None:
+                manifestFile.flush()
+                self.durability.syncFile(manifestFile)
+        with self.lock:
+            old = self._loadManifest(name) if os.path.isfile(path) else None
+            os.replace(temp, path)
+            self.logicalBytes += manifest['size']
+            if old is not None:
+                self.logicalBytes -= old['size']
+                for digest, size in old['chunks']:
+                    self._dropRef(digest, size)
+
+    def delete(self, name):
+        '''
+        : 删除文件，不再被引用的数据块随之删除
+        : return -> bool,文件是否存在并被删除
+        '''
+        with self._nameLock(name), self.lock:
+            if not self.exists(name):
+                return False
+            old = self._loadManifest(name)
+            os.remove(self._manifestPath(name))
+            self.logicalBytes -= old['size']
+            for digest, size in old['chunks']:
+                self._dropRef(digest, size)
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {"chunks": len(self.refcounts), "storedBytes": self.storedBytes, "logicalBytes": self.logicalBytes}
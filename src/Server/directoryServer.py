@@ -1,10 +1,25 @@
 import socketserver
-import json
+import socket
+import asyncio
 import uuid
-import random
 import time
 import os
 import sys
+import argparse
+import threading
+import queue
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Common import protocol
+from Common import asyncServer
+from Common import metrics
+from Common.hashRing import HashRing
+from Common.docnames import validDocname, validPrefix, invalidDocname
+from Common.partitionMap import PartitionMap, PARTITIONS, parseShards
+from Common.metadataLog import MetadataLog, SNAPSHOT_EVERY
+from Server.namespaceIndex import NamespaceIndex
+from Server.callbacks import CallbackTable, CallbackChannel, CALLBACK_LEASE, CALLBACK_TIMEOUT
 
 ADDRESS = "127.0.0.1"
 PORT = 8080
@@ -12,7 +27,40 @@ PORT = 8080
 #文件路径服务器使用典型的SocketServer网络服务框架进行组织
 
 FILE_SERVER = {}     #文件服务器列表
-FILE_ADDRESS = {}    #文件路径映射列表：将单个文件映射到对应的文件服务器
+FILE_ADDRESS = {}    #文件路径映射列表：将单个文件映射到对应的文件服务器；replicas字段为该文件全部副本所在的文件服务器，第一个为主副本
+
+RING = HashRing()                  #由FILE_SERVER中的文件服务器构成的一致性哈希环，决定新文件的存放位置
+NAMESPACE = NamespaceIndex()       #FILE_ADDRESS中全部文件名的有序索引，用于按目录（"/"分隔的前缀）分页列出文件
+METADATA_LOCK = threading.RLock()  #保护FILE_SERVER/FILE_ADDRESS/RING/NAMESPACE，使后台迁移线程能够原子地修改文件路径映射
+
+LIST_LIMIT = 1000                  #list请求每页默认返回的项数，也是每页项数的上限
+
+MIGRATION_RATE = 16 * 1024 * 1024  #新文件服务器加入后，后台迁移文件的速率上限（字节/秒）
+REBALANCE_QUEUE = queue.Queue()    #等待进行文件迁移的新加入文件服务器ID
+REPLICAS = 1                       #每个文件的副本数
+
+SERVER_LOAD = {}                   #文件服务器ID -> {"load": 最近一次心跳报文中的负载指标, "lastSeen": 最近一次收到心跳的时间}，不写入元数据日志
+DEAD_AFTER = 10                    #超过这么多秒没有收到心跳的文件服务器被判定为失效，从哈希环中删除
+PLACEMENT_CHOICES = 2              #为新文件选择副本时，在哈希环上额外考察的候选服务器数，从中选出负载最低的服务器
+MIN_FREE_SPACE = 64 * 1024 * 1024  #剩余空间低于此值的文件服务器不再存放新文件
+QUEUE_WEIGHT = 10                  #计算负载时，正在处理的请求数相对于每秒请求数的权重
+
+STRIPE_SIZE = 16 * 1024 * 1024    #大文件按此长度切分为条带，各条带分别存放在不同的文件服务器上，0表示不切分
+STRIPE_THRESHOLD = 64 * 1024 * 1024   #新文件的长度达到此值时才切分为条带
+
+METADATA_DIRECTORY = os.path.join(os.getcwd(), "DirectoryMetadata")   #元数据日志和快照的保存目录
+METADATA_LOG = None                #元数据日志，FILE_SERVER/FILE_ADDRESS的每次修改都追加写入其中；为None时元数据只保存在内存中
+
+#文件路径映射按文件名哈希分区到多个路径服务器（分片）上（Common.partitionMap），每个分片只保存自己负责的分区中的文件
+#-- 文件服务器加入并向每个分片发送心跳，因此每个分片都有完整的FILE_SERVER和哈希环，可以独立地为自己的文件选择存放位置
+#-- 只启动一个路径服务器时分区表中只有它自己，全部文件都属于它
+PARTITION_MAP = None               #全部分片共用的分区表
+SHARD_INDEX = 0                    #本服务器在分区表中的分片序号
+
+CALLBACKS = CallbackTable()        #客户端持有的回调承诺（Server.callbacks）：文件被写入时主动通知持有承诺的客户端，客户端在租期内可以直接使用缓存
+
+METRICS = metrics.Metrics("directory")     #按请求类型统计的请求数、延迟和收发字节数，通过stats请求或--metrics-port读取
+LOG = logging.getLogger("directory")
 
 def fileExistsTest(docname):
     '''
@@ -36,6 +84,52 @@ def getFileAddress(docname):
     else:
         return None
 
+def ownsDocname(docname):
+    '''
+    : 判断文件名是否属于本分片
+    '''
+    return PARTITION_MAP is None or PARTITION_MAP.shardOf(docname) == SHARD_INDEX
+
+def wrongShard(docname):
+    '''
+    : 文件名不属于本分片时的响应报文，附带本分片的分区表，客户端据此更新缓存的分区表后重新发送请求
+    '''
+    return {"response": "wrong-shard", "docname": docname, "shard": PARTITION_MAP.shardOf(docname), "partitions": PARTITION_MAP.toMessage()}
+
+def promiseCallback(message):
+    '''
+    : 为发出请求的客户端登记文件的回调承诺
+    : 必须在读取文件的版本时间戳之前登记：之后修改时间戳的写入一定能收回该承诺，之前的写入修改的时间戳一定能被读到
+    : message: dict,请求报文
+    : return -> float,承诺的租期（秒）；客户端没有回调连接时为None
+    '''
+    if message.get('clientid') is None:
+        return None
+    return CALLBACKS.promise(message['docname'], message['clientid'])
+
+def writeAndRevoke(message):
+    '''
+    : 处理write请求：修改文件的版本时间戳，收回其他客户端对该文件的回调承诺，写入者本身得到新的承诺
+    : message: dict,write请求报文
+    : return -> (响应报文, 需要通知的回调连接)
+    '''
+    lease = promiseCallback(message)
+    response = handleRequest(message)
+    channels = []
+    if response['response'] in ("write-exists", "write-null"):
+        channels = CALLBACKS.revoke(message['docname'], message.get('clientid'))
+        if lease:
+            response['lease'] = lease
+    return response, channels
+
+def callbackWorker():
+    '''
+    : 后台线程：定期删除已经到期的回调承诺
+    '''
+    while True:
+        time.sleep(max(CALLBACKS.lease, 1))
+        CALLBACKS.expire()
+
 def addFileAddress(docname, nodeID, address, port, timestamp):
     '''
     : 向指定的文件服务器中加入新文件
@@ -52,133 +146,795 @@ def deleteFileMapping(docname):
     : 从文件路径中删除文件
     : docname: 待删除文件名
     '''
-    del FILE_ADDRESS[docname]
+    with METADATA_LOCK:
+        del FILE_ADDRESS[docname]
+        NAMESPACE.remove(docname)
+        logMetadata({"op": "delete", "docname": docname})
 
-def getRandomServer():
+def setFileMapping(docname, fileinfo):
     '''
-    : 随机选择一个文件服务器
-    : return -> 随机一个文件服务器的IP地址和端口号
+    : 设置文件的路径映射，并写入元数据日志
+    : docname: str,文件名
+    : fileinfo: dict,文件路径映射；之后不应再原地修改，需要修改时用新的dict替换
     '''
-    index = random.randint(0, len(FILE_SERVER)-1)
-    return FILE_SERVER.items()[index]
+    with METADATA_LOCK:
+        FILE_ADDRESS[docname] = fileinfo
+        NAMESPACE.add(docname)
+        logMetadata({"op": "file", "docname": docname, "info": fileinfo})
 
+def setFileServer(nodeID, info):
+    '''
+    : 加入或更新文件服务器，并写入元数据日志
+    : nodeID: str,文件服务器ID
+    : info: dict,文件服务器信息
+    '''
+    with METADATA_LOCK:
+        FILE_SERVER[nodeID] = info
+        RING.add(nodeID)
+        logMetadata({"op": "server", "uuid": nodeID, "info": info})
 
-class ThreadedHandler(socketserver.BaseRequestHandler):
+def dropFileServer(nodeID):
     '''
-    : SocketServer 网络服务框架组件
-    : 继承自类socketserver.BaseRequestHandler，该组件协调处理本文件路径服务器与客户端之间的通信，负责处理客户端发来的请求报文
+    : 删除失效的文件服务器：此后新文件不再放在该服务器上，返回给客户端的文件位置中也不再包含该服务器上的副本
+    : 附注: 失效服务器上的副本不会自动在其他服务器上重建，文件仍可从其他副本读取
+    : nodeID: str,文件服务器ID
     '''
-    def handle(self):
-        message = self.request.recv(1024)
-        message = json.loads(message)
-        requestType = message['request']
-        response = ""
-
-        #1. 处理客户端发来的open指令报文
-        #-- open报文的处理步骤较为简单，如下所示：
-        #-- a. 提取报文中的文件名
-        #-- b. 根据报文中的目标文件名，使用文件路径服务器的getFileAddress方法，获得文件具体位置信息（包括文件所在文件服务器地址，文件服务器端口等）
-        #-- c. 根据上一步骤中得到的位置信息，生成一个open请求报文，发送给文件服务器以读取其上的文件
-        #-- d. 从文件服务器获得响应报文，确认文件已经打开
-        if requestType == "open":
-            if fileExistsTest(message['docname']):
-                fileinfo = getFileAddress(message['docname'])
-                response = json.dumps({
-                    "response": "open-exists",
-                    "docname": message['docname'],
-                    "isFile": True,
-                    "address": fileinfo['address'],
-                    "port": fileinfo['port'],
-                    "timestamp": fileinfo['timestamp']
-                })
-            else:
-                fileinfo = getRandomServer()
-                response = json.dumps({
-                    "response": "open-null",
-                    "docname": message['docname'],
-                    "isFile": False,
-                    "uuid": fileinfo[0],
-                    "address": fileinfo[1]['address'],
-                    "port": fileinfo[1]['port']
-                })
-
-        #2. 处理客户端发来的close指令报文
-        #-- close报文的处理步骤较为简单，如下所示：
-        #-- a. 提取报文中的文件名
-        #-- b. 根据报文中的目标文件名，使用文件路径服务器的getFileAddress方法，获得文件具体位置信息（包括文件所在文件服务器地址，文件服务器端口等）
-        #-- c. 根据上一步骤中得到的位置信息，生成一个close请求报文，发送给文件服务器以关闭其上的文件
-        #-- d. 从文件服务器获得响应报文，确认文件已经关闭
-        elif requestType == "close":
-            response = json.dumps({
-                "response": "close",
+    with METADATA_LOCK:
+        FILE_SERVER.pop(nodeID, None)
+        RING.remove(nodeID)
+        logMetadata({"op": "dropserver", "uuid": nodeID})
+    SERVER_LOAD.pop(nodeID, None)
+
+def livenessWorker():
+    '''
+    : 后台线程：定期检查各文件服务器最近一次心跳的时间，删除超过DEAD_AFTER秒没有心跳的服务器
+    '''
+    while True:
+        time.sleep(1)
+        now = time.monotonic()
+        with METADATA_LOCK:
+            dead = [nodeID for nodeID in FILE_SERVER if now - SERVER_LOAD.get(nodeID, {}).get('lastSeen', now) > DEAD_AFTER]
+        for nodeID in dead:
+            LOG.warning("File server %s missed its heartbeats, dropping it", nodeID)
+            dropFileServer(nodeID)
+
+def logMetadata(record):
+    '''
+    : 将一次元数据修改追加到元数据日志中；日志记录足够多时，在后台线程中生成快照
+    : 必须在持有METADATA_LOCK时调用，使日志顺序与修改顺序一致，并且快照复制的元数据与日志的切换点一致
+    : record: dict,日志记录
+    '''
+    if METADATA_LOG is None or not METADATA_LOG.append(record):
+        return
+    generation = METADATA_LOG.rotate()
+    servers = {nodeID: dict(info) for nodeID, info in FILE_SERVER.items()}
+    files = dict(FILE_ADDRESS)      #表项在修改时整体替换而不原地修改，因此浅复制即可
+    threading.Thread(target=METADATA_LOG.writeSnapshot, args=(generation, servers, files), daemon=True).start()
+
+def recoverMetadata():
+    '''
+    : 从元数据日志恢复FILE_SERVER/FILE_ADDRESS，并重新构造一致性哈希环
+    '''
+    started = time.monotonic()
+    servers, files, replayed = METADATA_LOG.recover()
+    with METADATA_LOCK:
+        FILE_SERVER.update(servers)
+        FILE_ADDRESS.update(files)
+        NAMESPACE.names = sorted(FILE_ADDRESS)
+        for nodeID in servers:
+            RING.add(nodeID)
+            SERVER_LOAD[nodeID] = {"load": None, "lastSeen": time.monotonic()}    #恢复的服务器需要在DEAD_AFTER秒内重新发送心跳
+    LOG.info("Recovered %d file servers and %d files (%d log records replayed) in %.2fs", len(servers), len(files), replayed, time.monotonic() - started)
+
+def loadScore(nodeID):
+    '''
+    : 根据文件服务器最近一次心跳报文中的负载指标计算其负载，数值越小负载越低
+    : nodeID: str,文件服务器ID
+    : return -> float；剩余空间不足的服务器为无穷大
+    '''
+    load = SERVER_LOAD.get(nodeID, {}).get('load')
+    if load is None:
+        return 0.0
+    if load['freeSpace'] < MIN_FREE_SPACE:
+        return float("inf")
+    return load['queueDepth'] * QUEUE_WEIGHT + load['requestRate'] + load['byteRate'] / (1024 * 1024)
+
+def ringServers(docname, count=None):
+    '''
+    : 从文件名在哈希环上的位置开始顺时针选取文件服务器，共用同一个存储目录的文件服务器只选取一次
+    : docname: str,文件名
+    : count: int,最多选取的服务器数，为None时选取全部
+    : return -> list,服务器信息（含uuid/address/port）
+    '''
+    with METADATA_LOCK:
+        servers = []
+        buckets = set()
+        for nodeID in RING.successors(docname):
+            info = FILE_SERVER[nodeID]
+            if info.get('bucket') is not None:
+                if info['bucket'] in buckets:
+                    continue
+                buckets.add(info['bucket'])
+            servers.append({"uuid": nodeID, "address": info['address'], "port": info['port']})
+            if count is not None and len(servers) >= count:
+                break
+        return servers
+
+def getReplicaSet(docname, loadAware=False, preferred=None):
+    '''
+    : 根据一致性哈希环计算文件的各个副本应存放的文件服务器：从文件名在环上的位置开始顺时针选取REPLICAS个服务器
+    : 共用同一个存储目录的文件服务器上的副本实际上是同一个文件，因此同一存储目录只选取一次
+    : docname: str,文件名
+    : loadAware: bool,为True时在环上多考察PLACEMENT_CHOICES个候选服务器，选出其中负载最低的REPLICAS个（用于新文件）
+    : preferred: str,希望作为主副本的文件服务器ID（融合写入时为收到数据的文件服务器），它在候选服务器之中时排在第一位
+    : return -> list,副本信息（含uuid/address/port），第一个为主副本；没有可用的文件服务器时返回空列表
+    '''
+    replicas = ringServers(docname, REPLICAS + (PLACEMENT_CHOICES if loadAware else 0))
+    if loadAware:
+        #按负载稳定排序，负载相同时保持哈希环上的顺序
+        replicas = sorted(replicas, key=lambda replica: loadScore(replica['uuid']))
+    if preferred is not None:
+        replicas = sorted(replicas, key=lambda replica: replica['uuid'] != preferred)
+    return replicas[:REPLICAS]
+
+def liveReplicas(fileinfo):
+    '''
+    : 从文件路径映射中去掉已被判定为失效的副本，主副本失效时由下一个存活的副本代替
+    : fileinfo: dict,文件路径映射
+    : return -> dict,文件路径映射；所有副本都失效时原样返回
+    '''
+    if fileinfo.get('stripes'):
+        fileinfo = dict(fileinfo, stripes=[liveReplicas(stripe) for stripe in fileinfo['stripes']])
+    replicas = [replica for replica in fileinfo['replicas'] if replica['uuid'] in FILE_SERVER]
+    if not replicas or len(replicas) == len(fileinfo['replicas']):
+        return fileinfo
+    return dict(fileinfo, uuid=replicas[0]['uuid'], address=replicas[0]['address'], port=replicas[0]['port'], replicas=replicas)
+
+def replicaBuckets(replicas):
+    '''
+    : 返回一组副本所在的存储目录
+    '''
+    with METADATA_LOCK:
+        return set(FILE_SERVER.get(replica['uuid'], {}).get('bucket') for replica in replicas) - {None}
+
+
+def writtenSize(current, message):
+    '''
+    : 根据write请求报文计算写入之后的文件长度：替换整个文件时为写入的长度，部分改写时不小于原来的长度
+    : current: dict,现有的文件路径映射，新文件为None
+    : message: dict,write请求报文
+    : return -> int；报文中没有写入长度或原来的长度未知时为None
+    '''
+    length = message.get('length')
+    if length is None:
+        return None
+    if message.get('offset') is None:
+        return length
+    size = current.get('size') if current is not None else 0
+    if size is None:
+        return None
+    return max(size, message['offset'] + length)
+
+def listEntry(name, isDirectory):
+    '''
+    : list响应中的一项：文件带有长度和版本时间戳，目录只有名称
+    : 必须在持有METADATA_LOCK时调用
+    '''
+    if isDirectory:
+        return {"name": name, "type": "directory"}
+    fileinfo = FILE_ADDRESS[name]
+    return {"name": name, "type": "file", "size": fileinfo.get('size'), "timestamp": fileinfo['timestamp']}
+
+def stripeName(docname, index):
+    '''
+    : 条带在文件服务器上保存时使用的文件名
+    '''
+    return docname + ".stripe" + str(index)
+
+def stripeFile(docname, message, current):
+    '''
+    : 为写入条带文件（或将要切分为条带的新文件）规划条带：已有的条带保持原来的位置，新增的条带从文件名在哈希环上的位置开始依次放在不同的文件服务器上
+    : 必须在持有METADATA_LOCK时调用
+    : docname: str,文件名
+    : message: dict,write请求报文，其中length为写入的数据长度，offset为写入的起始偏移（None表示替换整个文件）
+    : current: dict,现有的文件路径映射，新文件为None
+    : return -> (新的文件路径映射, 不再需要的条带)；可用的存储目录少于两个而无法切分新文件时返回None
+    '''
+    servers = ringServers(docname)
+    if current is None and len(servers) < 2:
+        return None
+
+    #1. 计算写入后的文件长度和条带数：替换整个文件时为写入的长度，部分改写时不小于原长度
+    length = message.get('length') or 0
+    if message.get('offset') is None:
+        size = length
+    else:
+        size = max(current['size'] if current is not None else 0, message['offset'] + length)
+    stripeSize = current['stripeSize'] if current is not None else STRIPE_SIZE
+    count = max(1, -(-size // stripeSize))
+
+    #2. 保留现有条带的位置，只为新增的条带选择文件服务器；每个条带的各个副本也依次放在不同的服务器上
+    stripes = list(current['stripes'][:count]) if current is not None else []
+    dropped = current['stripes'][count:] if current is not None else []
+    for index in range(len(stripes), count):
+        if not servers:
+            return None
+        replicas = [servers[(index + i) % len(servers)] for i in range(min(REPLICAS, len(servers)))]
+        stripes.append({"docname": stripeName(docname, index), "uuid": replicas[0]['uuid'], "address": replicas[0]['address'], "port": replicas[0]['port'], "replicas": replicas})
+
+    #文件路径映射的uuid/address/port/replicas字段取第一个条带的位置，使只认识这些字段的代码仍然可用
+    first = stripes[0]
+    fileinfo = {"uuid": first['uuid'], "address": first['address'], "port": first['port'], "replicas": first['replicas'],
+                "timestamp": message['timestamp'], "size": size, "stripeSize": stripeSize, "stripes": stripes}
+    return fileinfo, dropped
+
+def stripeFields(fileinfo):
+    '''
+    : 响应报文中描述条带的字段；文件没有切分为条带时为空
+    '''
+    if not fileinfo.get('stripes'):
+        return {}
+    return {"size": fileinfo['size'], "stripeSize": fileinfo['stripeSize'], "stripes": fileinfo['stripes']}
+
+def deleteStripes(stripes):
+    '''
+    : 删除文件缩短后不再需要的条带的全部副本
+    '''
+    for stripe in stripes:
+        for replica in stripe['replicas']:
+            try:
+                sendDelete(replica, stripe['docname'])
+            except (OSError, protocol.ProtocolError) as e:
+                LOG.warning("Deleting stripe %s failed: %s", stripe['docname'], e)
+
+
+class Throttle():
+    '''
+    : 简单的速率限制器，使调用者的数据传输速率不超过给定的上限
+    '''
+    def __init__(self, rate):
+        '''
+        : rate: int,速率上限（字节/秒），0表示不限速
+        '''
+        self.rate = rate
+        self.start = time.monotonic()
+        self.consumed = 0
+
+    def consume(self, size):
+        '''
+        : 记录已传输的数据量，若传输速度超过上限则等待
+        : size: int,本次传输的字节数
+        '''
+        if self.rate <= 0:
+            return
+        self.consumed += size
+        delay = self.consumed / self.rate - (time.monotonic() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def findMovedFiles(nodeID):
+    '''
+    : 找出按哈希环应当在指定文件服务器上保存副本、但该服务器目前还没有副本的文件
+    : nodeID: str,文件服务器ID
+    : return -> list,(文件名, 文件路径映射的副本)
+    '''
+    with METADATA_LOCK:
+        moved = []
+        for docname, fileinfo in FILE_ADDRESS.items():
+            if fileinfo.get('stripes'):
+                continue      #条带的位置在写入时确定，不随哈希环迁移
+            current = [replica['uuid'] for replica in fileinfo['replicas']]
+            if nodeID not in current and nodeID in [replica['uuid'] for replica in getReplicaSet(docname)]:
+                moved.append((docname, dict(fileinfo)))
+        return moved
+
+
+def sendDelete(replica, docname):
+    '''
+    : 删除指定文件服务器上的文件副本
+    '''
+    conn = protocol.connect(replica['address'], replica['port'])
+    try:
+        conn.send({"request": "delete", "docname": docname})
+        conn.recv()
+    finally:
+        conn.close()
+
+
+def migrateFile(docname, fileinfo, nodeID, throttle):
+    '''
+    : 将文件复制到新的副本服务器，并更新文件路径映射；不再属于副本集合的旧副本随后被删除
+    : docname: str,文件名
+    : fileinfo: dict,迁移开始时的文件路径映射
+    : nodeID: str,目标文件服务器ID
+    : throttle: Throttle,迁移速率限制器
+    : return -> bool,是否迁移成功；迁移期间文件被改写时放弃本次迁移
+    '''
+    with METADATA_LOCK:
+        target = FILE_SERVER.get(nodeID)
+    if target is None:
+        return False
+
+    #与现有副本共用同一个存储目录时（例如在同一目录下启动的多个文件服务器），只需修改路径映射，不需要复制数据
+    sharedBucket = target.get('bucket') is not None and target.get('bucket') in replicaBuckets(fileinfo['replicas'])
+
+    if not sharedBucket:
+        #1. 从主副本流式读取文件，并将数据块原样转发给目标服务器，内存中最多只保留一个数据块
+        #-- 源或目标服务器出错、目标服务器没有完整写入时放弃本次迁移，不修改文件路径映射，旧副本保持不变
+        src = dst = None
+        try:
+            src = protocol.connect(fileinfo['address'], fileinfo['port'])
+            dst = protocol.connect(target['address'], target['port'])
+            src.send({"request": "read", "docname": docname, "offset": 0, "length": -1})
+            response = src.recv()
+            if response is None or response['response'] != "read":
+                return False
+            dst.send({"request": "write", "docname": docname, "offset": None, "length": response['length']})
+            for chunk in src.recvChunks(response['length']):
+                dst.sendChunks(chunk)
+                throttle.consume(len(chunk))
+            written = dst.recv()
+            if written is None or written['response'] != "write" or written['written'] != response['length']:
+                LOG.warning("Migrating %s to %s failed: %s", docname, nodeID, written)
+                return False
+        except (OSError, protocol.ProtocolError) as e:
+            LOG.warning("Migrating %s to %s failed: %s", docname, nodeID, e)
+            return False
+        finally:
+            for conn in (src, dst):
+                if conn is not None:
+                    conn.close()
+
+    #2. 文件在迁移期间没有被改写时，才将目标服务器加入副本集合，并去掉按哈希环已不再需要的副本
+    with METADATA_LOCK:
+        current = FILE_ADDRESS.get(docname)
+        if current is None or current['uuid'] != fileinfo['uuid'] or current['timestamp'] != fileinfo['timestamp']:
+            return False
+        desired = [replica['uuid'] for replica in getReplicaSet(docname)]
+        candidates = current['replicas'] + [{"uuid": nodeID, "address": target['address'], "port": target['port']}]
+        replicas = sorted([replica for replica in candidates if replica['uuid'] in desired], key=lambda replica: desired.index(replica['uuid']))
+        dropped = [replica for replica in candidates if replica['uuid'] not in desired]
+        if not replicas:
+            return False
+        setFileMapping(docname, dict(current, uuid=replicas[0]['uuid'], address=replicas[0]['address'], port=replicas[0]['port'], replicas=replicas))
+        keptBuckets = replicaBuckets(replicas)
+        dropped = [replica for replica in dropped if FILE_SERVER.get(replica['uuid'], {}).get('bucket') not in keptBuckets]
+
+    #3. 删除旧副本
+    for replica in dropped:
+        sendDelete(replica, docname)
+    return True
+
+
+def rebalanceWorker():
+    '''
+    : 后台迁移线程：每当有新文件服务器加入，就把哈希环上归属于它的文件逐个迁移过去，总速率不超过MIGRATION_RATE
+    '''
+    while True:
+        nodeID = REBALANCE_QUEUE.get()
+        throttle = Throttle(MIGRATION_RATE)
+        moved = 0
+        for docname, fileinfo in findMovedFiles(nodeID):
+            try:
+                if migrateFile(docname, fileinfo, nodeID, throttle):
+                    moved += 1
+            except (OSError, protocol.ProtocolError) as e:
+                LOG.warning("Migrating %s failed: %s", docname, e)
+        LOG.info("Rebalance for %s finished, %d files moved", nodeID, moved)
+
+
+def handleRequest(message):
+    '''
+    : 处理一个请求报文
+    : message: dict,请求报文
+    : return -> dict,响应报文
+    '''
+    requestType = message['request']
+    response = {}
+
+    #0. 针对单个文件的请求只处理属于本分片的文件，其余文件返回wrong-shard响应
+    #-- 文件名不合法（例如含有".."或以"/"开头，见Common.docnames）时拒绝请求，不登记也不列出
+    if requestType in ("open", "close", "read", "write", "lookup", "stat"):
+        docnames = message['docnames'] if requestType == "lookup" else [message['docname']]
+        for docname in docnames:
+            if not validDocname(docname):
+                return invalidDocname(docname)
+        for docname in docnames:
+            if not ownsDocname(docname):
+                METRICS.increment("wrong_shard")
+                return wrongShard(docname)
+
+    #1. 处理客户端发来的open指令报文
+    #-- open报文的处理步骤较为简单，如下所示：
+    #-- a. 提取报文中的文件名
+    #-- b. 根据报文中的目标文件名，使用文件路径服务器的getFileAddress方法，获得文件具体位置信息（包括文件所在文件服务器地址，文件服务器端口等）
+    #-- c. 根据上一步骤中得到的位置信息，生成一个open请求报文，发送给文件服务器以读取其上的文件
+    #-- d. 从文件服务器获得响应报文，确认文件已经打开
+    #-- 订阅了回调的客户端同时得到该文件的回调承诺，租期内不需要再询问文件的版本
+    if requestType == "open":
+        if fileExistsTest(message['docname']):
+            lease = promiseCallback(message)
+            fileinfo = liveReplicas(getFileAddress(message['docname']))
+            response = {
+                "response": "open-exists",
                 "docname": message['docname'],
-                "isFile": True
-            })
-        elif requestType == "read":
-            if fileExistsTest(message['docname']):
-                fileinfo = getFileAddress(docname)
-                response = json.dumps({
-                    "response": "read-exists",
+                "isFile": True,
+                "address": fileinfo['address'],
+                "port": fileinfo['port'],
+                "replicas": fileinfo['replicas'],
+                "timestamp": fileinfo['timestamp'],
+                "lease": lease
+            }
+            response.update(stripeFields(fileinfo))
+        else:
+            replicas = getReplicaSet(message['docname'])
+            if not replicas:
+                return {"response": "error", "error": "没有可用的文件服务器"}
+            response = {
+                "response": "open-null",
+                "docname": message['docname'],
+                "isFile": False,
+                "uuid": replicas[0]['uuid'],
+                "address": replicas[0]['address'],
+                "port": replicas[0]['port'],
+                "replicas": replicas
+            }
+
+    #2. 处理客户端发来的close指令报文
+    #-- close报文的处理步骤较为简单，如下所示：
+    #-- a. 提取报文中的文件名
+    #-- b. 根据报文中的目标文件名，使用文件路径服务器的getFileAddress方法，获得文件具体位置信息（包括文件所在文件服务器地址，文件服务器端口等）
+    #-- c. 根据上一步骤中得到的位置信息，生成一个close请求报文，发送给文件服务器以关闭其上的文件
+    #-- d. 从文件服务器获得响应报文，确认文件已经关闭
+    elif requestType == "close":
+        response = {
+            "response": "close",
+            "docname": message['docname'],
+            "isFile": True
+        }
+    #2.1 处理客户端发来的批量lookup指令报文
+    #-- lookup报文中含有一个文件名列表docnames，一次返回所有文件的位置信息，不存在的文件对应None
+    #-- 客户端读取大量小文件时，可以用一次往返代替逐个文件的open请求
+    #-- 订阅了回调的客户端同时得到各个已存在文件的回调承诺，租期为响应中的lease
+    elif requestType == "lookup":
+        files = {}
+        lease = None
+        for docname in message['docnames']:
+            if fileExistsTest(docname):
+                lease = promiseCallback(dict(message, docname=docname))
+            fileinfo = getFileAddress(docname)
+            files[docname] = dict(liveReplicas(fileinfo)) if fileinfo is not None else None
+        response = {
+            "response": "lookup",
+            "files": files,
+            "lease": lease
+        }
+    elif requestType == "read":
+        if fileExistsTest(message['docname']):
+            lease = promiseCallback(message)
+            fileinfo = liveReplicas(getFileAddress(message['docname']))
+            response = {
+                "response": "read-exists",
+                "docname": message['docname'],
+                "isFile": True,
+                "address": fileinfo['address'],
+                "port": fileinfo['port'],
+                "replicas": fileinfo['replicas'],
+                "timestamp": fileinfo['timestamp'],
+                "lease": lease
+            }
+            response.update(stripeFields(fileinfo))
+        else:
+            response = {
+                "response": "read-null",
+                "docname": message['docname'],
+                "isFile": False
+            } 
+
+    #3. 处理客户端发来的write指令报文       
+    #-- 具体处理步骤和上面的open报文类似，此处不再赘述
+    #-- 报文中的length不小于STRIPE_THRESHOLD的新文件切分为条带，已经切分为条带的文件按写入后的长度重新规划条带
+    elif requestType == "write":
+        dropped = []
+        with METADATA_LOCK:
+            LOG.debug("write %s", message['docname'])
+            current = getFileAddress(message['docname'])
+            striped = None
+            if current is not None and current.get('stripes'):
+                striped = stripeFile(message['docname'], message, current)
+            elif current is None and STRIPE_SIZE > 0 and (message.get('length') or 0) >= STRIPE_THRESHOLD:
+                striped = stripeFile(message['docname'], message, None)
+            if striped is not None:
+                fileinfo, dropped = striped
+                setFileMapping(message['docname'], fileinfo)
+                fileinfo = liveReplicas(fileinfo)
+                response = {
+                    "response": "write-exists" if current is not None else "write-null",
                     "docname": message['docname'],
-                    "isFile": True,
+                    "isFile": current is not None,
+                    "uuid": fileinfo['uuid'],
                     "address": fileinfo['address'],
                     "port": fileinfo['port'],
-                    "timestamp": fileinfo['timestamp']
-                })
-            else:
-                response = json.dumps({
-                    "response": "read-null",
-                    "docname": message['docname'],
-                    "isFile": False
-                }) 
-
-        #3. 处理客户端发来的write指令报文       
-        #-- 具体处理步骤和上面的open报文类似，此处不再赘述
-        elif requestType == "write":
-            print(message['docname'])
-            print(FILE_ADDRESS)
-            if fileExistsTest(message['docname']):
-                print("write if")
+                    "replicas": fileinfo['replicas'],
+                    "timestamp": message['timestamp']
+                }
+                response.update(stripeFields(fileinfo))
+            elif fileExistsTest(message['docname']):
                 fileinfo = getFileAddress(message['docname'])
-                response = json.dumps({
+                fileinfo = dict(fileinfo, timestamp=message['timestamp'], size=writtenSize(fileinfo, message))      #文件的每次写入都更新版本时间戳，使其他客户端的缓存失效
+                setFileMapping(message['docname'], fileinfo)
+                fileinfo = liveReplicas(fileinfo)
+                response = {
                     "response": "write-exists",
                     "docname": message['docname'],
                     "isFile": True,
                     "uuid": fileinfo['uuid'],
                     "address": fileinfo['address'],
                     "port": fileinfo['port'],
+                    "replicas": fileinfo['replicas'],
                     "timestamp": message['timestamp']
-                })
+                }
             else:
-                fileinfo = getRandomServer()
-                FILE_ADDRESS[message['docname']] = {"uuid": fileinfo[0], "address": fileinfo[1]['address'], "port": fileinfo[1]['port'], "timestamp": message['timestamp']}
-                print(FILE_ADDRESS)
-                response = json.dumps({
+                replicas = getReplicaSet(message['docname'], loadAware=True, preferred=message.get('primary'))     #新文件优先放在负载较低的服务器上
+                if not replicas:
+                    return {"response": "error", "error": "没有可用的文件服务器"}
+                setFileMapping(message['docname'], {"uuid": replicas[0]['uuid'], "address": replicas[0]['address'], "port": replicas[0]['port'], "replicas": replicas,
+                                                    "timestamp": message['timestamp'], "size": writtenSize(None, message)})
+                LOG.debug("placed %s on %s", message['docname'], [replica['uuid'] for replica in replicas])
+                response = {
                     "response": "write-null",
                     "docname": message['docname'],
                     "isFile": False,
-                    "uuid": fileinfo[0],
-                    "address": fileinfo[1]['address'],
-                    "port": fileinfo[1]['port'],
+                    "uuid": replicas[0]['uuid'],
+                    "address": replicas[0]['address'],
+                    "port": replicas[0]['port'],
+                    "replicas": replicas,
                     "timestamp": message['timestamp']
-                })
-        elif requestType == "dfileinfojoin":
-            nodeID = message['uuid']
-            if(nodeID == ""):
-                nodeID = str(uuid.uuid4())
-            FILE_SERVER[nodeID] = {"address": message['address'], "port": message['port']}
-            response = json.dumps({"response": requestType, "uuid": nodeID})
-            #print(FILE_SERVER)
+                }
+        if dropped:
+            threading.Thread(target=deleteStripes, args=(dropped,), daemon=True).start()
+    elif requestType == "dfileinfojoin":
+        nodeID = message['uuid']
+        if(nodeID == ""):
+            nodeID = str(uuid.uuid4())
+        setFileServer(nodeID, {"address": message['address'], "port": message['port'], "bucket": message.get('bucket')})
+        SERVER_LOAD[nodeID] = {"load": None, "lastSeen": time.monotonic()}
+        REBALANCE_QUEUE.put(nodeID)     #哈希环上归属于新服务器的文件由后台线程逐步迁移过去
+        response = {"response": requestType, "uuid": nodeID, "partitions": PARTITION_MAP.toMessage() if PARTITION_MAP is not None else None}     #文件服务器随后以同一ID加入其余分片
+        #print(FILE_SERVER)
+
+    #4. 处理文件服务器定期发来的heartbeat报文：记录其负载指标和最近一次心跳的时间
+    #-- 已被判定为失效（或路径服务器不认识）的服务器收到known=False的响应，随后重新发送加入报文
+    elif requestType == "heartbeat":
+        nodeID = message['uuid']
+        with METADATA_LOCK:
+            known = nodeID in FILE_SERVER
+        if known:
+            SERVER_LOAD[nodeID] = {"load": message.get('load'), "lastSeen": time.monotonic()}
+        response = {"response": "heartbeat", "known": known}
+
+    #5. 处理cluster指令报文：返回各文件服务器的状态和负载
+    elif requestType == "cluster":
+        now = time.monotonic()
+        with METADATA_LOCK:
+            servers = {}
+            for nodeID, info in FILE_SERVER.items():
+                state = SERVER_LOAD.get(nodeID, {})
+                servers[nodeID] = dict(info, load=state.get('load'), lastHeartbeat=now - state.get('lastSeen', now), loadScore=loadScore(nodeID))
+            files = len(FILE_ADDRESS)
+        response = {"response": "cluster", "servers": servers, "files": files, "replicas": REPLICAS, "deadAfter": DEAD_AFTER,
+                    "shard": SHARD_INDEX, "shards": len(PARTITION_MAP) if PARTITION_MAP is not None else 1}     #files只是本分片上的文件数
+
+    #6. 处理servers指令报文：返回全部文件服务器及哈希环参数，客户端据此构造相同的哈希环，自行计算文件所在的服务器
+    elif requestType == "servers":
+        with METADATA_LOCK:
+            servers = {nodeID: dict(info) for nodeID, info in FILE_SERVER.items()}
+        response = {"response": "servers", "servers": servers, "vnodes": RING.vnodes, "replicas": REPLICAS}
+
+    #7. 处理list指令报文：按名称顺序分页列出以prefix开头的文件和子目录，cursor为上一页响应中的cursor
+    #-- 有多个分片时每个分片只列出自己的文件，由客户端合并各分片的结果（各分片使用相同的游标，因此可以直接合并）
+    elif requestType == "list":
+        if not validPrefix(message.get('prefix') or ""):
+            return invalidDocname(message.get('prefix'))
+        limit = min(max(int(message.get('limit') or LIST_LIMIT), 1), LIST_LIMIT)
+        with METADATA_LOCK:
+            names, cursor = NAMESPACE.list(message.get('prefix') or "", message.get('cursor'), limit, bool(message.get('recursive')))
+            entries = [listEntry(name, isDirectory) for name, isDirectory in names]
+        response = {"response": "list", "prefix": message.get('prefix') or "", "entries": entries, "cursor": cursor}
+
+    #8. 处理stat指令报文：返回文件的长度、版本时间戳和位置；名称不是文件但有以"名称/"开头的文件时为目录
+    elif requestType == "stat":
+        docname = message['docname']
+        with METADATA_LOCK:
+            fileinfo = getFileAddress(docname)
+            isDirectory = fileinfo is None and NAMESPACE.hasPrefix(docname.rstrip("/") + "/")
+        if fileinfo is not None:
+            fileinfo = liveReplicas(fileinfo)
+            response = {
+                "response": "stat",
+                "docname": docname,
+                "type": "file",
+                "size": fileinfo.get('size'),
+                "timestamp": fileinfo['timestamp'],
+                "address": fileinfo['address'],
+                "port": fileinfo['port'],
+                "replicas": fileinfo['replicas']
+            }
+            response.update(stripeFields(fileinfo))
+        elif isDirectory:
+            response = {"response": "stat", "docname": docname, "type": "directory"}
         else:
-            response = json.dumps({"response": "error", "error": requestType+"为非法指令"})
+            response = {"response": "stat-null", "docname": docname}
+
+    #9. 处理partitions指令报文：返回分区表，客户端据此把针对单个文件的请求直接发给文件所属的分片
+    elif requestType == "partitions":
+        response = {"response": "partitions", "shard": SHARD_INDEX, "partitions": PARTITION_MAP.toMessage() if PARTITION_MAP is not None else None}
+
+    #10. 处理stats指令报文：返回本服务器的运行指标
+    elif requestType == "stats":
+        response = metrics.statsResponse(METRICS, message)
+    else:
+        response = {"response": "error", "error": requestType+"为非法指令"}
 
-        self.request.sendall(response.encode())
+    return response
+
+
+def streamWrite(conn, message):
+    '''
+    : 处理write报文：收回的回调承诺全部得到确认（或超时）之后才返回响应
+    '''
+    response, channels = writeAndRevoke(message)
+    CALLBACKS.breakCallbacks(message['docname'], channels)
+    conn.send(protocol.replyTo(message, response))
+
+def streamCallbacks(conn, message):
+    '''
+    : 处理callbacks报文：该连接此后作为客户端的回调连接，路径服务器在其上发送失效通知，客户端在其上发送确认
+    '''
+    conn.send(protocol.replyTo(message, {"response": "callbacks", "lease": CALLBACKS.lease}))
+    channel = CallbackChannel(message['clientid'], conn.send, lambda: conn.sock.shutdown(socket.SHUT_RDWR))
+    CALLBACKS.attach(channel)
+    try:
+        while True:
+            ack = conn.recv()
+            if ack is None:
+                break
+            channel.acknowledge(ack.get('seq'))
+    except (OSError, protocol.ProtocolError):
+        pass
+    finally:
+        CALLBACKS.detach(channel)
+
+async def asyncStreamWrite(conn, message):
+    '''
+    : 事件循环模式下的write报文处理：等待客户端确认的过程在线程池中进行
+    '''
+    response, channels = writeAndRevoke(message)
+    if channels:
+        await asyncio.get_running_loop().run_in_executor(None, CALLBACKS.breakCallbacks, message['docname'], channels)
+    await conn.send(protocol.replyTo(message, response))
+
+async def asyncStreamCallbacks(conn, message):
+    '''
+    : 事件循环模式下的callbacks报文处理：失效通知由写入请求所在的线程交给事件循环发送
+    '''
+    loop = asyncio.get_running_loop()
+    await conn.send(protocol.replyTo(message, {"response": "callbacks", "lease": CALLBACKS.lease}))
+    channel = CallbackChannel(message['clientid'], lambda notice: asyncio.run_coroutine_threadsafe(conn.send(notice), loop).result(),
+                              lambda: loop.call_soon_threadsafe(conn.writer.close))
+    CALLBACKS.attach(channel)
+    try:
+        while True:
+            ack = await conn.recv()
+            if ack is None:
+                break
+            channel.acknowledge(ack.get('seq'))
+    except (ConnectionError, protocol.ProtocolError):
+        pass
+    finally:
+        CALLBACKS.detach(channel)
+
+STREAM_HANDLERS = {"write": streamWrite, "callbacks": streamCallbacks}
+ASYNC_STREAM_HANDLERS = {"write": asyncStreamWrite, "callbacks": asyncStreamCallbacks}
+
+
+class ThreadedHandler(socketserver.BaseRequestHandler):
+    '''
+    : SocketServer 网络服务框架组件
+    : 继承自类socketserver.BaseRequestHandler，该组件协调处理本文件路径服务器与客户端之间的通信，负责处理客户端发来的请求报文
+    '''
+    def handle(self):
+        #连接在多次请求之间保持打开，依次处理同一连接上的所有请求，直到客户端关闭连接
+        conn = protocol.Connection(self.request)
+        METRICS.connectionOpened()
+        try:
+            while True:
+                bytesIn = conn.bytesIn
+                message = conn.recv()
+                if message is None:
+                    break
+                started = time.perf_counter()
+                bytesOut = conn.bytesOut
+                error = False
+                handler = STREAM_HANDLERS.get(message.get('request'))
+                if handler is not None:
+                    handler(conn, message)
+                else:
+                    response = handleRequest(message)
+                    error = response.get('response') == "error"
+                    conn.send(protocol.replyTo(message, response))
+                METRICS.record(message.get('request'), time.perf_counter() - started, conn.bytesIn - bytesIn, conn.bytesOut - bytesOut, error)
+        finally:
+            METRICS.connectionClosed()
 
 
 class MasterServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    daemon_threads = True     #长连接的处理线程不阻止服务器进程退出
+    allow_reuse_address = True
+    request_queue_size = 1024     #大量客户端同时建立连接时，避免默认的监听队列长度(5)导致连接请求被丢弃重传
 
 if __name__ == '__main__':
-    address = (ADDRESS, PORT)
-    server = MasterServer(address, ThreadedHandler)
-    server.serve_forever()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="myDFS directory server")
+    parser.add_argument("--address", default=ADDRESS, help="监听的IP地址")
+    parser.add_argument("--port", type=int, default=PORT, help="监听的端口，0表示由系统分配")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded", help="服务器运行模式：每个连接一个线程，或asyncio事件循环")
+    parser.add_argument("--replicas", type=int, default=REPLICAS, help="每个文件的副本数")
+    parser.add_argument("--metadata-dir", default=METADATA_DIRECTORY, help="元数据日志和快照的保存目录，空字符串表示不持久化元数据；使用默认目录且有多个分片时，每个分片使用其中以分片序号命名的子目录")
+    parser.add_argument("--snapshot-every", type=int, default=SNAPSHOT_EVERY, help="追加多少条元数据日志记录后生成一次快照")
+    parser.add_argument("--metadata-fsync", action="store_true", help="每条元数据日志记录写入后调用fsync")
+    parser.add_argument("--dead-after", type=float, default=DEAD_AFTER, help="文件服务器超过这么多秒没有心跳即被判定为失效")
+    parser.add_argument("--stripe-size", type=int, default=STRIPE_SIZE, help="大文件的条带长度（字节），0表示不切分")
+    parser.add_argument("--stripe-threshold", type=int, default=STRIPE_THRESHOLD, help="新文件的长度达到此值（字节）时切分为条带")
+    parser.add_argument("--migration-rate", type=int, default=MIGRATION_RATE, help="文件迁移速率上限（字节/秒），0表示不限速")
+    parser.add_argument("--shards", default="", help="全部路径服务器分片的地址，以逗号分隔的地址:端口，各分片应使用相同的列表；本服务器监听其中第--shard-index项的端口。为空时只有本服务器一个分片")
+    parser.add_argument("--shard-index", type=int, default=0, help="本服务器在--shards中的序号（从0开始）")
+    parser.add_argument("--partitions", type=int, default=PARTITIONS, help="文件名哈希分区数，各分片应使用相同的值")
+    parser.add_argument("--partition-epoch", type=int, default=0, help="分区表的版本号，修改--shards后重启各分片时应增加")
+    parser.add_argument("--callback-lease", type=float, default=CALLBACK_LEASE, help="回调承诺的租期（秒），0表示不给出承诺，客户端每次读取都询问文件的版本")
+    parser.add_argument("--callback-timeout", type=float, default=CALLBACK_TIMEOUT, help="写入时等待持有回调承诺的客户端确认失效通知的时限（秒）")
+    parser.add_argument("--metrics-port", type=int, default=0, help="以Prometheus文本格式提供运行指标的HTTP端口（GET /metrics），0表示不启用")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info", help="日志级别")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    MIGRATION_RATE, REPLICAS = args.migration_rate, max(args.replicas, 1)
+    port = args.port
+    shards = parseShards(args.shards) if args.shards else []
+    if shards:
+        if not 0 <= args.shard_index < len(shards):
+            parser.error("--shard-index超出--shards的范围")
+        SHARD_INDEX = args.shard_index
+        port = shards[SHARD_INDEX][1]
+    metadataDir = args.metadata_dir
+    if len(shards) > 1 and metadataDir == METADATA_DIRECTORY:
+        metadataDir = os.path.join(metadataDir, "shard" + str(SHARD_INDEX))     #同一目录下启动的多个分片不能共用元数据日志
+    if metadataDir:
+        METADATA_LOG = MetadataLog(metadataDir, args.snapshot_every, args.metadata_fsync)
+        recoverMetadata()
+    DEAD_AFTER = args.dead_after
+    STRIPE_SIZE, STRIPE_THRESHOLD = args.stripe_size, args.stripe_threshold
+    threading.Thread(target=rebalanceWorker, daemon=True).start()
+    threading.Thread(target=livenessWorker, daemon=True).start()
+    CALLBACKS = CallbackTable(args.callback_lease, args.callback_timeout)
+    threading.Thread(target=callbackWorker, daemon=True).start()
+    METRICS.gauge("files", lambda: len(FILE_ADDRESS))
+    METRICS.gauge("file_servers", lambda: len(FILE_SERVER))
+    METRICS.gauge("rebalance_queue", REBALANCE_QUEUE.qsize)
+    for name in ("clients", "files", "promises", "breaks", "timeouts"):
+        METRICS.gauge("callback_" + name, lambda name=name: CALLBACKS.stats()[name])
+
+    address = (args.address, port)
+    if args.mode == "asyncio":
+        server = asyncServer.AsyncServer(address, handleRequest, ASYNC_STREAM_HANDLERS, metrics=METRICS)
+    else:
+        server = MasterServer(address, ThreadedHandler)
+
+    ADDRESS, PORT = server.socket.getsockname()[:2]
+    PARTITION_MAP = PartitionMap(shards or [[ADDRESS, PORT]], args.partitions, epoch=args.partition_epoch)
+    if args.metrics_port:
+        metrics.serveHttp(METRICS, args.address, args.metrics_port)
+    print("Directory Server is listening on " + ADDRESS + ":" + str(PORT) + " (" + args.mode + ", shard " + str(SHARD_INDEX) + "/" + str(len(PARTITION_MAP)) + ")", flush=True)
+
+    server.serve_forever()
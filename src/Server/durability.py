@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+
+#文件服务器写入的持久化方式
+#-- none: 写入的数据留在操作系统的页缓存中，由操作系统择机写入磁盘；进程崩溃不丢失，操作系统崩溃或断电时最近的写入可能丢失
+#-- fsync: 每次写入在返回响应之前对文件调用fsync，替换文件之后再对所在目录调用fsync，使重命名本身也被持久化
+#-- group: 组提交，与fsync的持久化保证相同；第一个到达的写入（组长）等待一段很短的时间窗口，收集同时进行的其他写入，
+#--        然后依次对整组的文件调用fsync，其余写入只等待组长完成；日志文件系统上这些紧接着的fsync合并到同一次日志提交中，
+#--        并发写入较多时每次写入分摊的刷盘开销随之减少
+#-- 替换整个文件总是先写入临时文件再原子地重命名，因此无论哪种方式，崩溃之后文件要么是旧内容，要么是完整的新内容，不会被截断
+
+MODES = ("none", "fsync", "group")
+GROUP_WINDOW = 0.002         #组提交的时间窗口（秒）
+
+
+def flushAll(fds):
+    '''
+    : 将一组文件（或目录）的数据写入磁盘；只刷写这些文件，不影响同一台机器上的其他文件和进程
+    : fds: list,文件描述符
+    '''
+    for fd in fds:
+        os.fsync(fd)
+
+
+class GroupCommit():
+    '''
+    : 组提交：同一时间窗口内的刷盘请求由组长一并执行flushAll
+    '''
+    def __init__(self, window=GROUP_WINDOW):
+        '''
+        : window: float,组长等待其他写入加入的时间（秒）
+        '''
+        self.window = window
+        self.lock = threading.Lock()
+        self.batch = None        #正在收集的一组：{"fds": 文件描述符, "done": threading.Event, "error": 刷盘时发生的异常}
+        self.requests = 0
+        self.flushes = 0
+
+    def sync(self, fd):
+        '''
+        : 等待fd的数据被写入磁盘；调用者在返回之前不能关闭fd
+        : fd: int,文件描述符
+        '''
+        with self.lock:
+            self.requests += 1
+            batch = self.batch
+            leader = batch is None
+            if leader:
+                batch = self.batch = {"fds": [], "done": threading.Event(), "error": None}
+            batch['fds'].append(fd)
+
+        if leader:
+            #1. 组长等待窗口结束后关闭本组，此后到达的写入组成下一组，与本组的刷盘同时进行收集
+            time.sleep(self.window)
+            with self.lock:
+                self.batch = None
+                self.flushes += 1
+            try:
+                flushAll(batch['fds'])
+            except OSError as e:
+                batch['error'] = e
+            finally:
+                batch['done'].set()
+        else:
+            batch['done'].wait()
+        if batch['error'] is not None:
+            raise batch['error']
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "flushes": self.flushes}
+
+
+class Durability():
+    '''
+    : 按持久化方式执行刷盘；写入流程在重命名之前调用syncFile，重命名之后调用syncDirectory
+    '''
+    def __init__(self, mode="none", window=GROUP_WINDOW):
+        '''
+        : mode: str,持久化方式，见MODES
+        : window: float,组提交的时间窗口（秒）
+        '''
+        if mode not in MODES:
+            raise ValueError("未知的持久化方式: %s" % mode)
+        self.mode = mode
+        self.group = GroupCommit(window) if mode == "group" else None
+        self.lock = threading.Lock()
+        self.syncs = 0
+
+    def syncFile(self, fileobj):
+        '''
+        : 将已打开的文件写入磁盘；fileobj的缓冲区应已经flush
+        '''
+        if self.mode == "none":
+            return
+        self._sync(fileobj.fileno())
+
+    def syncDirectory(self, path):
+        '''
+        : 将目录项的修改（新建、重命名）写入磁盘
+        : path: str,目录
+        '''
+        if self.mode == "none":
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self._sync(fd)
+        finally:
+            os.close(fd)
+
+    def _sync(self, fd):
+        with self.lock:
+            self.syncs += 1
+        if self.group is not None:
+            self.group.sync(fd)
+        else:
+            os.fsync(fd)
+
+    def stats(self):
+        '''
+        : return -> dict,刷盘请求数syncs，以及刷盘的轮数flushes（组提交时每组一轮，小于syncs）
+        '''
+        with self.lock:
+            syncs = self.syncs
+        return {"mode": self.mode, "syncs": syncs, "flushes": self.group.stats()['flushes'] if self.group is not None else syncs}
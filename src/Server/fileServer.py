@@ -1,8 +1,26 @@
 import socketserver
 import socket
-import json
 import os
 import sys
+import asyncio
+import argparse
+import threading
+import time
+import shutil
+import logging
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Common import protocol
+from Common import asyncServer
+from Common import metrics
+from Common import delta
+from Common.channel import ConnectionPool
+from Common.partitionMap import PartitionMap
+from Common.docnames import validDocname, invalidDocname
+from Server.chunkStore import ChunkStore
+from Server.durability import Durability, MODES as DURABILITY_MODES, GROUP_WINDOW
+from Server.hotCache import HotCache, POLICIES, MMAP_THRESHOLD
 
 NODEID = ""
 ADDRESS = "127.0.0.1"
@@ -10,26 +28,898 @@ PORT = 0
 
 MASTER_ADDRESS = "127.0.0.1"
 MASTER_PORT = 8080
+DIRECTORY_SHARDS = []            #全部路径服务器分片的[地址, 端口]，由加入报文的响应中的分区表获得；本服务器加入每个分片并向每个分片发送心跳
+PARTITION_MAP = None             #路径服务器的分区表，融合写入时据此把write请求发给文件名所属的分片；只有一个路径服务器时为None
+LOCK_ADDRESS = "127.0.0.1"
+LOCK_PORT = None                 #锁服务器的端口，为None时不接受融合写入（fusedwrite）
 
 CURRENT_DIRECTORY = os.getcwd()
 BUCKET_NAME = "FileServerBucket"         #文件储存路径
 BUCKET_PATH = os.path.join(CURRENT_DIRECTORY, BUCKET_NAME)
 
+PEER_POOL = ConnectionPool()     #到复制链中下一个文件服务器的长连接
+CONTROL_POOL = ConnectionPool()  #融合写入时到锁服务器的长连接，检查锁的请求在连接上流水线发送
+REGISTER_CONNECTIONS = {}        #(路径服务器分片地址, 端口) -> list,空闲的登记连接；融合写入向路径服务器登记时每个请求独占一条连接
+REGISTER_LOCK = threading.Lock()
+REGISTER_IDLE = 16               #每个路径服务器分片最多保留的空闲登记连接数
+MAX_REDIRECTS = 3                #融合写入时最多跟随多少次路径服务器分片的wrong-shard响应
+
+HEARTBEAT_INTERVAL = 2           #向路径服务器发送心跳报文的间隔（秒）
+
+DURABILITY = Durability("none")   #写入的持久化方式（Server.durability），由--durability指定
+CHUNK_STORE = None               #--storage chunked时使用的分块存储（Server.chunkStore），为None时每个文件直接保存为bucket中的普通文件
+
+#读取文件时的压缩传输：客户端在read报文的compression字段中按偏好顺序列出可以接受的压缩算法，服务器从中选择自己允许使用的第一个
+COMPRESSION_CODECS = ["zlib", "lzma"]               #允许使用的压缩算法，为空时不压缩
+COMPRESSION_LEVEL = None                            #压缩级别，为None时使用各算法的默认级别
+COMPRESSION_THRESHOLD = protocol.COMPRESSION_THRESHOLD
+COMPRESSORS = {}                                    #压缩算法 -> protocol.Compressor
+
+#压缩副本：完整读取文件时，把压缩后的帧（帧头+压缩的数据块）保存在bucket的.compressed目录中，之后的完整读取直接通过sendfile发送，不再重复压缩
+#-- 文件被写入或删除时其压缩副本随之删除；COPY_VERSIONS记录每个文件被修改的次数，生成副本的过程中文件被修改时放弃该副本
+COMPRESSED_COPIES = False
+COPY_DIRECTORY = ".compressed"
+COPY_LOCK = threading.Lock()
+COPY_VERSIONS = {}
+
+#热点文件内存缓存（Server.hotCache）：被读取的文件内容保存在内存中（较大的普通文件通过mmap映射），之后的读取直接从内存发送
+#-- 文件被写入或删除时删除其缓存项；替换整个普通文件时先写入临时文件再原子地替换，使已有的映射和正在发送的旧内容不受影响
+HOT_CACHE_BYTES = 256 * 1024 * 1024       #缓存容量，0表示不缓存
+HOT_CACHE_POLICY = "lru"
+HOT_CACHE = None
+
+#增量写入（Common.delta）：signatures请求返回文件当前版本的数据块签名，delta请求按增量指令和字面数据生成文件的新版本
+SIGNATURES = OrderedDict()        #文件名 -> (版本标识, 分块参数, 摘要, 长度)，最近计算的签名，文件未被修改时直接复用
+SIGNATURE_FILES = 256             #保存签名的文件数上限
+SIGNATURE_LOCK = threading.Lock()
+
+
+class LoadStats():
+    '''
+    : 文件服务器的负载统计，随心跳报文发送给路径服务器
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0         #累计处理的请求数
+        self.bytesOut = 0         #累计发送的文件数据字节数
+        self.bytesIn = 0          #累计写入的文件数据字节数
+        self.active = 0           #正在处理的请求数（队列深度）
+        self.lastTime = time.monotonic()
+        self.lastRequests = 0
+        self.lastBytes = 0
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+
+    def end(self, bytesOut=0, bytesIn=0):
+        with self.lock:
+            self.active -= 1
+            self.requests += 1
+            self.bytesOut += bytesOut
+            self.bytesIn += bytesIn
+
+    def snapshot(self):
+        '''
+        : 返回当前的负载指标，速率按距上一次调用的时间计算
+        : return -> dict
+        '''
+        with self.lock:
+            now = time.monotonic()
+            elapsed = max(now - self.lastTime, 1e-6)
+            transferred = self.bytesOut + self.bytesIn
+            load = {
+                "requestRate": (self.requests - self.lastRequests) / elapsed,
+                "byteRate": (transferred - self.lastBytes) / elapsed,
+                "requests": self.requests,
+                "bytesServed": self.bytesOut,
+                "bytesWritten": self.bytesIn,
+                "queueDepth": self.active,
+            }
+            self.lastTime, self.lastRequests, self.lastBytes = now, self.requests, transferred
+        load['freeSpace'] = shutil.disk_usage(BUCKET_PATH).free
+        if CHUNK_STORE is not None:
+            load['storage'] = CHUNK_STORE.stats()
+        if HOT_CACHE is not None:
+            load['hotCache'] = HOT_CACHE.stats()
+        return load
+
+
+LOAD = LoadStats()
+METRICS = metrics.Metrics("file")     #按请求类型统计的请求数、延迟和收发字节数，通过stats请求或--metrics-port读取
+LOG = logging.getLogger("file")
+
 def dfsOpen(docname):
+    if CHUNK_STORE is not None:
+        return CHUNK_STORE.exists(docname)
     path = os.path.join(BUCKET_PATH, docname)
     exists = os.path.isfile(path)
     return exists
 
-def dfsRead(docname):
+def dfsDelete(docname):
+    '''
+    : 删除文件（例如文件已经迁移到其他文件服务器）
+    : docname: str,文件名
+    : return -> bool,文件是否存在并被删除
+    '''
+    invalidateCached(docname)
+    if CHUNK_STORE is not None:
+        return CHUNK_STORE.delete(docname)
     path = os.path.join(BUCKET_PATH, docname)
-    file_handle = open(path, "r")
-    data = file_handle.read()
-    return data
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
 
-def dfsWrite(docname, data):
-    path = os.path.join(BUCKET_PATH, docname)
-    file_handle = open(path, "w+")
-    file_handle.write(data)
+def dfsRead(docname, offset=0, length=-1):
+    '''
+    : 打开文件并计算需要读取的数据范围，文件内容本身由调用者流式发送
+    : docname: str,文件名
+    : offset: int,读取的起始偏移
+    : length: int,读取的字节数，-1表示读到文件末尾
+    : return -> (已打开的文件对象（分块存储时为ChunkedFile）, 实际起始偏移, 实际读取长度, 文件总长度)
+    '''
+    if CHUNK_STORE is not None:
+        file_handle = CHUNK_STORE.open(docname)
+        size = file_handle.size
+    else:
+        file_handle = open(os.path.join(BUCKET_PATH, docname), "rb")
+        size = os.fstat(file_handle.fileno()).st_size
+    offset, length = readRange(offset, length, size)
+    return file_handle, offset, length, size
+
+def readRange(offset, length, size):
+    '''
+    : 将请求的读取范围限制在文件之内
+    : return -> (实际起始偏移, 实际读取长度)
+    '''
+    offset = min(max(offset, 0), size)
+    if length < 0 or offset + length > size:
+        length = size - offset
+    return offset, length
+
+def dfsWrite(docname, chunks, offset=None):
+    '''
+    : 将数据块依次写入文件，不在内存中拼接完整的文件内容
+    : docname: str,文件名
+    : chunks: 可迭代对象，依次产生待写入的数据块
+    : offset: int,写入的起始偏移；为None时表示用新内容替换整个文件
+    : return -> (写入的字节数, 写入后的文件总长度)
+    '''
+    #写入前后各删除一次压缩副本和内存缓存：写入过程中生成的副本或读入缓存的内容可能含有写了一半的内容
+    invalidateCached(docname)
+    try:
+        if CHUNK_STORE is not None:
+            return CHUNK_STORE.write(docname, chunks, offset)
+        path = os.path.join(BUCKET_PATH, docname)
+        #替换整个文件或新建文件时写入临时文件后原子地替换：原文件不会被截断，崩溃后也不会留下写了一半的新文件，内存缓存中对原文件的映射仍然有效
+        #-- 改写已有文件的一部分时直接在原文件上修改
+        exists = os.path.isfile(path)
+        target = path + "." + str(threading.get_ident()) + ".tmp" if offset is None or not exists else path
+        if "/" in docname:
+            os.makedirs(os.path.dirname(path), exist_ok=True)     #文件名中的"/"为目录分隔符，文件保存在bucket中对应的子目录下
+        mode = "r+b" if target == path else "wb"
+
+        written = 0
+        try:
+            with open(target, mode) as file_handle:
+                if offset is not None:
+                    file_handle.seek(offset)
+                for chunk in chunks:
+                    file_handle.write(chunk)
+                    written += len(chunk)
+                file_handle.flush()
+                DURABILITY.syncFile(file_handle)      #数据先于重命名写入磁盘，崩溃后新的文件名不会指向不完整的内容
+                size = os.fstat(file_handle.fileno()).st_size
+            if target != path:
+                os.replace(target, path)
+                DURABILITY.syncDirectory(os.path.dirname(path))
+        except BaseException:
+            if target != path:
+                try:
+                    os.remove(target)
+                except FileNotFoundError:
+                    pass
+            raise
+        return written, size
+    finally:
+        invalidateCached(docname)
+
+def readCompressor(msg):
+    '''
+    : 根据read报文的compression字段协商压缩算法
+    : msg: dict,read请求报文
+    : return -> protocol.Compressor,不压缩时返回None
+    '''
+    codec = protocol.negotiateCompression(msg.get('compression'), COMPRESSION_CODECS)
+    if codec is None:
+        return None
+    if codec not in COMPRESSORS:
+        COMPRESSORS[codec] = protocol.Compressor(codec, COMPRESSION_LEVEL, COMPRESSION_THRESHOLD)
+    return COMPRESSORS[codec]
+
+def readBlock(file_handle, offset, size):
+    '''
+    : 读取dfsRead返回的文件对象中的一段数据
+    '''
+    if CHUNK_STORE is not None:
+        return file_handle.read(offset, size)
+    return os.pread(file_handle.fileno(), size, offset)
+
+def copyPath(docname, codec):
+    return os.path.join(BUCKET_PATH, COPY_DIRECTORY, codec, docname)
+
+def invalidateCached(docname):
+    '''
+    : 文件被写入或删除时删除其压缩副本和内存缓存
+    '''
+    invalidateCopies(docname)
+    if HOT_CACHE is not None:
+        HOT_CACHE.invalidate(docname)
+
+def cachedContent(docname, file_handle, size, version):
+    '''
+    : 读入文件的完整内容并放入内存缓存
+    : docname: str,文件名
+    : file_handle: dfsRead返回的文件对象
+    : size: int,文件总长度
+    : version: int,打开文件之前由HOT_CACHE.version()获得的版本号
+    : return -> bytes/mmap,文件内容；没有启用缓存或文件不适合缓存时为None
+    '''
+    if HOT_CACHE is None or not HOT_CACHE.admits(size):
+        return None
+    content = HOT_CACHE.load(file_handle, size, readBlock, CHUNK_STORE is None)
+    HOT_CACHE.put(docname, content, version)
+    return content
+
+def useCopy(compressor, offset, length, size):
+    return compressor is not None and COMPRESSED_COPIES and offset == 0 and length == size
+
+def invalidateCopies(docname):
+    '''
+    : 删除文件的全部压缩副本
+    '''
+    if not COMPRESSED_COPIES:
+        return
+    with COPY_LOCK:
+        COPY_VERSIONS[docname] = COPY_VERSIONS.get(docname, 0) + 1
+        for codec in protocol.COMPRESSION_FLAGS:
+            try:
+                os.remove(copyPath(docname, codec))
+            except FileNotFoundError:
+                pass
+
+def compressedCopy(docname, file_handle, size, compressor):
+    '''
+    : 打开文件的压缩副本，副本不存在时先生成
+    : docname: str,文件名
+    : file_handle: dfsRead返回的文件对象
+    : size: int,文件总长度
+    : compressor: protocol.Compressor,协商好的压缩器
+    : return -> 已打开的副本文件；生成副本期间文件被修改时返回None，由调用者直接压缩发送
+    '''
+    path = copyPath(docname, compressor.codec)
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        pass
+
+    with COPY_LOCK:
+        version = COPY_VERSIONS.get(docname, 0)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = path + "." + str(threading.get_ident()) + ".tmp"
+    with open(temp, "wb") as copy:
+        for pos in range(0, size, protocol.CHUNK_SIZE):
+            flags, chunk = compressor.frame(readBlock(file_handle, pos, min(protocol.CHUNK_SIZE, size - pos)))
+            copy.write(protocol.HEADER.pack(protocol.CODEC_RAW, flags, len(chunk)))
+            copy.write(chunk)
+    with COPY_LOCK:
+        if COPY_VERSIONS.get(docname, 0) != version:
+            os.remove(temp)
+            return None
+        os.replace(temp, path)
+        return open(path, "rb")
+
+def sendRange(conn, file_handle, offset, length, compressor=None):
+    '''
+    : 通过sendfile发送文件中的一段范围；分块存储的文件逐个发送其所在的数据块文件
+    : conn: protocol.Connection,客户端连接
+    : compressor: protocol.Compressor,指定时数据压缩后发送
+    '''
+    if CHUNK_STORE is None:
+        conn.sendFile(file_handle, offset, length, compressor)
+        return
+    if compressor is not None:
+        #分块存储的数据块较小，按CHUNK_SIZE重新组合后再压缩
+        for pos in range(offset, offset + length, protocol.CHUNK_SIZE):
+            conn.sendChunks(file_handle.read(pos, min(protocol.CHUNK_SIZE, offset + length - pos)), compressor)
+        return
+    for path, start, count in file_handle.segments(offset, length):
+        with open(path, "rb") as chunkFile:
+            conn.sendFile(chunkFile, start, count)
+
+async def asyncSendRange(conn, file_handle, offset, length, compressor=None):
+    '''
+    : 事件循环模式下的sendRange
+    : conn: asyncServer.AsyncConnection,客户端连接
+    '''
+    if CHUNK_STORE is None:
+        await conn.sendFile(file_handle, offset, length, compressor)
+        return
+    if compressor is not None:
+        for pos in range(offset, offset + length, protocol.CHUNK_SIZE):
+            block = await conn.runBlocking(file_handle.read, pos, min(protocol.CHUNK_SIZE, offset + length - pos))
+            await conn.sendChunks(block, compressor)
+        return
+    for path, start, count in file_handle.segments(offset, length):
+        chunkFile = await conn.runBlocking(open, path, "rb")
+        try:
+            await conn.sendFile(chunkFile, start, count)
+        finally:
+            chunkFile.close()
+
+def teeChunks(chunks, peer, failed):
+    '''
+    : 依次产生数据块，同时把每个数据块转发给复制链中的下一个文件服务器
+    : 转发失败时记录错误并停止转发，本地写入不受影响
+    : chunks: 可迭代对象，依次产生数据块
+    : peer: protocol.Connection,到下一个文件服务器的连接
+    : failed: list,用于记录转发时发生的错误
+    '''
+    for chunk in chunks:
+        if not failed:
+            try:
+                peer.sendChunks(chunk)
+            except OSError as e:
+                failed.append(e)
+        yield chunk
+
+def chainWrite(msg, chunks):
+    '''
+    : 链式复制写入：写入本地文件的同时将数据块转发给复制链（chain字段）中的下一个文件服务器，
+    : 下一个服务器再转发给之后的服务器，链尾写入完成后确认沿链逐级返回
+    : msg: dict,write请求报文
+    : chunks: 可迭代对象，依次产生待写入的数据块
+    : return -> (写入的字节数, 写入后的文件总长度, 成功写入的副本数)
+    '''
+    chain = msg.get('chain') or []
+    if not chain:
+        written, size = dfsWrite(msg['docname'], chunks, msg.get('offset'))
+        return written, size, 1
+
+    successor = chain[0]
+    forward = {key: value for key, value in msg.items() if key != 'rid'}
+    forward['chain'] = chain[1:]
+    started = []
+    result = []
+    failed = []
+
+    def sendBody(peer):
+        started.append(True)
+        result.extend(dfsWrite(msg['docname'], teeChunks(chunks, peer, failed), msg.get('offset')))
+        if failed:
+            raise failed[0]
+
+    #1. 本地写入在向下一个服务器发送数据块的过程中完成；不使用PEER_POOL.submit的失败重试，因为数据块只能被消费一次
+    try:
+        future = PEER_POOL.channel(successor['address'], successor['port']).submit(forward, sendBody)
+        replicated = future.result().get('replicas', 1)
+    except (OSError, protocol.ProtocolError) as e:
+        if started and not result:
+            raise      #本地写入本身失败
+        LOG.warning("Replicating %s to %s:%s failed: %s", msg['docname'], successor['address'], successor['port'], e)
+        replicated = 0
+
+    #2. 连接下一个服务器失败时数据块还未被读取，此时只写入本地
+    if not result:
+        result.extend(dfsWrite(msg['docname'], chunks, msg.get('offset')))
+    written, size = result
+    return written, size, 1 + replicated
+
+def rejectDocname(msg):
+    '''
+    : 检查请求报文中的文件名：不合法的文件名可能指向bucket之外或文件服务器的内部目录，在访问文件系统之前拒绝
+    : msg: dict,请求报文
+    : return -> dict,文件名不合法时的Error响应报文；文件名合法时返回None
+    '''
+    if validDocname(msg.get('docname')):
+        return None
+    return dict(invalidDocname(msg.get('docname')), address=ADDRESS, port=PORT)
+
+def drainChunks(chunks):
+    '''
+    : 读取并丢弃报文之后的数据块，使连接上的下一个报文能被正确解析
+    '''
+    for chunk in chunks:
+        pass
+
+def handleRequest(msg):
+    '''
+    : 处理不需要收发原始数据块的请求报文
+    : msg: dict,请求报文
+    : return -> dict,响应报文
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+
+    LOAD.begin()
+    try:
+        return handleFileRequest(msg)
+    finally:
+        LOAD.end()
+
+def handleFileRequest(msg):
+    requestType = msg['request']
+    response = {}
+
+    if requestType in ("open", "delete", "signatures"):
+        rejected = rejectDocname(msg)
+        if rejected is not None:
+            return rejected
+    if requestType == "open":
+        exists = dfsOpen(msg['docname'])
+        response = {"response": requestType, "docname": msg['docname'], "isFile": exists, "address": ADDRESS, "port": PORT}
+    elif requestType == "close":
+        response = {"response": requestType, "address": ADDRESS, "port": PORT}
+    elif requestType == "delete":
+        deleted = dfsDelete(msg['docname'])
+        response = {"response": requestType, "docname": msg['docname'], "isFile": deleted, "address": ADDRESS, "port": PORT}
+    elif requestType == "signatures":
+        response = fileSignatures(msg)
+    elif requestType == "stats":
+        response = metrics.statsResponse(METRICS, msg)
+    elif requestType in ("read", "write", "delta", "fusedwrite"):
+        #read/write/delta/fusedwrite报文需要收发原始数据块，由streamRead/streamWrite（多线程模式）或asyncStreamRead/asyncStreamWrite（事件循环模式）处理
+        response = {"response": "Error", "error": requestType+" must be handled as a stream", "address": ADDRESS, "port": PORT}
+    else:
+        response = {"response": "Error", "error": requestType+" is not a valid request", "address": ADDRESS, "port": PORT}
+
+    return response
+
+def readNullResponse(msg):
+    return {"response": "read-null", "docname": msg['docname'], "isFile": False, "address": ADDRESS, "port": PORT}
+
+def readResponse(msg, offset, length, size, compressor=None):
+    return {"response": "read", "docname": msg['docname'], "offset": offset, "length": length, "size": size,
+            "compression": compressor.codec if compressor is not None else None, "address": ADDRESS, "port": PORT}
+
+def writeResponse(msg, written, size, replicas):
+    return {"response": "write", "docname": msg['docname'], "written": written, "size": size, "replicas": replicas, "address": ADDRESS, "port": PORT, "uuid": NODEID}
+
+def streamRead(conn, msg):
+    '''
+    : 处理read报文：首先发送包含数据范围的响应报文，然后通过sendfile将文件中的对应范围以原始数据块的形式发送给客户端
+    : 协商了压缩算法时数据块压缩后发送；启用压缩副本时完整读取直接发送副本
+    : conn: protocol.Connection,客户端连接
+    : msg: dict,请求报文
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    length = 0
+    try:
+        rejected = rejectDocname(msg)
+        if rejected is not None:
+            conn.send(protocol.replyTo(msg, rejected))
+            return
+        compressor = readCompressor(msg)
+
+        #1. 热点文件直接从内存缓存发送，不访问磁盘
+        content = HOT_CACHE.get(msg['docname']) if HOT_CACHE is not None else None
+        if content is not None:
+            offset, length = readRange(msg.get('offset', 0), msg.get('length', -1), len(content))
+            if not useCopy(compressor, offset, length, len(content)):
+                conn.send(protocol.replyTo(msg, readResponse(msg, offset, length, len(content), compressor)))
+                conn.sendChunks(memoryview(content)[offset:offset+length], compressor)
+                return
+        version = HOT_CACHE.version(msg['docname']) if HOT_CACHE is not None else None
+
+        #2. 从磁盘读取，并将文件内容放入内存缓存
+        if not dfsOpen(msg['docname']):
+            conn.send(protocol.replyTo(msg, readNullResponse(msg)))
+            return
+        file_handle, offset, length, size = dfsRead(msg['docname'], msg.get('offset', 0), msg.get('length', -1))
+        with file_handle:
+            copy = None
+            if useCopy(compressor, offset, length, size):
+                copy = compressedCopy(msg['docname'], file_handle, size, compressor)
+            content = cachedContent(msg['docname'], file_handle, size, version) if copy is None else None
+            conn.send(protocol.replyTo(msg, readResponse(msg, offset, length, size, compressor)))
+            if copy is not None:
+                with copy:
+                    conn.sendFramed(copy, 0, os.fstat(copy.fileno()).st_size)
+            elif content is not None:
+                conn.sendChunks(memoryview(content)[offset:offset+length], compressor)
+            else:
+                sendRange(conn, file_handle, offset, length, compressor)
+    finally:
+        LOAD.end(bytesOut=length)
+
+def streamWrite(conn, msg):
+    '''
+    : 处理write报文：报文之后紧跟着length字节的原始数据块，逐块写入磁盘，并沿复制链转发
+    : conn: protocol.Connection,客户端连接
+    : msg: dict,请求报文
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    written = 0
+    try:
+        rejected = rejectDocname(msg)
+        if rejected is not None:
+            drainChunks(conn.recvChunks(msg['length']))
+            conn.send(protocol.replyTo(msg, rejected))
+            return
+        written, size, replicas = chainWrite(msg, conn.recvChunks(msg['length']))
+        conn.send(protocol.replyTo(msg, writeResponse(msg, written, size, replicas)))
+    finally:
+        LOAD.end(bytesIn=written)
+
+async def asyncStreamRead(conn, msg):
+    '''
+    : 事件循环模式下的read报文处理：打开文件的磁盘I/O在线程池中执行，数据由事件循环通过sendfile发送
+    : conn: asyncServer.AsyncConnection,客户端连接
+    : msg: dict,请求报文
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    length = 0
+    try:
+        rejected = rejectDocname(msg)
+        if rejected is not None:
+            await conn.send(protocol.replyTo(msg, rejected))
+            return
+        compressor = readCompressor(msg)
+        content = HOT_CACHE.get(msg['docname']) if HOT_CACHE is not None else None
+        if content is not None:
+            offset, length = readRange(msg.get('offset', 0), msg.get('length', -1), len(content))
+            if not useCopy(compressor, offset, length, len(content)):
+                await conn.send(protocol.replyTo(msg, readResponse(msg, offset, length, len(content), compressor)))
+                await conn.sendChunks(memoryview(content)[offset:offset+length], compressor)
+                return
+        version = HOT_CACHE.version(msg['docname']) if HOT_CACHE is not None else None
+
+        if not await conn.runBlocking(dfsOpen, msg['docname']):
+            await conn.send(protocol.replyTo(msg, readNullResponse(msg)))
+            return
+        file_handle, offset, length, size = await conn.runBlocking(dfsRead, msg['docname'], msg.get('offset', 0), msg.get('length', -1))
+        try:
+            copy = None
+            if useCopy(compressor, offset, length, size):
+                copy = await conn.runBlocking(compressedCopy, msg['docname'], file_handle, size, compressor)
+            content = await conn.runBlocking(cachedContent, msg['docname'], file_handle, size, version) if copy is None else None
+            await conn.send(protocol.replyTo(msg, readResponse(msg, offset, length, size, compressor)))
+            if copy is not None:
+                try:
+                    await conn.sendFramed(copy, 0, os.fstat(copy.fileno()).st_size)
+                finally:
+                    copy.close()
+            elif content is not None:
+                await conn.sendChunks(memoryview(content)[offset:offset+length], compressor)
+            else:
+                await asyncSendRange(conn, file_handle, offset, length, compressor)
+        finally:
+            file_handle.close()
+    finally:
+        LOAD.end(bytesOut=length)
+
+async def asyncStreamWrite(conn, msg):
+    '''
+    : 事件循环模式下的write报文处理：chainWrite在线程池中执行，其所需的数据块由事件循环逐块从连接中接收
+    : conn: asyncServer.AsyncConnection,客户端连接
+    : msg: dict,请求报文
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    written = 0
+    try:
+        chunks = conn.syncChunks(msg['length'], asyncio.get_running_loop())
+        rejected = rejectDocname(msg)
+        if rejected is not None:
+            await conn.runBlocking(drainChunks, chunks)
+            await conn.send(protocol.replyTo(msg, rejected))
+            return
+        written, size, replicas = await conn.runBlocking(chainWrite, msg, chunks)
+        await conn.send(protocol.replyTo(msg, writeResponse(msg, written, size, replicas)))
+    finally:
+        LOAD.end(bytesIn=written)
+
+def registerCall(address, port, message):
+    '''
+    : 通过独占的连接向路径服务器发送一个请求并等待响应
+    : 路径服务器在收回其他客户端的回调承诺时，write请求可能等待较久（最长为其--callback-timeout）；
+    : 路径服务器按顺序处理同一连接上的请求，因此登记不能与其他登记共用一条流水线连接，否则一个文件的等待会拖慢其他文件的融合写入
+    : return -> dict,响应报文
+    '''
+    key = (address, int(port))
+    for attempt in range(2):
+        conn = None
+        if attempt == 0:
+            with REGISTER_LOCK:
+                idle = REGISTER_CONNECTIONS.get(key)
+                conn = idle.pop() if idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = protocol.connect(address, port)
+        try:
+            conn.send(message)
+            response = conn.recv()
+            if response is None:
+                raise ConnectionError("路径服务器关闭了连接")
+        except (OSError, protocol.ProtocolError):
+            conn.close()
+            if reused:
+                continue      #空闲的连接可能已经被路径服务器关闭，换一条新连接重试一次
+            raise
+        with REGISTER_LOCK:
+            idle = REGISTER_CONNECTIONS.setdefault(key, [])
+            if len(idle) < REGISTER_IDLE:
+                idle.append(conn)
+                return response
+        conn.close()
+        return response
+
+def registerWrite(msg):
+    '''
+    : 融合写入的元数据部分：代替客户端向锁服务器检查锁，再向文件名所属的路径服务器分片发送write请求（修改版本时间戳，新文件确定存放位置）
+    : 两个请求都经过保持打开的连接，不需要建立新连接
+    : msg: dict,fusedwrite请求报文
+    : return -> dict,路径服务器的write响应；被其他客户端锁定时为锁服务器的locked响应
+    '''
+    global PARTITION_MAP
+
+    #1. 客户端持有覆盖写入范围的排他锁时不需要检查；部分改写时只检查被改写的字节范围
+    if not msg.get('lockHeld'):
+        lockcheck = {"request": "checklock", "docname": msg['docname'], "clientid": msg.get('clientid')}
+        if msg.get('offset') is not None:
+            lockcheck.update(mode="exclusive", offset=msg['offset'], length=msg['length'])
+        response = CONTROL_POOL.call(LOCK_ADDRESS, LOCK_PORT, lockcheck)
+        if response['response'] == "locked":
+            return response
+
+    #2. 新文件优先以本服务器为主副本，使数据不需要再转发
+    message = {"request": "write", "docname": msg['docname'], "clientid": msg.get('clientid'), "timestamp": msg['timestamp'],
+               "offset": msg.get('offset'), "length": msg['length'], "primary": NODEID}
+    for attempt in range(MAX_REDIRECTS + 1):
+        address, port = PARTITION_MAP.endpoint(msg['docname']) if PARTITION_MAP is not None else (MASTER_ADDRESS, MASTER_PORT)
+        response = registerCall(address, port, message)
+        if response['response'] != "wrong-shard":
+            return response
+        PARTITION_MAP = PartitionMap.fromMessage(response['partitions'])
+    return {"response": "Error", "error": "路径服务器分片的分区表不一致"}
+
+def fusedWrite(msg, chunks):
+    '''
+    : 处理fusedwrite报文：客户端只向文件服务器发送一个请求，由文件服务器检查锁并向路径服务器登记写入，之后才写入紧跟在报文之后的数据
+    : 路径服务器把文件放在其他服务器上或切分为条带时不写入数据，返回write-redirect响应（含路径服务器的write响应中的位置信息），
+    : 客户端据此直接向文件所在的服务器写入；锁定、出错和重定向时报文之后的数据块都被读取并丢弃
+    : msg: dict,fusedwrite请求报文，含docname/offset/length/clientid/timestamp/lockHeld
+    : chunks: 可迭代对象，依次产生报文之后的数据块
+    : return -> (dict,int),响应报文和写入的字节数（没有写入数据时为0）
+    '''
+    if not validDocname(msg.get('docname')):
+        placement = rejectDocname(msg)
+    elif LOCK_PORT is None:
+        placement = {"response": "Error", "error": "本文件服务器没有配置锁服务器，不接受融合写入"}
+    else:
+        try:
+            placement = registerWrite(msg)
+        except (OSError, protocol.ProtocolError) as e:
+            placement = {"response": "Error", "error": "登记写入失败: %s" % e}
+
+    if placement['response'] in ("write-exists", "write-null") and (placement.get('stripes') or placement['uuid'] != NODEID):
+        METRICS.increment("fused_redirects")
+        placement = dict(placement, response="write-redirect")
+    if placement['response'] not in ("write-exists", "write-null"):
+        drainChunks(chunks)
+        return placement, 0
+
+    chain = [{"address": replica['address'], "port": replica['port']} for replica in placement['replicas'][1:]]
+    written, size, replicas = chainWrite(dict(msg, request="write", chain=chain), chunks)
+    response = writeResponse(msg, written, size, replicas)
+    response.update(timestamp=msg['timestamp'], isFile=placement['isFile'], lease=placement.get('lease'))
+    return response, written
+
+def streamFusedWrite(conn, msg):
+    '''
+    : 处理fusedwrite报文，见fusedWrite
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    written = 0
+    try:
+        response, written = fusedWrite(msg, conn.recvChunks(msg['length']))
+        conn.send(protocol.replyTo(msg, response))
+    finally:
+        LOAD.end(bytesIn=written)
+
+async def asyncStreamFusedWrite(conn, msg):
+    '''
+    : 事件循环模式下的fusedwrite报文处理：fusedWrite中的锁检查、登记和写入都在线程池中执行
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    written = 0
+    try:
+        chunks = conn.syncChunks(msg['length'], asyncio.get_running_loop())
+        response, written = await conn.runBlocking(fusedWrite, msg, chunks)
+        await conn.send(protocol.replyTo(msg, response))
+    finally:
+        LOAD.end(bytesIn=written)
+
+def baseVersion(docname, file_handle):
+    '''
+    : 返回已打开的文件的版本标识，用于确认增量指令所依据的签名来自文件的当前版本
+    : file_handle: dfsRead返回的文件对象
+    : return -> str
+    '''
+    if CHUNK_STORE is not None:
+        return CHUNK_STORE.version(docname)
+    stat = os.fstat(file_handle.fileno())
+    return "%d:%d:%d" % (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def fileSignatures(msg):
+    '''
+    : 处理signatures报文：计算（或复用）文件当前版本的数据块签名
+    : msg: dict,请求报文
+    : return -> dict,响应报文，含版本标识version、分块参数params、拼接的摘要digests和各数据块的长度sizes
+    '''
+    rejected = rejectDocname(msg)
+    if rejected is not None:
+        return rejected
+    docname = msg['docname']
+    if not dfsOpen(docname):
+        return readNullResponse(msg)
+    file_handle, offset, length, size = dfsRead(docname)
+    with file_handle:
+        version = baseVersion(docname, file_handle)
+        with SIGNATURE_LOCK:
+            cached = SIGNATURES.get(docname)
+        if cached is None or cached[0] != version:
+            params = delta.deltaParams(size)
+            pieces = (readBlock(file_handle, pos, min(protocol.CHUNK_SIZE, size - pos)) for pos in range(0, size, protocol.CHUNK_SIZE))
+            digests, sizes = delta.signatures(pieces, params)
+            cached = (version, params, digests, sizes)
+            with SIGNATURE_LOCK:
+                SIGNATURES[docname] = cached
+                SIGNATURES.move_to_end(docname)
+                while len(SIGNATURES) > SIGNATURE_FILES:
+                    SIGNATURES.popitem(last=False)
+    version, params, digests, sizes = cached
+    return {"response": "signatures", "docname": docname, "size": size, "version": version, "params": params, "digests": digests, "sizes": sizes,
+            "address": ADDRESS, "port": PORT}
+
+def applyDelta(msg, literalChunks):
+    '''
+    : 处理delta报文：按增量指令从文件的当前版本复制数据、插入字面数据，写入文件的新版本，并沿复制链转发完整的新内容
+    : 签名之后文件已被修改（版本标识不一致）时返回delta-stale，客户端随后改为发送完整内容
+    : msg: dict,delta请求报文，含base（签名的版本标识）、ops（增量指令）、length（字面数据长度）和size（新内容长度）
+    : literalChunks: 迭代器，依次产生字面数据块；无论成功与否都会被读完
+    : return -> dict,响应报文
+    '''
+    literalChunks = iter(literalChunks)
+    try:
+        rejected = rejectDocname(msg)
+        if rejected is not None:
+            return rejected
+        if not dfsOpen(msg['docname']):
+            return {"response": "delta-stale", "docname": msg['docname'], "address": ADDRESS, "port": PORT}
+        file_handle, offset, length, size = dfsRead(msg['docname'])
+        with file_handle:
+            if baseVersion(msg['docname'], file_handle) != msg.get('base'):
+                return {"response": "delta-stale", "docname": msg['docname'], "address": ADDRESS, "port": PORT}
+            error = delta.validate(msg.get('ops'), size, msg['length'], msg.get('size'))
+            if error is not None:
+                return {"response": "Error", "error": error, "address": ADDRESS, "port": PORT}
+            content = {"request": "write", "docname": msg['docname'], "offset": None, "length": msg['size'], "chain": msg.get('chain'),
+                       "clientid": msg.get('clientid'), "timestamp": msg.get('timestamp')}
+            pieces = delta.patch(msg['ops'], lambda position, count: readBlock(file_handle, position, count), literalChunks)
+            written, size, replicas = chainWrite(content, pieces)
+        return dict(writeResponse(msg, written, size, replicas), literal=msg['length'])
+    finally:
+        drainChunks(literalChunks)
+
+def streamDelta(conn, msg):
+    '''
+    : 处理delta报文：报文之后紧跟着length字节的字面数据
+    : conn: protocol.Connection,客户端连接
+    : msg: dict,请求报文
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    written = 0
+    try:
+        response = applyDelta(msg, conn.recvChunks(msg['length']))
+        written = response['written'] if response['response'] == "write" else 0
+        conn.send(protocol.replyTo(msg, response))
+    finally:
+        LOAD.end(bytesIn=written)
+
+async def asyncSignatures(conn, msg):
+    '''
+    : 事件循环模式下的signatures报文处理：计算签名需要读取整个文件，在线程池中执行
+    '''
+    LOAD.begin()
+    try:
+        await conn.send(protocol.replyTo(msg, await conn.runBlocking(fileSignatures, msg)))
+    finally:
+        LOAD.end()
+
+async def asyncStreamDelta(conn, msg):
+    '''
+    : 事件循环模式下的delta报文处理：applyDelta在线程池中执行，字面数据由事件循环逐块从连接中接收
+    '''
+    LOG.debug("%s %s", msg['request'], msg.get('docname'))
+    LOAD.begin()
+    written = 0
+    try:
+        chunks = conn.syncChunks(msg['length'], asyncio.get_running_loop())
+        response = await conn.runBlocking(applyDelta, msg, chunks)
+        written = response['written'] if response['response'] == "write" else 0
+        await conn.send(protocol.replyTo(msg, response))
+    finally:
+        LOAD.end(bytesIn=written)
+
+STREAM_HANDLERS = {"read": streamRead, "write": streamWrite, "delta": streamDelta, "fusedwrite": streamFusedWrite}
+ASYNC_STREAM_HANDLERS = {"read": asyncStreamRead, "write": asyncStreamWrite, "signatures": asyncSignatures, "delta": asyncStreamDelta,
+                         "fusedwrite": asyncStreamFusedWrite}
+
+def joinMessage():
+    return {"request": "dfileinfojoin", "uuid": NODEID, "address": ADDRESS, "port": PORT, "bucket": BUCKET_PATH}
+
+def joinDirectory():
+    '''
+    : 加入路径服务器：先加入--master-address指定的分片，获得节点ID和分区表，再以同一ID加入其余分片
+    : 暂时无法连接的分片在之后的心跳中重新加入
+    '''
+    global NODEID, DIRECTORY_SHARDS, PARTITION_MAP
+    conn = protocol.connect(MASTER_ADDRESS, MASTER_PORT)
+    conn.send(joinMessage())
+    data = conn.recv()
+    conn.close()
+
+    NODEID = data['uuid']
+    partitions = data.get('partitions')
+    DIRECTORY_SHARDS = partitions['shards'] if partitions else [[MASTER_ADDRESS, MASTER_PORT]]
+    PARTITION_MAP = PartitionMap.fromMessage(partitions) if partitions else None
+    for address, port in DIRECTORY_SHARDS:
+        if (address, port) == (MASTER_ADDRESS, MASTER_PORT):
+            continue
+        try:
+            conn = protocol.connect(address, port)
+            conn.send(joinMessage())
+            conn.recv()
+            conn.close()
+        except (OSError, protocol.ProtocolError) as e:
+            LOG.warning("Joining directory shard %s:%s failed, retrying with the next heartbeat: %s", address, port, e)
+
+def heartbeatWorker():
+    '''
+    : 后台心跳线程：每隔HEARTBEAT_INTERVAL秒向每个路径服务器分片发送一次带有负载指标的心跳报文
+    : 某个分片不认识本服务器时（例如本服务器曾被该分片判定为失效），重新向该分片发送加入报文
+    '''
+    conns = {}
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        load = LOAD.snapshot()
+        for address, port in DIRECTORY_SHARDS:
+            key = (address, port)
+            try:
+                if key not in conns:
+                    conns[key] = protocol.connect(address, port)
+                conn = conns[key]
+                conn.send({"request": "heartbeat", "uuid": NODEID, "load": load})
+                response = conn.recv()
+                if response is None:
+                    raise ConnectionError("路径服务器关闭了连接")
+                if not response.get('known', True):
+                    LOG.warning("Directory server %s:%s does not know this node, joining again", address, port)
+                    conn.send(joinMessage())
+                    conn.recv()
+            except (OSError, protocol.ProtocolError) as e:
+                LOG.warning("Heartbeat to %s:%s failed: %s", address, port, e)
+                conn = conns.pop(key, None)
+                if conn is not None:
+                    conn.close()
 
 class ThreadedHandler(socketserver.BaseRequestHandler):
     '''
@@ -37,50 +927,97 @@ class ThreadedHandler(socketserver.BaseRequestHandler):
     : 继承自类socketserver.BaseRequestHandler，该组件协调处理文件路径服务器与锁服务器之间的通信，负责处理文件路径服务器发来的请求报文
     '''
     def handle(self):
-        msg = self.request.recv(1024)
-        print(msg)
-
-        msg = json.loads(msg)
-        requestType = msg['request']
-        response = ""
-
-        if requestType == "open":
-            exists = dfsOpen(msg['docname'])
-            response = json.dumps({"response": requestType, "docname": msg['docname'], "isFile": exists, "address": ADDRESS, "port": PORT})
-        elif requestType == "close":
-            response = json.dumps({"response": requestType, "address": ADDRESS, "port": PORT})
-        elif requestType == "read":
-            data = dfsRead(msg['docname'])
-            response = json.dumps({"response": requestType, "address": ADDRESS, "port": PORT, "data": data})
-        elif requestType == "write":
-            dfsWrite(msg['docname'], msg['data'])
-            response = json.dumps({"response": requestType, "address": ADDRESS, "port": PORT, "uuid": NODEID})
-        else:
-            response = json.dumps({"response": "Error", "error": requestType+" is not a valid request", "address": ADDRESS, "port": PORT})
-
-        self.request.sendall(response.encode())
+        #连接在多次请求之间保持打开，依次处理同一连接上的所有请求，直到客户端关闭连接
+        conn = protocol.Connection(self.request)
+        METRICS.connectionOpened()
+        try:
+            while True:
+                bytesIn = conn.bytesIn
+                msg = conn.recv()
+                if msg is None:
+                    break
+                started = time.perf_counter()
+                bytesOut = conn.bytesOut
+                error = False
+                handler = STREAM_HANDLERS.get(msg['request'])
+                if handler is not None:
+                    handler(conn, msg)
+                else:
+                    response = handleRequest(msg)
+                    error = response.get('response') == "Error"
+                    conn.send(protocol.replyTo(msg, response))
+                METRICS.record(msg['request'], time.perf_counter() - started, conn.bytesIn - bytesIn, conn.bytesOut - bytesOut, error)
+        finally:
+            METRICS.connectionClosed()
 
 
 class FileServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    daemon_threads = True     #长连接的处理线程不阻止服务器进程退出
+    allow_reuse_address = True
+    request_queue_size = 1024     #大量客户端同时建立连接时，避免默认的监听队列长度(5)导致连接请求被丢弃重传
 
 if __name__ == '__main__':
-    address = (ADDRESS, PORT)
-    server = FileServer(address, ThreadedHandler)
-    PORT = server.socket.getsockname()[1]
+    parser = argparse.ArgumentParser(description="myDFS file server")
+    parser.add_argument("--address", default=ADDRESS, help="监听的IP地址")
+    parser.add_argument("--port", type=int, default=PORT, help="监听的端口，0表示由系统分配")
+    parser.add_argument("--master-address", default=MASTER_ADDRESS, help="文件路径服务器的IP地址；有多个分片时为其中任意一个分片，其余分片从其分区表获得")
+    parser.add_argument("--master-port", type=int, default=MASTER_PORT, help="文件路径服务器的端口")
+    parser.add_argument("--bucket", default=BUCKET_PATH, help="文件储存目录，同一台机器上的多个文件服务器应使用不同的目录")
+    parser.add_argument("--lock-address", default=LOCK_ADDRESS, help="锁服务器的IP地址")
+    parser.add_argument("--lock-port", type=int, default=LOCK_PORT, help="锁服务器的端口；指定后接受融合写入：客户端只向文件服务器发送一个请求，由文件服务器检查锁并向路径服务器登记")
+    parser.add_argument("--heartbeat-interval", type=float, default=HEARTBEAT_INTERVAL, help="心跳报文的发送间隔（秒）")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded", help="服务器运行模式：每个连接一个线程，或asyncio事件循环")
+    parser.add_argument("--compression", nargs="*", choices=sorted(protocol.COMPRESSION_FLAGS), default=COMPRESSION_CODECS, help="允许与客户端协商使用的压缩算法，不指定任何算法时不压缩")
+    parser.add_argument("--compression-level", type=int, default=COMPRESSION_LEVEL, help="压缩级别，默认使用各算法的默认级别")
+    parser.add_argument("--compression-threshold", type=int, default=COMPRESSION_THRESHOLD, help="小于该长度（字节）的数据块不压缩")
+    parser.add_argument("--compressed-copies", action="store_true", help="在磁盘上保存文件的压缩副本，完整读取时直接发送副本而不再重复压缩")
+    parser.add_argument("--durability", choices=DURABILITY_MODES, default="none", help="写入的持久化方式：不主动刷盘(none)、每次写入fsync(fsync)，或同一时间窗口内的并发写入由组长一并刷盘(group)")
+    parser.add_argument("--group-commit-window", type=float, default=GROUP_WINDOW, help="--durability group时组提交的时间窗口（秒）")
+    parser.add_argument("--storage", choices=["plain", "chunked"], default="plain", help="存储方式：每个文件保存为一个普通文件，或按内容分块去重保存；同一个bucket应始终使用同一种方式")
+    parser.add_argument("--disk-workers", type=int, default=asyncServer.DISK_WORKERS, help="asyncio模式下执行磁盘I/O的线程数")
+    parser.add_argument("--hot-cache-bytes", type=int, default=HOT_CACHE_BYTES, help="热点文件内存缓存的容量（字节），0表示不缓存")
+    parser.add_argument("--hot-cache-policy", choices=POLICIES, default=HOT_CACHE_POLICY, help="热点文件内存缓存的淘汰策略：最久未读取(lru)或读取次数最少(lfu)")
+    parser.add_argument("--hot-cache-max-file", type=int, default=None, help="放入热点文件内存缓存的单个文件的长度上限（字节），默认为缓存容量的1/4")
+    parser.add_argument("--mmap-threshold", type=int, default=MMAP_THRESHOLD, help="不小于此长度（字节）的文件在热点文件内存缓存中通过mmap映射而不复制到内存")
+    parser.add_argument("--metrics-port", type=int, default=0, help="以Prometheus文本格式提供运行指标的HTTP端口（GET /metrics），0表示不启用")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info", help="日志级别")
+    args = parser.parse_args()
 
-    msg = json.dumps({"request": "dfsjoin", "uuid": NODEID, "address": ADDRESS, "port": PORT})
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((MASTER_ADDRESS, MASTER_PORT))
-    sock.sendall(msg.encode())
-    response = sock.recv(1024)
-    #print(type(response))
-    sock.close()
+    ADDRESS, MASTER_ADDRESS, MASTER_PORT = args.address, args.master_address, args.master_port
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
+    LOCK_ADDRESS, LOCK_PORT = args.lock_address, args.lock_port
+    BUCKET_PATH = os.path.abspath(args.bucket)
+    COMPRESSION_CODECS, COMPRESSION_LEVEL, COMPRESSION_THRESHOLD = args.compression, args.compression_level, args.compression_threshold
+    COMPRESSED_COPIES = args.compressed_copies
+    os.makedirs(BUCKET_PATH, exist_ok=True)
+    DURABILITY = Durability(args.durability, args.group_commit_window)
+    METRICS.gauge("durability_syncs", lambda: DURABILITY.stats()['syncs'])
+    METRICS.gauge("durability_flushes", lambda: DURABILITY.stats()['flushes'])
+    if args.storage == "chunked":
+        CHUNK_STORE = ChunkStore(BUCKET_PATH, DURABILITY)
+        METRICS.gauge("stored_bytes", lambda: CHUNK_STORE.stats()['storedBytes'])
+        METRICS.gauge("logical_bytes", lambda: CHUNK_STORE.stats()['logicalBytes'])
+    if args.hot_cache_bytes > 0:
+        HOT_CACHE = HotCache(args.hot_cache_bytes, args.hot_cache_policy, args.hot_cache_max_file, args.mmap_threshold)
+        for name, key in (("hits", "hits"), ("misses", "misses"), ("hit_rate", "hitRate"), ("evictions", "evictions"), ("files", "files"), ("bytes", "bytes")):
+            METRICS.gauge("hot_cache_" + name, lambda key=key: HOT_CACHE.stats()[key])
+    METRICS.gauge("queue_depth", lambda: LOAD.active)
+    METRICS.gauge("free_bytes", lambda: shutil.disk_usage(BUCKET_PATH).free)
 
-    data = json.loads(str(response))
-    NODEID = data['uuid']
+    address = (ADDRESS, args.port)
+    if args.mode == "asyncio":
+        server = asyncServer.AsyncServer(address, handleRequest, ASYNC_STREAM_HANDLERS, args.disk_workers, METRICS)
+    else:
+        server = FileServer(address, ThreadedHandler)
+    PORT = server.socket.getsockname()[1]
+
+    joinDirectory()
+    threading.Thread(target=heartbeatWorker, daemon=True).start()
+    if args.metrics_port:
+        metrics.serveHttp(METRICS, ADDRESS, args.metrics_port)
 
-    print("File Server " + NODEID + " is listening on " + ADDRESS + ":" + str(PORT))
+    print("File Server " + NODEID + " is listening on " + ADDRESS + ":" + str(PORT) + " (" + args.mode + ")", flush=True)
 
-    server.serve_forever()
\ No newline at end of file
+    server.serve_forever()
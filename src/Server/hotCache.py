@@ -0,0 +1,145 @@
+import mmap
+import threading
+from collections import OrderedDict
+
+#文件服务器的热点文件内存缓存
+#-- 被读取的文件内容保存在内存中，之后对同一文件的读取直接从内存发送，不再打开文件或读取磁盘
+#-- 较大的普通文件（不小于MMAP_THRESHOLD）通过mmap映射而不复制到进程内存中，其内容由操作系统的页缓存保存；
+#-- 映射在淘汰后不显式关闭，正在发送其中数据的请求结束、最后一个引用释放时自动解除映射
+#-- 缓存的总字节数不超过给定的上限，超出时按淘汰策略淘汰：lru淘汰最久未被读取的文件，lfu淘汰被读取次数最少的文件（次数相同时淘汰最久未被读取的）
+#-- 文件被写入或删除时调用invalidate删除其缓存项，并增加其版本号；读取过程中文件被修改时，按旧版本读到的内容不会被放入缓存
+
+MMAP_THRESHOLD = 1024 * 1024         #不小于此长度的普通文件通过mmap映射
+POLICIES = ("lru", "lfu")
+
+
+class HotCache():
+    '''
+    : 有容量上限的热点文件内存缓存，并统计命中、未命中和淘汰次数
+    '''
+    def __init__(self, maxBytes, policy="lru", maxFileBytes=None, mmapThreshold=MMAP_THRESHOLD):
+        '''
+        : maxBytes: int,缓存容量（字节）
+        : policy: str,淘汰策略，lru或lfu
+        : maxFileBytes: int,单个文件的长度上限，更大的文件不缓存；为None时为容量的1/4
+        : mmapThreshold: int,不小于此长度的普通文件通过mmap映射
+        '''
+        if policy not in POLICIES:
+            raise ValueError("非法的淘汰策略: " + str(policy))
+        self.maxBytes = maxBytes
+        self.policy = policy
+        self.maxFileBytes = maxBytes // 4 if maxFileBytes is None else maxFileBytes
+        self.mmapThreshold = mmapThreshold
+        self.lock = threading.Lock()
+
+        self.entries = OrderedDict()     #文件名 -> [内容(bytes/mmap), 被读取次数]，按最近读取顺序排列（末尾为最近读取）
+        self.bytes = 0
+        self.versions = {}               #文件名 -> 版本号，文件每次被修改时增加
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.insertions = 0
+        self.rejected = 0                #读取期间文件被修改，没有放入缓存的次数
+
+    def get(self, docname):
+        '''
+        : 从缓存中读取文件内容
+        : docname: str,文件名
+        : return -> bytes/mmap,文件内容；不在缓存中时返回None
+        '''
+        with self.lock:
+            entry = self.entries.get(docname)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(docname)
+            entry[1] += 1
+            self.hits += 1
+            return entry[0]
+
+    def version(self, docname):
+        '''
+        : 返回文件当前的版本号，在读取文件内容之前调用，随后传给put
+        '''
+        with self.lock:
+            return self.versions.get(docname, 0)
+
+    def admits(self, size):
+        return 0 < size <= self.maxFileBytes
+
+    def load(self, file_handle, size, readBlock, mappable):
+        '''
+        : 读取dfsRead打开的文件的完整内容
+        : file_handle: dfsRead返回的文件对象
+        : size: int,文件总长度
+        : readBlock: 函数readBlock(file_handle, offset, size) -> bytes
+        : mappable: bool,文件是否为可以mmap的普通文件
+        : return -> bytes/mmap
+        '''
+        if mappable and size >= self.mmapThreshold:
+            return mmap.mmap(file_handle.fileno(), size, access=mmap.ACCESS_READ)
+        return readBlock(file_handle, 0, size)
+
+    def put(self, docname, content, version):
+        '''
+        : 将文件内容放入缓存
+        : docname: str,文件名
+        : content: bytes/mmap,文件内容
+        : version: int,读取之前由version()获得的版本号；文件在此期间被修改时不放入缓存
+        : return -> bool,是否放入了缓存
+        '''
+        with self.lock:
+            if self.versions.get(docname, 0) != version:
+                self.rejected += 1
+                return False
+            self._remove(docname)
+            if not self.admits(len(content)):
+                return False
+            self.entries[docname] = [content, 1]
+            self.bytes += len(content)
+            self.insertions += 1
+            while self.bytes > self.maxBytes:
+                self._evict()
+            return True
+
+    def invalidate(self, docname):
+        '''
+        : 文件被写入或删除时调用：删除其缓存项，并使正在读取的旧内容不能再放入缓存
+        '''
+        with self.lock:
+            self.versions[docname] = self.versions.get(docname, 0) + 1
+            self._remove(docname)
+
+    def stats(self):
+        '''
+        : 返回缓存的统计信息
+        : return -> dict
+        '''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "policy": self.policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "insertions": self.insertions,
+                "rejected": self.rejected,
+                "files": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+    def _evict(self):
+        if self.policy == "lfu":
+            #按最近读取顺序扫描，次数相同时保留先遇到的（最久未被读取的）文件
+            victim = min(self.entries, key=lambda docname: self.entries[docname][1])
+        else:
+            victim = next(iter(self.entries))
+        self._remove(victim)
+        self.evictions += 1
+
+    def _remove(self, docname):
+        entry = self.entries.pop(docname, None)
+        if entry is not None:
+            self.bytes -= len(entry[0])
@@ -1,59 +1,392 @@
 import socketserver
-import json
 import os
 import sys
+import argparse
 import uuid
 import random
 import time
+import heapq
+import itertools
+import threading
+import asyncio
+import logging
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Common import protocol
+from Common import asyncServer
+from Common import metrics
 
 ADDRESS = "127.0.0.1"
 PORT = 8888
 
 LOCK_TIMEOUT = 30
+LOCK_SHARDS = 64       #锁表的分片数
+
+SHARED = "shared"          #共享锁（读锁）：同一范围上可以同时存在多个客户端的共享锁
+EXCLUSIVE = "exclusive"    #排他锁（写锁）：与同一范围上其他客户端的任何锁都冲突
+
+#锁表
+#-- 锁表按文件名的哈希值分为LOCK_SHARDS个分片（LockShard），每个分片有自己的互斥锁，不同分片上的文件的加锁请求互不等待
+#-- 一个文件上可以同时有多把锁，每把锁有模式（共享/排他）和字节范围（offset, length），length为-1表示到文件末尾；
+#-- 不指定范围的锁覆盖整个文件。不同客户端的两把锁只有在范围重叠且至少一把为排他锁时才冲突
+#
+#锁的到期和等待
+#-- 每个分片的锁和等待者的到期时间保存在分片的最小堆中，后台线程expiryWorker在所有分片中最早的到期时间醒来，主动释放到期的锁
+#-- 带有wait字段的obtainlock请求在与已有的锁冲突时不立即返回locked，而是进入该文件的先进先出等待队列；
+#-- 锁被释放或到期时，按队列顺序授予与已有的锁以及排在前面的等待者都不冲突的请求，并发送lockgranted响应；等待超过wait秒仍未获得锁时发送locked响应
+#-- 新的加锁请求与排队中的等待者冲突时同样需要排队，避免排他锁的请求被源源不断的共享锁请求饿死
+#-- 堆中的表项不会在锁被释放或续期时删除，而是在出堆时检查其是否仍在锁表中，已经失效的表项直接丢弃
+
+
+class LockShard():
+    '''
+    : 锁表的一个分片
+    '''
+    def __init__(self):
+        self.mutex = threading.Lock()    #保护本分片的locks/waitQueues/expiryHeap
+        self.locks = {}                  #文件名 -> list,该文件上的锁
+        self.waitQueues = {}             #文件名 -> deque,等待该文件上的锁的请求
+        self.expiryHeap = []             #(到期时间, 序号, 文件名, 锁或等待者)
+
+
+LOCK_TABLE = [LockShard() for i in range(LOCK_SHARDS)]
+LOCK_IDS = itertools.count(1)
+
+EXPIRY_CONDITION = threading.Condition()   #出现比expiryWorker计划的唤醒时间更早的到期时间时唤醒expiryWorker
+EXPIRY_SEQUENCE = itertools.count()        #堆中到期时间相同时按加入顺序比较
+NEXT_WAKEUP = float("inf")                 #expiryWorker计划的下一次唤醒时间；其正在扫描各分片时为inf，使新的到期时间总能唤醒它
+
+METRICS = metrics.Metrics("lock")          #按请求类型统计的请求数、延迟和收发字节数，另有等待锁的时间（lock_wait），通过stats请求或--metrics-port读取
+LOG = logging.getLogger("lock")
 
-LOCK_LIST = {}     #加锁文件表：加锁文件的"文件名-客户ID"键值对表
+def shardFor(docname):
+    '''
+    : 返回文件所属的锁表分片
+    : docname: 文件名
+    '''
+    return LOCK_TABLE[hash(docname) % len(LOCK_TABLE)]
+
+def lockRequest(msg):
+    '''
+    : 从请求报文中提取锁的客户ID、模式和范围，未指定时为整个文件上的排他锁
+    : msg: dict,请求报文
+    : return -> dict
+    '''
+    mode = msg.get('mode') or EXCLUSIVE
+    if mode not in (SHARED, EXCLUSIVE):
+        raise ValueError("非法的锁模式: " + str(mode))
+    offset = msg.get('offset')
+    length = msg.get('length')
+    return {
+        "clientid": msg['clientid'],
+        "mode": mode,
+        "offset": 0 if offset is None else offset,
+        "length": -1 if length is None else length
+    }
 
-def lockExistsTest(docname):
+def rangesOverlap(a, b):
+    '''
+    : 判断两把锁的字节范围是否重叠
+    '''
+    aEnd = float("inf") if a['length'] < 0 else a['offset'] + a['length']
+    bEnd = float("inf") if b['length'] < 0 else b['offset'] + b['length']
+    return a['offset'] < bEnd and b['offset'] < aEnd
+
+def conflicts(a, b):
+    '''
+    : 判断两把锁（或加锁请求）是否冲突：属于不同客户端、范围重叠且至少一把为排他锁
+    '''
+    return a['clientid'] != b['clientid'] and (a['mode'] == EXCLUSIVE or b['mode'] == EXCLUSIVE) and rangesOverlap(a, b)
+
+def findConflict(entries, request):
+    '''
+    : 返回entries中第一个与request冲突的锁或等待者；没有冲突时返回None
+    '''
+    for entry in entries:
+        if not entry.get('done') and conflicts(entry, request):
+            return entry
+    return None
+
+def lockExistsTest(shard, docname):
     '''
     : 判断给定文件名的文件是否存在锁
+    : shard: LockShard,文件所属的锁表分片
     : docname: 文件名
     '''
-    #1. 判断加锁文件表中是否含有该文件名，含有即代表该文件上有锁，否则该文件上无锁
-    if docname in LOCK_LIST:
+    #1. 判断分片的锁表中是否含有该文件名，含有即代表该文件上有锁，否则该文件上无锁
+    if docname in shard.locks:
         return True
     else:
         return False
 
-def getLockClient(docname):
+def getLocks(shard, docname):
     '''
-    : 返回给定文件名的文件的锁信息（即加锁的客户ID）
+    : 返回给定文件名的文件上的所有锁
+    : shard: LockShard,文件所属的锁表分片
     : docname: 文件名
     '''
-    #1. 检查该文件是否含有锁
-    if lockExistsTest(docname):
-        return LOCK_LIST[docname]
-    #2. 若该文件不含有锁，则返回None；否则，返回正在占用（即给文件加锁）的客户ID
-    else:
-        return None
+    return shard.locks.get(docname, [])
 
-def addLock(docname, clientid, timestamp, timeout):
+def addLock(shard, docname, request, timestamp, timeout):
     '''
-    : 为特定用户给指定文件加锁
+    : 为特定用户给指定文件加锁；调用者须持有shard.mutex
+    : shard: LockShard,文件所属的锁表分片
     : docname: 文件名
-    : clientid: 客户ID
+    : request: dict,锁的客户ID、模式和范围
     : timestamp: 时间戳
     : timeout: 加锁最长时限（防止死锁）
+    : return -> dict,新加的锁
     '''
-    #1. 在加锁文件表中添加该文件的锁，以及锁的具体信息
-    LOCK_LIST[docname] = {"clientid": clientid, "timestamp": timestamp, "timeout": timeout}
+    #1. 在锁表中添加该文件的锁，以及锁的具体信息
+    lock = {"lockid": next(LOCK_IDS), "clientid": request['clientid'], "mode": request['mode'],
+            "offset": request['offset'], "length": request['length'], "timestamp": timestamp, "timeout": timeout}
+    shard.locks.setdefault(docname, []).append(lock)
+    #2. 将锁的到期时间加入到期堆
+    scheduleExpiry(shard, timestamp + timeout, docname, lock)
+    return lock
 
-def delLock(docname):
+def delLock(shard, docname, lock):
     '''
-    : 为给指定文件名的文件解锁
+    : 删除指定文件上的一把锁；调用者须持有shard.mutex
+    : shard: LockShard,文件所属的锁表分片
     : docname: 文件名
+    : lock: dict,要删除的锁
     '''
-    #1. 在加锁文件表中删除相关锁的记录以完成解锁
-    del LOCK_LIST[docname]
+    #1. 在锁表中删除相关锁的记录以完成解锁
+    locks = shard.locks[docname]
+    locks.remove(lock)
+    if not locks:
+        del shard.locks[docname]
+
+def scheduleExpiry(shard, deadline, docname, entry):
+    '''
+    : 将锁或等待者的到期时间加入分片的到期堆；调用者须持有shard.mutex
+    : deadline: float,到期时间
+    : docname: str,文件名
+    : entry: dict,锁或等待者
+    '''
+    heapq.heappush(shard.expiryHeap, (deadline, next(EXPIRY_SEQUENCE), docname, entry))
+    if deadline < NEXT_WAKEUP:
+        with EXPIRY_CONDITION:
+            EXPIRY_CONDITION.notify()
+
+def grantResponse(docname, lock, response="lockgranted"):
+    return {
+        "response": response,
+        "docname": docname,
+        "clientid": lock['clientid'],
+        "lockid": lock['lockid'],
+        "mode": lock['mode'],
+        "offset": lock['offset'],
+        "length": lock['length'],
+        "timestamp": lock['timestamp'],
+        "timeout": lock['timeout']
+    }
+
+def lockedResponse(docname, lock):
+    response = {
+        "response": "locked",
+        "docname": docname,
+        "mode": lock['mode'],
+        "offset": lock['offset'],
+        "length": lock['length']
+    }
+    if 'timestamp' in lock:
+        response['timestamp'] = lock['timestamp']
+        response['timeout'] = lock['timeout']
+    return response
+
+def grantWaiters(shard, docname):
+    '''
+    : 按队列顺序授予该文件上可以授予的等待者：与已有的锁以及排在前面仍在等待的请求都不冲突；调用者须持有shard.mutex
+    : shard: LockShard,文件所属的锁表分片
+    : docname: str,文件名
+    : return -> list,需要在释放shard.mutex之后发送的(回复函数, 响应报文)
+    '''
+    queue = shard.waitQueues.get(docname)
+    if not queue:
+        return []
+    replies = []
+    waiting = deque()
+    for waiter in queue:
+        if waiter['done']:
+            continue
+        if findConflict(getLocks(shard, docname), waiter) is None and findConflict(waiting, waiter) is None:
+            waiter['done'] = True
+            METRICS.observe("lock_wait", time.monotonic() - waiter['queued'])
+            lock = addLock(shard, docname, waiter, time.time(), LOCK_TIMEOUT)
+            replies.append((waiter['reply'], grantResponse(docname, lock)))
+        else:
+            waiting.append(waiter)
+    if waiting:
+        shard.waitQueues[docname] = waiting
+    else:
+        del shard.waitQueues[docname]
+    return replies
+
+def expireDue(shard, now):
+    '''
+    : 处理分片的到期堆中所有已经到期的表项：释放到期的锁，向等待超时的请求发送locked响应，然后重新检查相关文件的等待队列；调用者须持有shard.mutex
+    : shard: LockShard,锁表分片
+    : now: float,当前时间
+    : return -> list,需要在释放shard.mutex之后发送的(回复函数, 响应报文)
+    '''
+    replies = []
+    changed = set()
+    heap = shard.expiryHeap
+    while heap and heap[0][0] <= now:
+        deadline, seq, docname, entry = heapq.heappop(heap)
+        if 'reply' in entry:
+            #等待者等待超时
+            if not entry['done']:
+                entry['done'] = True
+                METRICS.increment("lock_wait_timeouts")
+                conflict = findConflict(getLocks(shard, docname), entry)
+                response = lockedResponse(docname, conflict) if conflict is not None else {"response": "unlocked", "docname": docname}
+                replies.append((entry['reply'], dict(response, waited=True)))
+                changed.add(docname)
+        elif any(lock is entry for lock in getLocks(shard, docname)):
+            #锁到期；已被释放或续期的锁不在锁表中，其堆表项直接丢弃
+            LOG.info("Lock on %s has timed out", docname)
+            METRICS.increment("lock_expirations")
+            delLock(shard, docname, entry)
+            changed.add(docname)
+    for docname in changed:
+        replies.extend(grantWaiters(shard, docname))
+    return replies
+
+def sendReplies(replies):
+    for reply, response in replies:
+        try:
+            reply(response)
+        except (OSError, RuntimeError):
+            pass        #等待者的连接已经关闭
+
+def expiryWorker():
+    '''
+    : 后台到期线程：睡眠到所有分片中最早的到期时间，然后释放到期的锁并唤醒等待者
+    '''
+    global NEXT_WAKEUP
+    while True:
+        with EXPIRY_CONDITION:
+            NEXT_WAKEUP = float("inf")
+            earliest = float("inf")
+            for shard in LOCK_TABLE:
+                try:
+                    earliest = min(earliest, shard.expiryHeap[0][0])
+                except IndexError:
+                    pass
+            NEXT_WAKEUP = earliest
+            delay = earliest - time.time()
+            if delay > 0:
+                EXPIRY_CONDITION.wait(None if earliest == float("inf") else delay)
+
+        now = time.time()
+        for shard in LOCK_TABLE:
+            if shard.expiryHeap and shard.expiryHeap[0][0] <= now:
+                with shard.mutex:
+                    replies = expireDue(shard, now)
+                sendReplies(replies)
+
+def handleRequest(msg, reply=None):
+    '''
+    : 处理一个请求报文
+    : msg: dict,请求报文
+    : reply: 可选函数reply(response)，用于在稍后（例如等待的锁被授予时）发送响应；
+    :        为None时带有wait字段的obtainlock请求不会等待，而是立即返回locked
+    : return -> dict,响应报文；请求进入等待队列时返回None，响应随后通过reply发送
+    '''
+    requestType = msg['request']
+
+    LOG.debug("%s %s", requestType, msg.get('docname'))
+
+    if requestType == "stats":
+        return metrics.statsResponse(METRICS, msg)
+    if requestType not in ("checklock", "obtainlock", "releaselock"):
+        return {"response": "Error", "error": requestType+" is not a valid request"}
+
+    try:
+        request = lockRequest(msg)
+    except ValueError as e:
+        return {"response": "Error", "error": str(e)}
+
+    shard = shardFor(msg['docname'])
+    with shard.mutex:
+        #到期线程被唤醒之前，先处理本分片已经到期的锁，使本次请求看到的锁状态总是最新的
+        replies = expireDue(shard, time.time())
+        response = handleLockRequest(shard, msg, request, reply, replies)
+    sendReplies(replies)
+    return response
+
+def handleLockRequest(shard, msg, request, reply, replies):
+    '''
+    : 在持有shard.mutex时处理请求报文；需要发送给其他等待者的响应加入replies，由handleRequest在释放shard.mutex之后发送
+    '''
+    requestType = msg['request']
+    docname = msg['docname']
+    response = {}
+
+    if requestType == "checklock":
+        conflict = findConflict(getLocks(shard, docname), request)
+        if conflict is not None:
+            LOG.debug("Check lock -> locked")
+            response = lockedResponse(docname, conflict)
+        else:
+            owned = [lock for lock in getLocks(shard, docname) if lock['clientid'] == request['clientid'] and rangesOverlap(lock, request)]
+            if owned:
+                LOG.debug("Check lock -> lockowned")
+                response = grantResponse(docname, owned[0], "lockowned")
+            else:
+                response = {
+                    "response": "unlocked"
+                }
+
+    elif requestType == "obtainlock":
+        locks = getLocks(shard, docname)
+        same = [lock for lock in locks if all(lock[key] == request[key] for key in request)]
+        conflict = findConflict(locks, request) or findConflict(shard.waitQueues.get(docname, ()), request)
+
+        if same:
+            #锁的持有者再次请求同一把锁时为其续期
+            LOG.debug("Obtain lock -> lockowned, renewed")
+            delLock(shard, docname, same[0])
+            lock = addLock(shard, docname, request, time.time(), LOCK_TIMEOUT)
+            response = grantResponse(docname, lock, "lockregranted")
+        elif conflict is None:
+            LOG.debug("Obtain lock -> lock granted")
+            lock = addLock(shard, docname, request, time.time(), LOCK_TIMEOUT)
+            response = grantResponse(docname, lock)
+        elif msg.get('wait') and reply is not None:
+            #阻塞模式：进入该文件的等待队列，锁被释放或到期时由grantWaiters授予
+            LOG.debug("Obtain lock -> waiting")
+            waiter = dict(request, reply=reply, done=False, queued=time.monotonic())
+            shard.waitQueues.setdefault(docname, deque()).append(waiter)
+            scheduleExpiry(shard, time.time() + msg['wait'], docname, waiter)
+            response = None
+        else:
+            LOG.debug("Obtain lock -> locked already")
+            response = lockedResponse(docname, conflict)
+
+    elif requestType == "releaselock":
+        #指定lockid时只释放该锁，否则释放该客户端在指定范围（默认为整个文件）上的所有锁
+        mine = [lock for lock in getLocks(shard, docname) if lock['clientid'] == request['clientid']]
+        if 'lockid' in msg:
+            released = [lock for lock in mine if lock['lockid'] == msg['lockid']]
+        else:
+            released = [lock for lock in mine if rangesOverlap(lock, request)]
+        for lock in released:
+            delLock(shard, docname, lock)
+        if released:
+            LOG.debug("Release lock -> unlocked")
+            replies.extend(grantWaiters(shard, docname))
+            response = {"response": "unlocked", "docname": docname, "released": len(released)}
+        else:
+            others = [lock for lock in getLocks(shard, docname) if lock['clientid'] != request['clientid']]
+            response = lockedResponse(docname, others[0]) if others else {"response": "unlocked", "docname": docname, "released": 0}
+
+    return response
+
 
 class ThreadedHandler(socketserver.BaseRequestHandler):
     '''
@@ -62,116 +395,87 @@ class ThreadedHandler(socketserver.BaseRequestHandler):
     : 需要特别注意，锁控制服务是由客户端进行的
     '''
     def handle(self):
-        msg = self.request.recv(1024)
-
-        msg = json.loads(msg)
-        requestType = msg['request']
-
-        print("Request type = " + requestType)
-
-        response = ""
-
-        if requestType == "checklock":
-            if lockExistsTest(msg['docname']):
-                print("Check lock -> lock exists")
-                timestamp = time.time()
-                fs = getLockClient(msg['docname'])
-
-
-                if fs['timestamp']+fs['timeout'] < timestamp:
-                    print("Lock has timed out")
-                    print(fs['timestamp']+fs['timeout'])
-                    print(timestamp)
-
-                    delLock(msg['docname'])
-                    response = json.dumps({
-                        "response": "unlocked"
-                    })
-
-                elif msg['clientid'] == fs['clientid']:
-                    print("Check lock -> lockowned")
-                    response = json.dumps({
-                        "response": "lockowned",
-                        "docname": msg['docname'],
-                        "timestamp": fs['timestamp'],
-                        "timeout": fs['timeout']
-                    })
-
-                else:
-                    print("Check lock -> locked")
-                    response = json.dumps({
-                        "response": "locked",
-                        "docname": msg['docname'],
-                        "timestamp": fs['timestamp'],
-                        "timeout": fs['timeout']
-                    })
-            else:
-                response = json.dumps({
-                    "response": "unlocked"
-                })
-
-        elif requestType == "obtainlock":
-            if lockExistsTest(msg['docname']):
-                print("Obtain lock -> lock exists")
-
-                fs = getLockClient(msg['docname'])
-                timestamp = time.time()
-
-                if fs['timestamp']+fs['timeout'] < timestamp:
-                    print("Obtain lock -> lock timed out, obtain again")
-
-                    print(fs['timestamp']+fs['timeout'])
-                    print(timestamp)
-
-                    delLock(msg['docname'])
-                    addLock(msg['docname'], msg['clientid'], timestamp, LOCK_TIMEOUT)
-
-                    response = json.dumps({
-                        "response": "lockgranted",
-                        "docname": msg['docname'],
-                        "timestamp": fs['timestamp'],
-                        "timeout": fs['timeout']
-                    })
-
-                elif msg['clientid'] == fs['clientid']:
-                    print("Check lock -> lockowned")
-                    timestamp = time.time()
-                    response = json.dumps({
-                        "response": "lockregranted",
-                        "docname": msg['docname'],
-                        "timestamp": timestamp,
-                        "timeout": LOCK_TIMEOUT
-                    })
-                else:
-                    print("Obtain lock -> locked already")
-                    response = json.dumps({
-                        "response": "locked",
-                        "docname": msg['docname'],
-                        "timestamp": fs['timestamp'],
-                        "timeout": fs['timeout']
-                    })
-            else:
-                print("Obtain lock -> lock granted")
-                timestamp = time.time()
-                addLock(msg['docname'], msg['clientid'], timestamp, LOCK_TIMEOUT)
-
-                response = json.dumps({
-                    "response": "lockgranted",
-                    "docname": msg['docname'],
-                    "clientid": msg['clientid'],
-                    "timestamp": timestamp,
-                    "timeout": LOCK_TIMEOUT
-                })
-        else:
-            response = json.dumps({"response": "Error", "error": requestType+" is not a valid request"})
+        #连接在多次请求之间保持打开，依次处理同一连接上的所有请求，直到客户端关闭连接
+        #等待中的obtainlock请求的响应由其他线程（释放锁的请求或到期线程）发送，因此发送时需要加锁，避免与本线程的响应交错
+        conn = protocol.Connection(self.request)
+        sendLock = threading.Lock()
+
+        def replier(msg):
+            def reply(response):
+                with sendLock:
+                    conn.send(protocol.replyTo(msg, response))
+            return reply
+
+        METRICS.connectionOpened()
+        try:
+            while True:
+                bytesIn = conn.bytesIn
+                msg = conn.recv()
+                if msg is None:
+                    break
+                started = time.perf_counter()
+                bytesOut = conn.bytesOut
+                reply = replier(msg)
+                response = handleRequest(msg, reply)
+                if response is not None:
+                    reply(response)
+                METRICS.record(msg['request'], time.perf_counter() - started, conn.bytesIn - bytesIn, conn.bytesOut - bytesOut,
+                               response is not None and response.get('response') == "Error")
+        finally:
+            METRICS.connectionClosed()
 
-        self.request.sendall(response.encode())
+
+async def asyncObtainLock(conn, msg):
+    '''
+    : 事件循环模式下的obtainlock报文处理：等待中的请求不阻塞事件循环，锁被授予时由其他线程通过call_soon_threadsafe发送响应
+    : conn: asyncServer.AsyncConnection,客户端连接
+    : msg: dict,请求报文
+    '''
+    loop = asyncio.get_running_loop()
+
+    def reply(response):
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(conn.send(protocol.replyTo(msg, response))))
+
+    response = handleRequest(msg, reply)
+    if response is not None:
+        await conn.send(protocol.replyTo(msg, response))
+
+ASYNC_STREAM_HANDLERS = {"obtainlock": asyncObtainLock}
 
 
 class LockingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    pass
+    daemon_threads = True     #长连接的处理线程不阻止服务器进程退出
+    allow_reuse_address = True
+    request_queue_size = 1024     #大量客户端同时建立连接时，避免默认的监听队列长度(5)导致连接请求被丢弃重传
 
 if __name__ == '__main__':
-    address = (ADDRESS, PORT)
-    server = LockingServer(address, ThreadedHandler)
-    server.serve_forever()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="myDFS locking server")
+    parser.add_argument("--address", default=ADDRESS, help="监听的IP地址")
+    parser.add_argument("--port", type=int, default=PORT, help="监听的端口，0表示由系统分配")
+    parser.add_argument("--lock-timeout", type=int, default=LOCK_TIMEOUT, help="锁的租期（秒），到期后自动释放")
+    parser.add_argument("--lock-shards", type=int, default=LOCK_SHARDS, help="锁表的分片数，1表示所有文件共用一个互斥锁")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded", help="服务器运行模式：每个连接一个线程，或asyncio事件循环")
+    parser.add_argument("--metrics-port", type=int, default=0, help="以Prometheus文本格式提供运行指标的HTTP端口（GET /metrics），0表示不启用")
+    parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info", help="日志级别")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    LOCK_TIMEOUT = args.lock_timeout
+    LOCK_TABLE = [LockShard() for i in range(max(args.lock_shards, 1))]
+    METRICS.gauge("locks", lambda: sum(len(locks) for shard in LOCK_TABLE for locks in list(shard.locks.values())))
+    METRICS.gauge("waiting", lambda: sum(len(queue) for shard in LOCK_TABLE for queue in list(shard.waitQueues.values())))
+
+    address = (args.address, args.port)
+    if args.mode == "asyncio":
+        server = asyncServer.AsyncServer(address, handleRequest, ASYNC_STREAM_HANDLERS, metrics=METRICS)
+    else:
+        server = LockingServer(address, ThreadedHandler)
+    threading.Thread(target=expiryWorker, daemon=True).start()
+
+    ADDRESS, PORT = server.socket.getsockname()[:2]
+    if args.metrics_port:
+        metrics.serveHttp(METRICS, args.address, args.metrics_port)
+    print("Locking Server is listening on " + ADDRESS + ":" + str(PORT) + " (" + args.mode + ")", flush=True)
+
+    server.serve_forever()
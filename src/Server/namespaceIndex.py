@@ -0,0 +1,75 @@
+import bisect
+
+#路径服务器的有序文件名索引，提供按目录列出文件的功能
+#-- 文件名中的"/"作为目录分隔符；目录不单独保存，由其下的文件隐含存在（与对象存储按前缀和分隔符列出对象的方式相同）
+#-- 全部文件名保存在一个升序列表中，同一前缀下的文件名在列表中连续排列，用二分查找定位前缀的起点；
+#-- 非递归列出时遇到子目录只输出一次子目录名，再用二分查找直接跳过该子目录下的全部文件，
+#-- 因此一页的代价为O(返回的项数 * log N)，与命名空间的总大小无关
+#-- 分页游标为上一页最后一项的名称，下一页从严格大于它的位置继续；翻页期间插入或删除其他文件不会使未被修改的项重复或遗漏
+
+SEPARATOR = "/"
+AFTER_SEPARATOR = chr(ord(SEPARATOR) + 1)     #以"dir/"开头的名称都小于"dir0"，"dir0"之后不再有以"dir/"开头的名称
+
+
+class NamespaceIndex():
+    '''
+    : 有序的文件名索引
+    '''
+    def __init__(self, names=()):
+        '''
+        : names: 可迭代对象,初始的文件名
+        '''
+        self.names = sorted(set(names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name):
+        index = bisect.bisect_left(self.names, name)
+        if index == len(self.names) or self.names[index] != name:
+            self.names.insert(index, name)
+
+    def remove(self, name):
+        index = bisect.bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            del self.names[index]
+
+    def hasPrefix(self, prefix):
+        '''
+        : 判断是否有以prefix开头的文件名，用于判断目录是否存在
+        '''
+        index = bisect.bisect_left(self.names, prefix)
+        return index < len(self.names) and self.names[index].startswith(prefix)
+
+    def list(self, prefix="", cursor=None, limit=1000, recursive=False):
+        '''
+        : 列出以prefix开头的名称
+        : prefix: str,名称前缀，列出目录时应以"/"结尾
+        : cursor: str,上一页返回的游标，为None时从第一项开始
+        : limit: int,本页最多返回的项数
+        : recursive: bool,为False时只列出prefix之后不再含有"/"的文件名，以及各个直接子目录（以"/"结尾，每个只出现一次）；为True时列出全部文件名
+        : return -> (list,[(名称, 是否为目录)]，按名称升序, str,下一页的游标；没有更多项时为None)
+        '''
+        names = self.names
+        index = bisect.bisect_left(names, prefix)
+        if cursor is not None and cursor >= prefix:
+            if cursor.endswith(SEPARATOR) and not recursive:
+                index = max(index, bisect.bisect_left(names, cursor[:-1] + AFTER_SEPARATOR))    #游标为子目录时跳过其下的全部文件
+            else:
+                index = max(index, bisect.bisect_right(names, cursor))
+
+        entries = []
+        while index < len(names) and len(entries) < limit:
+            name = names[index]
+            if not name.startswith(prefix):
+                break
+            slash = -1 if recursive else name.find(SEPARATOR, len(prefix))
+            if slash < 0:
+                entries.append((name, False))
+                index += 1
+            else:
+                entries.append((name[:slash + 1], True))
+                index = bisect.bisect_left(names, name[:slash] + AFTER_SEPARATOR, index)
+
+        more = index < len(names) and names[index].startswith(prefix)
+        return entries, entries[-1][0] if more and entries else None
@@ -2,10 +2,10 @@
 
 echo "Hello World!"
 
-gnome-terminal -e "bash -c python\ Server/directoryServer.py;bash"
+gnome-terminal -e "bash -c python\ Server/directoryServer.py\ --replicas\ 2;bash"
 
-gnome-terminal -e "bash -c python\ Server/fileServer.py;bash"
-gnome-terminal -e "bash -c python\ Server/fileServer.py;bash"
+gnome-terminal -e "bash -c python\ Server/fileServer.py\ --bucket\ FileServerBucket;bash"
+gnome-terminal -e "bash -c python\ Server/fileServer.py\ --bucket\ FileServerBucket2;bash"
 
 gnome-terminal -e "bash -c python\ Server/lockingServer.py;bash"
 